@@ -1,8 +1,14 @@
 import logging
 import json
 import os
+import queue
+import tempfile
+import threading
+import time
 from argparse import ArgumentParser
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import sha256
+from urllib.parse import urlparse
 
 from google.cloud.exceptions import Forbidden
 from google.cloud.pubsub_v1 import PublisherClient
@@ -13,6 +19,12 @@ from google.oauth2 import service_account
 # When deployed as a Cloud Function, the entry point would be cloudFunctionMain.
 
 from requests import Session
+from requests.adapters import HTTPAdapter
+
+from api.httpCache import CachingSession, HttpCache
+from api.rateLimiter import RateLimitedSession, RateLimiter
+from api.seenSet import SeenSet
+from common import serialization
 
 logging.basicConfig(
   format='%(asctime)s.%(msecs)03dZ,%(pathname)s:%(lineno)d,%(levelname)s,%(module)s,%(funcName)s: %(message)s',
@@ -20,6 +32,18 @@ logging.basicConfig(
 _logger=logging.getLogger(__name__)
 
 _expectedFieldsInFunctionCall=[]  # Fields to send as parameters to the REST API.
+defaultMaxWorkers=16 # Number of requests callAPIBatch sends at the same time.
+defaultMaxPerHost=4 # Number of requests callAPIBatch sends to the same host at the same time.
+defaultTimeout=(10.0, 60.0) # Seconds to wait to connect to and to read from an API.
+defaultSinkWorkers=4 # Number of threads a DataProcessor writes and publishes with.
+defaultSinkQueueSize=64 # Number of writes/publishes a DataProcessor queues before process blocks.
+defaultRateLimit=10.0 # Most requests per second sent to a host; lowered while the host throttles them.
+defaultTries=4 # Number of times a throttled or failed request is sent.
+defaultChunkSize=1024*1024 # Bytes read from a response at a time when passing it through to storage.
+defaultSpoolBytes=8*1024*1024 # Bytes of a passed-through response kept in memory before spilling to a temporary file.
+defaultUploadChunkSize=8*1024*1024 # Bytes sent per request of a resumable upload (a multiple of 256KB.)
+defaultCacheTTL=300 # Seconds during which callAPI serves a cached response without revalidating it.
+defaultCacheMaxBytes=100*1024*1024 # Size of the responses callAPI keeps in its cache.
 
 class RequestTemplate(object):
   '''
@@ -104,7 +128,40 @@ class DataProcessor():
       contents=str(values)
     return sha256(contents.encode()).hexdigest()
   
-  def __init__(self, projectId=None, topic=None, bucket=None, path=None, debug=None):
+  def _seenKey(self, recordKey):
+    '''
+    :return: the ID of the content in the seen set, prefixed with the outputs of this processor since the seen set may
+             be shared with processors that output elsewhere (see _getProcessor.)
+    '''
+    return self._createID([self._projectId, self._topic, self._bucket, self._path])[:16]+':'+recordKey
+  
+  def _reserve(self, recordKey):
+    '''
+    Reserve content before outputting it, so that the same content submitted while it is being output is skipped.
+    :return (bool): False if the content has already been output or is being output (counted as a duplicate.)
+    '''
+    if self._seen is None: return True
+    seenKey=self._seenKey(recordKey)
+    with self._statsLock:
+      if seenKey not in self._inFlight and not self._seen.contains(seenKey):
+        self._inFlight.add(seenKey)
+        return True
+      self.numDuplicates+=1
+    _logger.debug('Skipping {recordKey}, which has already been output.'.format(recordKey=recordKey))
+    return False
+  
+  def _release(self, recordKey, output):
+    '''
+    :param output (bool): True if the content was output everywhere, in which case it is remembered as seen; otherwise
+           it is output again the next time it is received.
+    '''
+    if self._seen is None: return
+    seenKey=self._seenKey(recordKey)
+    if output: self._seen.add(seenKey)
+    with self._statsLock: self._inFlight.discard(seenKey)
+  
+  def __init__(self, projectId=None, topic=None, bucket=None, path=None, debug=None, seen=None,
+               workers=defaultSinkWorkers, queueSize=defaultSinkQueueSize, bucketClient=None, publisher=None):
     '''
 
     :param projectId:
@@ -112,7 +169,26 @@ class DataProcessor():
     :param bucket:
     :param path:
     :param debug:
+    :param seen (SeenSet): skip writing/publishing content whose ID is in this set (optional).
+    :param workers: the number of threads that write to storage and publish at the same time.
+    :param queueSize: the number of writes/publishes waiting for a worker before submit (and process) block.
+    :param bucketClient: the bucket to write to; created from bucket if not given.
+    :param publisher (PublisherClient): the client to publish with; created if not given.
     '''
+    self._seen=seen
+    # IDs of the content being output, see _reserve.
+    self._inFlight=set()
+    # Outputs completed after their sink worker is done with them (publications waiting for Pub/Sub), see flush.
+    self._pending=set()
+    self._pendingCondition=threading.Condition()
+    self.numDuplicates=0
+    # Writes and publishes are queued for a pool of sink workers, started the first time there is output.
+    self._numWorkers=workers
+    self._queue=queue.Queue(maxsize=queueSize)
+    self._workers=[]
+    self._workersLock=threading.Lock()
+    self._statsLock=threading.Lock()
+    self._closed=False
     self._bucket=bucket
     self._path=path
     self._topic=topic
@@ -122,8 +198,11 @@ class DataProcessor():
     if topic is not None and projectId is not None: _logger.debug(
       'Output will be published to {topic} in project {projectId}.'.format(topic=topic, projectId=projectId))
     
-    self._publisher=PublisherClient() if topic is not None and projectId is not None else None
-    self._bucketClient=storage.Client().bucket(bucket) if bucket is not None else None
+    self._publisher=None
+    if topic is not None and projectId is not None:
+      self._publisher=PublisherClient() if publisher is None else publisher
+    self._bucketClient=None
+    if bucket is not None: self._bucketClient=storage.Client().bucket(bucket) if bucketClient is None else bucketClient
   
   def _writeToBucket(self, data, filename=None):
     '''
@@ -136,7 +215,7 @@ class DataProcessor():
     recordKey=None
     try:
       recordKey=self._createID(data) if filename is None else filename
-      self._bucketClient.blob(recordKey).upload_from_string(json.dumps(data))
+      self._bucketClient.blob(recordKey).upload_from_string(serialization.dumps(data), content_type='application/json')
       return 1
     except Forbidden as fe:
       try:
@@ -160,45 +239,159 @@ class DataProcessor():
       ), exc_info=True, stack_info=True)
     return 0
   
+  def writeStream(self, chunks, contentType='application/json', spoolBytes=defaultSpoolBytes,
+                  uploadChunkSize=defaultUploadChunkSize):
+    '''
+    Write a body to storage as it is received, without parsing it. The chunks are hashed into the name of the file as
+    they arrive and spooled (to a temporary file once there are more than spoolBytes of them) so that memory use does
+    not depend on the size of the body; the file is then sent with a resumable upload. The name is the SHA-256 of the
+    raw bytes, so it differs from the name _writeToBucket gives to the same data once parsed.
+    :param chunks: an iterable of bytes, i.e. response.iter_content(chunk_size).
+    :param contentType: the content type of the file.
+    :param spoolBytes: the number of bytes to keep in memory.
+    :param uploadChunkSize: the number of bytes to send per request of the upload.
+    :return: (number of records written, number of bytes received)
+    '''
+    if self._bucket is None: return (0, 0)
+    digest=sha256()
+    numBytes=0
+    recordKey=None
+    with tempfile.SpooledTemporaryFile(max_size=spoolBytes) as spool:
+      for chunk in chunks:
+        if not chunk: continue  # Keep-alive chunks.
+        digest.update(chunk)
+        spool.write(chunk)
+        numBytes+=len(chunk)
+      recordKey=digest.hexdigest()
+      if not self._reserve(recordKey): return (0, numBytes)
+      try:
+        spool.seek(0)
+        self._bucketClient.blob(recordKey, chunk_size=uploadChunkSize).upload_from_file(
+          spool, size=numBytes, content_type=contentType)
+      except:
+        _logger.error('Failed to write to GCS bucket {bucket}, object {objectName}.'.format(
+          bucket=self._bucket,
+          objectName=recordKey
+        ), exc_info=True, stack_info=True)
+        self._release(recordKey, False)
+        return (0, numBytes)
+    self._release(recordKey, True)
+    return (1, numBytes)
+  
+  @staticmethod
+  def _confirm(publishFuture, published, message):
+    '''
+    Resolve published to 1 once Pub/Sub has accepted the message, or to 0 if it failed.
+    '''
+    try:
+      publishFuture.result()
+      published.set_result(1)
+    except:
+      _logger.error('Cannot publish message "'+message.decode('utf-8')+'".', exc_info=True)
+      published.set_result(0)
+  
   def _publish(self, data):
+    '''
+    :return (Future): resolves to the number of messages published once Pub/Sub has confirmed the message, so that
+             content is only remembered as output once it has been (see submit.)
+    '''
+    message=serialization.dumps(data)
+    published=Future()
     attributes=None
     if type(data)==dict:
       attributes={}
       for key, value in data.items():
         if type(value) in [int, float, str, bool]:
           attributes[key]=value
+    publishFuture=None
     if attributes is not None and len(attributes)>0:
       # Try to include key-values of data as attributes in the published message.
       try:
-        self._publisher.publish('projects/'+self._projectId+'/topics/'+self._topic,
-                                data=json.dumps(data).encode("utf-8"), **attributes)
-        return 1
+        publishFuture=self._publisher.publish('projects/'+self._projectId+'/topics/'+self._topic,
+                                              data=message, **attributes)
       except:
         _logger.debug('Cannot include '+str(attributes)+' as attributes to the message.', exc_info=True)
-    try:
-      self._publisher.publish('projects/'+self._projectId+'/topics/'+self._topic, data=json.dumps(data).encode("utf-8"))
-      return 1
-    except:
-      _logger.error('Cannot publish message "'+str(json.dumps(data))+'".', exc_info=True, stack_info=True)
-      return 0
+    if publishFuture is None:
+      try:
+        publishFuture=self._publisher.publish('projects/'+self._projectId+'/topics/'+self._topic, data=message)
+      except:
+        _logger.error('Cannot publish message "'+message.decode('utf-8')+'".', exc_info=True, stack_info=True)
+        published.set_result(0)
+        return published
+    publishFuture.add_done_callback(lambda done: self._confirm(done, published, message))
+    return published
   
   def _parse(self, data):
     '''
     Parse data to generate tabular data.
-    :param data: JSON string.
+    :param data: JSON string (data that has already been decoded is returned as is.)
     :return: a dict.
     '''
+    if type(data) not in [str, bytes]: return data
     try:
       return json.loads(data)
     except:
       _logger.error('Error parsing data as JSON string. '+str(data), exc_info=True, stack_info=True)
       return {'error':str(data)}  # Return the record in a field named "error".
   
-  def process(self, data):
+  def _startWorkers(self):
+    with self._workersLock:
+      if self._closed: raise RuntimeError('Cannot output data through a closed DataProcessor.')
+      if len(self._workers)>0: return
+      for index in range(self._numWorkers):
+        worker=threading.Thread(target=self._work, name='DataProcessor-sink-{index:d}'.format(index=index), daemon=True)
+        worker.start()
+        self._workers.append(worker)
+  
+  def _work(self):
+    while True:
+      task=self._queue.get()
+      try:
+        if task is None: return
+        future, output, args=task
+        try:
+          outcome=output(*args)
+        except Exception as ex:
+          future.set_exception(ex)
+        else:
+          if isinstance(outcome, Future):
+            # Completed later, i.e. once Pub/Sub confirms a message (see _publish.)
+            with self._pendingCondition: self._pending.add(outcome)
+            outcome.add_done_callback(lambda done, future=future: self._complete(future, done))
+          else:
+            future.set_result(outcome)
+      finally:
+        # Only once the future (and its callbacks) are done, so that flush returns with every output completed (or
+        # waiting for Pub/Sub, see flush.)
+        self._queue.task_done()
+  
+  def _complete(self, future, outcome):
+    '''
+    Complete future with the result of outcome, and only then stop waiting for it in flush.
+    '''
+    try:
+      future.set_result(outcome.result())
+    finally:
+      with self._pendingCondition:
+        self._pending.discard(outcome)
+        self._pendingCondition.notify_all()
+  
+  def _enqueue(self, output, *args):
     '''
+    :return (Future): the result of output(*args) once a sink worker has run it; blocks while the queue is full.
+    '''
+    future=Future()
+    self._queue.put((future, output, args))
+    return future
+  
+  def submit(self, data):
+    '''
+    Parse data and queue its write to storage and its publication, which run in parallel on the sink workers.
+    Blocks while the queue is full.
     :param data:
-    :return: returns (number of records written, number of records published)
+    :return (Future): resolves to (number of records written, number of records published) once both are done.
     '''
+    result=Future()
     parsed=None
     try:
       _logger.debug('Received data. '+str(data)[:100]+('...' if len(str(data))>100 else ''))
@@ -206,30 +399,245 @@ class DataProcessor():
     except:
       _logger.error('Error processing data. '+str(data), exc_info=True, stack_info=True)
     
-    numWritten=0
-    numPublished=0
-    if parsed is not None:
-      # Output the data.
-      if self._bucket is not None: numWritten+=self._writeToBucket(parsed)
-      if self._publisher is not None: numPublished+=self._publish(parsed)
-    return (numWritten, numPublished)
+    if parsed is None or (self._bucket is None and self._publisher is None):
+      result.set_result((0, 0))
+      return result
+    recordKey=self._createID(parsed)
+    if not self._reserve(recordKey):
+      # The same content has already been output (or is being output.)
+      result.set_result((0, 0))
+      return result
+    # Output the data.
+    try:
+      self._startWorkers()
+    except:
+      self._release(recordKey, False)
+      raise
+    outputs=[]
+    if self._bucket is not None: outputs.append(('written', self._enqueue(self._writeToBucket, parsed, recordKey)))
+    if self._publisher is not None: outputs.append(('published', self._enqueue(self._publish, parsed)))
+    remaining=[len(outputs)]
+    lock=threading.Lock()
+    
+    def done(future):
+      with lock:
+        remaining[0]-=1
+        if remaining[0]>0: return
+      counts={'written':0, 'published':0}
+      for name, output in outputs:
+        try:
+          counts[name]=output.result()
+        except:
+          _logger.error('Failed to output data.', exc_info=True)
+      # Only remembered once it has been output everywhere, so failures are retried the next time it is received.
+      self._release(recordKey, all(counts[name]>0 for name, output in outputs))
+      result.set_result((counts['written'], counts['published']))
+    
+    for name, output in outputs:
+      output.add_done_callback(done)
+    return result
+  
+  def process(self, data):
+    '''
+    :param data:
+    :return: returns (number of records written, number of records published) once both are done.
+    '''
+    return self.submit(data).result()
+  
+  def flush(self):
+    '''
+    Wait until every write/publish queued so far has completed, including the confirmation of every publication.
+    '''
+    self._queue.join()
+    with self._pendingCondition:
+      while len(self._pending)>0: self._pendingCondition.wait()
+  
+  def close(self):
+    '''
+    Complete every write/publish queued so far and stop the sink workers; the processor cannot be used afterwards.
+    '''
+    with self._workersLock:
+      if self._closed: return
+      self._closed=True
+      workers=self._workers
+    self.flush()
+    for worker in workers:
+      self._queue.put(None)
+    for worker in workers:
+      worker.join()
+  
+  def getStats(self):
+    '''
+    :return (dict): the number of duplicates skipped, writes/publishes waiting for a sink worker and the hits/misses
+             of the seen set.
+    '''
+    stats={'duplicates':self.numDuplicates, 'queued':self._queue.qsize()}
+    if self._seen is not None: stats['seen']=self._seen.getStats()
+    return stats
+
+# One HTTP session (and pool of connections kept alive) for all calls within this process.
+_session=None
 
-def callAPI(url,headers,parameters,projectId,topic,bucket,pathInBucket,debug):
+def _getSession(maxPerHost=defaultMaxPerHost):
+  '''
+  :param maxPerHost: the number of connections to keep alive per host, the first time this is called.
+  :return (Session): the session shared by all calls within this process.
+  '''
+  global _session
+  if _session is None:
+    session=Session()
+    adapter=HTTPAdapter(pool_connections=32, pool_maxsize=maxPerHost)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    _session=session
+  return _session
+
+# Processors are kept for the life of the process, keyed by (projectId, topic, bucket, path, dedupe), so that their GCS
+# and Pub/Sub clients are only created once.
+_processors={}
+_processorsLock=threading.Lock()
+# Seen sets of content IDs, keyed by the path of their file (None for memory only.) A seen set is shared by every
+# processor that uses its file, each of which prefixes the IDs with its outputs (see DataProcessor._seenKey.)
+_seenSets={}
+
+def _getProcessor(projectId, topic, bucket, pathInBucket, debug=None, dedupe=False, dedupePath=None):
+  '''
+  :param dedupe: skip content that has already been output if True (see SeenSet.)
+  :param dedupePath: a local file to keep the IDs of content output in between runs.
+  :return (DataProcessor): the processor shared by all calls within this process for the given outputs.
+  '''
+  key=(projectId, topic, bucket, pathInBucket, dedupePath if dedupe else False)
+  with _processorsLock:
+    if key not in _processors:
+      seen=None
+      if dedupe:
+        if dedupePath not in _seenSets: _seenSets[dedupePath]=SeenSet(path=dedupePath)
+        seen=_seenSets[dedupePath]
+      _processors[key]=DataProcessor(projectId=projectId, topic=topic, bucket=bucket, path=pathInBucket, debug=debug,
+                                     seen=seen)
+    return _processors[key]
+
+# Caches of responses, keyed by their directory.
+_httpCaches={}
+
+def _getHttpCache(cachePath, ttl=defaultCacheTTL, maxBytes=defaultCacheMaxBytes):
+  '''
+  :param cachePath: the local directory of the cache.
+  :return (HttpCache): the cache shared by all calls within this process that use the directory.
+  '''
+  with _processorsLock:
+    if cachePath not in _httpCaches: _httpCaches[cachePath]=HttpCache(cachePath, ttl=ttl, maxBytes=maxBytes)
+    return _httpCaches[cachePath]
+
+# One rate limiter for all calls within this process, so that every call shares the limits of each host.
+_rateLimiter=None
+_rateLimiterSettings=None
+
+def _getRateLimiter(rate=defaultRateLimit, tries=defaultTries):
+  '''
+  :param rate: the most requests per second to send to each host, the first time this is called.
+  :param tries: the number of times to send a throttled or failed request, the first time this is called.
+  :return (RateLimiter): the rate limiter shared by all calls within this process.
+  '''
+  global _rateLimiter, _rateLimiterSettings
+  with _processorsLock:
+    if _rateLimiter is None:
+      _rateLimiter=RateLimiter(rate=rate, tries=tries)
+      _rateLimiterSettings=(rate, tries)
+    elif _rateLimiterSettings!=(rate, tries):
+      _logger.warning('Limiting to {rate} requests/s and {tries} tries, as set by the first call.'.format(
+        rate=_rateLimiterSettings[0], tries=_rateLimiterSettings[1]))
+    return _rateLimiter
+
+def _getRateLimitedSession(maxPerHost=defaultMaxPerHost, rate=defaultRateLimit, tries=defaultTries):
+  '''
+  :return (RateLimitedSession): the session shared by all calls within this process, within the shared rate limits.
+  '''
+  return RateLimitedSession(_getSession(maxPerHost), _getRateLimiter(rate, tries))
+
+def _fetch(session, url, headers, parameters, timeout=defaultTimeout):
+  '''
+  :return: (data parsed from the JSON response or None, status code or None, number of bytes received); the data is
+           None for a 304 Not Modified (see CachingSession.)
+  '''
+  response=session.get(url, headers=headers, params=parameters, timeout=timeout)
+  if response.status_code==304: return (None, response.status_code, len(response.content))
+  if response.status_code==429 or response.status_code>=500:
+    # Still throttled or failing after every retry (see RateLimiter); the body is an error, not data.
+    raise IOError('{url} responded with status {status:d}.'.format(url=url, status=response.status_code))
+  return (json.loads(response.text), response.status_code, len(response.content))
+
+def callAPI(url,headers,parameters,projectId,topic,bucket,pathInBucket,debug,dedupe=False,dedupePath=None,
+            cachePath=None,cacheTTL=defaultCacheTTL,cacheMaxBytes=defaultCacheMaxBytes,
+            rateLimit=defaultRateLimit,tries=defaultTries,passthrough=False,processor=None):
+  '''
+  :param cachePath: a local directory to cache responses in (see HttpCache); responses that have not changed since the
+         last call are not processed again.
+  :param cacheTTL: seconds during which a cached response is used without asking the API whether it changed.
+  :param cacheMaxBytes: the size of the responses to keep in the cache.
+  :param rateLimit: the most requests per second to send to the host of url (see RateLimiter); the first call within
+         this process sets it for all calls.
+  :param tries: the number of times to send a request that is throttled (429), fails (5xx) or cannot connect.
+  :param passthrough: stream the body of the response to the bucket as is, without parsing it (see
+         DataProcessor.writeStream); nothing is published and responses are not cached.
+  :param processor: the DataProcessor to use; defaults to the one shared by all calls with the same outputs.
+  '''
   # Access API.
   _logger.info('Calling {url} with {params}.'.format(url=url, params=str(parameters)))
   
+  # Cached responses are served without using up the rate limit.
+  session=_getRateLimitedSession(rate=rateLimit, tries=tries)
+  if passthrough:
+    if topic is not None or cachePath is not None:
+      _logger.warning('Responses passed through to storage are neither published nor cached.')
+    if processor is None:
+      processor=_getProcessor(projectId, None, bucket, pathInBucket, debug=debug, dedupe=dedupe, dedupePath=dedupePath)
+    numWritten=0
+    numBytes=0
+    try:
+      response=session.get(url, headers=headers, params=parameters, timeout=defaultTimeout, stream=True)
+      try:
+        if response.status_code!=200:
+          raise IOError('{url} responded with status {status:d}.'.format(url=url, status=response.status_code))
+        numWritten, numBytes=processor.writeStream(response.iter_content(chunk_size=defaultChunkSize),
+                                                   contentType=response.headers.get('Content-Type', 'application/json'))
+      finally:
+        response.close()
+    except:
+      _logger.error('Error retrieving data.', exc_info=True, stack_info=True)
+    _logger.info('Wrote {numWritten:d} records ({numBytes:d} bytes) to gs://{bucket}/{path}.'.format(
+      numWritten=numWritten, numBytes=numBytes, bucket=bucket, path=pathInBucket))
+    return
+  cache=None
+  if cachePath is not None:
+    cache=_getHttpCache(cachePath, ttl=cacheTTL, maxBytes=cacheMaxBytes)
+    session=CachingSession(session, cache)
+  cacheLog=''
+  
   data=None
+  status=None
   try:
-    session=Session()
-    session.headers.update(headers)
-    response=session.get(url, params=parameters)
-    data=json.loads(response.text)
+    data, status, numBytes=_fetch(session, url, headers, parameters)
   except:
     _logger.error('Error retrieving data.', exc_info=True, stack_info=True)
+    # Download it again the next time instead of treating it as already processed.
+    if cache is not None: session.discard(url, headers, parameters)
+  if cache is not None:
+    stats=cache.getStats()
+    cacheLog=' Cache hit ratio {hitRatio:.1%}, {bytesSaved:d} bytes saved.'.format(
+      hitRatio=stats['hitRatio'], bytesSaved=stats['bytesSaved'])
   
+  if status==304:
+    _logger.info('Response from {url} has not changed since it was last processed.'.format(url=url)+cacheLog)
   if data is not None:
-    processor=DataProcessor(projectId=projectId, topic=topic, bucket=bucket, path=pathInBucket, debug=debug)
+    if processor is None:
+      processor=_getProcessor(projectId, topic, bucket, pathInBucket, debug=debug, dedupe=dedupe, dedupePath=dedupePath)
     numWritten, numPublished=processor.process(data)
+    if cache is not None and ((bucket is not None and numWritten==0) or
+                              (topic is not None and projectId is not None and numPublished==0)):
+      # Not output everywhere (or already output, see dedupe); download it again the next time so that a failed write
+      # or publication is retried instead of the response being treated as processed.
+      session.discard(url, headers, parameters)
     _logger.info(
       'Wrote {numWritten:d} records to gs://{bucket}/{path}, published {numPublished:d} messages to {topic}.'.format(
         numWritten=numWritten,
@@ -237,7 +645,213 @@ def callAPI(url,headers,parameters,projectId,topic,bucket,pathInBucket,debug):
         bucket=bucket,
         path=pathInBucket,
         topic=topic
-      ))
+      )+cacheLog)
+
+class _HostLimits(object):
+  '''
+  Bounds the number of requests sent to each host at the same time.
+  '''
+  def __init__(self, maxPerHost):
+    self._maxPerHost=maxPerHost
+    self._semaphores={}
+    self._lock=threading.Lock()
+  
+  def get(self, url):
+    host=urlparse(url).netloc
+    with self._lock:
+      if host not in self._semaphores: self._semaphores[host]=threading.BoundedSemaphore(self._maxPerHost)
+      return self._semaphores[host]
+
+def _job(job):
+  '''
+  :param job: a (url, headers, parameters) tuple or a dict with url, headers and parameters.
+  :return: (url, headers, parameters)
+  '''
+  if type(job)==dict:
+    return (job['url'], job.get('headers', None), job.get('parameters', job.get('params', None)))
+  url, headers, parameters=(tuple(job)+(None, None))[:3]
+  return (url, headers, parameters)
+
+def callAPIBatch(jobs, projectId, topic, bucket, pathInBucket, debug=None,
+                 maxWorkers=defaultMaxWorkers, maxPerHost=defaultMaxPerHost, timeout=defaultTimeout,
+                 session=None, processor=None, dedupe=False, dedupePath=None,
+                 rateLimit=defaultRateLimit, tries=defaultTries):
+  '''
+  Fetch many endpoints concurrently over one pool of connections and output every response through one DataProcessor.
+  :param jobs: a list of (url, headers, parameters) tuples or dicts with url, headers and parameters.
+  :param projectId: the project that contains the topic.
+  :param topic: the Pub/Sub topic to publish responses to (optional).
+  :param bucket: the bucket to write responses to (optional).
+  :param pathInBucket: the path within the bucket.
+  :param debug: set to 10 to see debug statements.
+  :param maxWorkers: the number of requests sent at the same time.
+  :param maxPerHost: the number of requests sent to the same host at the same time.
+  :param timeout: seconds to wait for an API, either one number or a (connect, read) tuple.
+  :param session: the Session to use; defaults to the one shared by all calls within this process, rate limited.
+  :param processor: the DataProcessor to use; defaults to the one shared by all calls with the same outputs.
+  :param dedupe: skip responses whose content has already been output if True.
+  :param dedupePath: a local file to keep the IDs of content output in between runs.
+  :param rateLimit: the most requests per second to send to each host (see callAPI.)
+  :param tries: the number of times to send a request that is throttled (429), fails (5xx) or cannot connect.
+  :return (dict): endpoints, a list with the url, status, latency (seconds), bytes, written, published and error of
+           every job, plus the number of requests, the total seconds and the rate of requests per second.
+  '''
+  session=_getRateLimitedSession(maxPerHost, rateLimit, tries) if session is None else session
+  if processor is None:
+    processor=_getProcessor(projectId, topic, bucket, pathInBucket, debug=debug, dedupe=dedupe, dedupePath=dedupePath)
+  hostLimits=_HostLimits(maxPerHost)
+  
+  def run(job):
+    url, headers, parameters=_job(job)
+    result={'url':url, 'status':None, 'latency':None, 'bytes':0, 'written':0, 'published':0, 'error':None}
+    data=None
+    with hostLimits.get(url):
+      start=time.time()
+      try:
+        data, result['status'], result['bytes']=_fetch(session, url, headers, parameters, timeout=timeout)
+      except Exception as ex:
+        result['error']=str(ex)
+        _logger.error('Error retrieving data from {url}.'.format(url=url), exc_info=True)
+      result['latency']=time.time()-start
+    if data is not None:
+      result['written'], result['published']=processor.process(data)
+    return result
+  
+  start=time.time()
+  with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+    results=list(executor.map(run, jobs))
+  seconds=time.time()-start
+  stats={'endpoints':results, 'requests':len(results), 'seconds':seconds,
+         'rate':len(results)/seconds if seconds>0 else 0.0}
+  _logger.info(json.dumps({'log':'Called {num:d} endpoints in {seconds:.3f}s, {rate:.1f} requests/s, {failed:d} failed.'.format(
+    num=len(results), seconds=seconds, rate=stats['rate'], failed=sum(1 for result in results if result['error'] is not None)),
+    'latency':dict((result['url'], result['latency']) for result in results)}))
+  return stats
+
+def _lookup(data, field):
+  '''
+  :param field: a dotted path within data (i.e. "meta.next"); None for data itself.
+  :return: the value at the path or None if it does not exist.
+  '''
+  if field is None: return data
+  for name in field.split('.'):
+    if not isinstance(data, dict): return None
+    data=data.get(name)
+  return data
+
+def _nextPage(pagination, url, parameters, response, data, pageSize):
+  '''
+  Work out the request for the page following the given one.
+  :return: (url, parameters) of the next page or None if this was the last page.
+  '''
+  style=pagination.get('type', 'link')
+  if style=='link':
+    # requests parses the Link header into response.links.
+    nextUrl=getattr(response, 'links', {}).get('next', {}).get('url')
+    return (nextUrl, None) if nextUrl else None
+  if style=='cursor':
+    cursor=_lookup(data, pagination.get('cursorField', 'next'))
+    if cursor is None or cursor=='': return None
+    following=dict(parameters or {})
+    following[pagination.get('cursorParam', 'cursor')]=cursor
+    return (url, following)
+  items=_lookup(data, pagination.get('itemsField', None))
+  if items is not None and not isinstance(items, list):
+    # Counting the keys of an object would move the offset by the wrong number of items.
+    raise ValueError('{style} pagination needs itemsField to name the list of items in a page.'.format(style=style))
+  numItems=len(items) if items is not None else 0
+  if numItems==0 or (pageSize is not None and numItems<pageSize): return None
+  following=dict(parameters or {})
+  if style=='offset':
+    offsetParam=pagination.get('offsetParam', 'offset')
+    following[offsetParam]=int(following.get(offsetParam, 0))+numItems
+  elif style=='page':
+    pageParam=pagination.get('pageParam', 'page')
+    following[pageParam]=int(following.get(pageParam, pagination.get('firstPage', 1)))+1
+  else:
+    raise ValueError('Unknown pagination type "{style}".'.format(style=style))
+  return (url, following)
+
+def _getPage(session, url, headers, parameters, timeout):
+  '''
+  :return: (response, data parsed from the JSON response or None if the request failed)
+  '''
+  response=session.get(url, headers=headers, params=parameters, timeout=timeout)
+  if response.status_code!=200:
+    _logger.error('Error retrieving {url} with {params}: status {status}.'.format(
+      url=url, params=str(parameters), status=str(response.status_code)))
+    return (response, None)
+  return (response, json.loads(response.text))
+
+def fetchPages(url, headers=None, parameters=None, pagination=None, pageSize=None, maxPages=None,
+               session=None, timeout=defaultTimeout):
+  '''
+  Lazily fetch the pages of a paginated API. The next page is requested while the current one is being processed, so
+  at most two pages are held in memory at a time.
+  :param url: the URL of the first page.
+  :param headers: the headers to send with every request.
+  :param parameters: the parameters of the first page.
+  :param pagination: a dict describing how the API paginates; type is one of:
+           link   -- follow the "next" URL of the Link header (the default.)
+           cursor -- send the value at cursorField (default "next") of a page as cursorParam (default "cursor".)
+           offset -- add the number of items at itemsField (default the page itself) to offsetParam (default "offset".)
+           page   -- add one to pageParam (default "page", starting at firstPage, default 1.)
+         sizeParam is the parameter that sets the page size. Offset and page pagination stop at the first page with
+         fewer than pageSize items, and need itemsField when pages are not lists.
+  :param pageSize: the number of items to request per page.
+  :param maxPages: stop after this many pages.
+  :param session: the Session to use; defaults to the one shared by all calls within this process, rate limited.
+  :param timeout: seconds to wait for the API, either one number or a (connect, read) tuple.
+  :return: yields the data parsed from every page.
+  '''
+  session=_getRateLimitedSession() if session is None else session
+  pagination={} if pagination is None else pagination
+  parameters=dict(parameters or {})
+  if pageSize is not None and pagination.get('sizeParam') is not None: parameters[pagination['sizeParam']]=pageSize
+  with ThreadPoolExecutor(max_workers=1) as prefetcher:
+    future=prefetcher.submit(_getPage, session, url, headers, parameters, timeout)
+    numPages=0
+    while future is not None:
+      response, data=future.result()
+      future=None
+      if data is None: break
+      numPages+=1
+      if maxPages is None or numPages<maxPages:
+        following=_nextPage(pagination, url, parameters, response, data, pageSize)
+        if following is not None:
+          url, parameters=following
+          future=prefetcher.submit(_getPage, session, url, headers, parameters, timeout)
+      response=None
+      yield data
+
+def callAPIPaged(url, headers, parameters, projectId, topic, bucket, pathInBucket, debug=None,
+                 pagination=None, pageSize=None, maxPages=None, dedupe=False, dedupePath=None,
+                 rateLimit=defaultRateLimit, tries=defaultTries):
+  '''
+  Fetch every page of a paginated API (see fetchPages) and output each page through a DataProcessor as it arrives.
+  :param rateLimit: the most requests per second to send to the host of url (see callAPI.)
+  :param tries: the number of times to send a request that is throttled (429), fails (5xx) or cannot connect.
+  :return: (number of pages, number of records written, number of records published)
+  '''
+  _logger.info('Calling {url} with {params}, {maxPages} pages at most.'.format(
+    url=url, params=str(parameters), maxPages=str(maxPages)))
+  processor=_getProcessor(projectId, topic, bucket, pathInBucket, debug=debug, dedupe=dedupe, dedupePath=dedupePath)
+  numPages=0
+  numWritten=0
+  numPublished=0
+  try:
+    for page in fetchPages(url, headers=headers, parameters=parameters, pagination=pagination, pageSize=pageSize,
+                           maxPages=maxPages, session=_getRateLimitedSession(rate=rateLimit, tries=tries)):
+      numPages+=1
+      written, published=processor.process(page)
+      numWritten+=written
+      numPublished+=published
+  except:
+    _logger.error('Error retrieving page {num:d} of {url}.'.format(num=numPages+1, url=url), exc_info=True, stack_info=True)
+  _logger.info(
+    'Wrote {numWritten:d} records to gs://{bucket}/{path}, published {numPublished:d} messages to {topic} from {numPages:d} pages.'.format(
+      numWritten=numWritten, numPublished=numPublished, bucket=bucket, path=pathInBucket, topic=topic, numPages=numPages))
+  return (numPages, numWritten, numPublished)
 
 def cloudFunctionMain(request):
   """Responds to any HTTP request.
@@ -277,7 +891,36 @@ def cloudFunctionMain(request):
   # Grab the parameters and headers from the message.
   parameters=messageJSON.get('parameters',None)
   headers=messageJSON.get('headers',None)
-  callAPI(parameters,projectId,topic,bucket,pathInBucket,debug)
+  # A list of jobs, each with a url, headers and parameters, fetches all of them concurrently.
+  jobs=messageJSON.get('jobs',None)
+  # Skip content that was already output (dedupePath keeps the IDs in a local file, i.e. under /tmp.)
+  dedupe=messageJSON.get('dedupe',False)
+  dedupePath=messageJSON.get('dedupePath',None)
+  # The most requests per second to send to each host and the number of tries of throttled requests (see RateLimiter.)
+  rateLimit=messageJSON.get('rateLimit',defaultRateLimit)
+  tries=messageJSON.get('tries',defaultTries)
+  if jobs is not None:
+    stats=callAPIBatch(jobs,projectId,topic,bucket,pathInBucket,debug,dedupe=dedupe,dedupePath=dedupePath,
+                       rateLimit=rateLimit,tries=tries)
+    return json.dumps(messageJSON)+' completed {num:d} requests at {rate:.1f} requests/s.'.format(
+      num=stats['requests'], rate=stats['rate'])
+  # A pagination dict (see fetchPages) fetches every page of url, up to maxPages.
+  pagination=messageJSON.get('pagination',None)
+  if pagination is not None:
+    numPages, numWritten, numPublished=callAPIPaged(messageJSON.get('url',None),headers,parameters,projectId,topic,
+                                                    bucket,pathInBucket,debug,pagination=pagination,
+                                                    pageSize=messageJSON.get('pageSize',None),
+                                                    maxPages=messageJSON.get('maxPages',None),
+                                                    dedupe=dedupe,dedupePath=dedupePath,
+                                                    rateLimit=rateLimit,tries=tries)
+    return json.dumps(messageJSON)+' completed {num:d} pages.'.format(num=numPages)
+  # A cachePath (i.e. under /tmp) caches responses and skips those that have not changed (see HttpCache.)
+  # passthrough streams large responses to the bucket as they are, without parsing them.
+  callAPI(messageJSON.get('url',None),headers,parameters,projectId,topic,bucket,pathInBucket,debug,
+          dedupe=dedupe,dedupePath=dedupePath,cachePath=messageJSON.get('cachePath',None),
+          cacheTTL=messageJSON.get('cacheTTL',defaultCacheTTL),
+          cacheMaxBytes=messageJSON.get('cacheMaxBytes',defaultCacheMaxBytes),
+          rateLimit=rateLimit,tries=tries,passthrough=messageJSON.get('passthrough',False))
   
   return json.dumps(messageJSON)+' completed.'
 
@@ -0,0 +1,245 @@
+# An on-disk cache of HTTP responses for APIs that are polled on a schedule, so that data that has not changed upstream
+# is neither downloaded nor output again:
+#   - Responses are keyed by URL, parameters and headers. Every entry is two files in the cache directory: KEY.body holds
+#     the body and KEY.meta holds a JSON object with the URL, when it was stored and its ETag/Last-Modified validators.
+#   - Within ttl seconds of being stored, an entry is served without sending a request. After that, the request is sent
+#     with If-None-Match/If-Modified-Since and a 304 Not Modified renews the entry.
+#   - Either way, CachingSession.get returns a response with status 304 (and no body) so that callers can skip
+#     processing content they have already processed. Any other response is returned as is; 200s are stored.
+#   - The least recently used entries are evicted when the bodies add up to more than maxBytes.
+#     session=CachingSession(Session(), HttpCache('/tmp/genericRest.cache', ttl=300))
+#     response=session.get(url, headers=headers, params=parameters)
+#     if response.status_code==304: ... unchanged ...
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+
+_logger=logging.getLogger(__name__)
+
+class HttpCache(object):
+  '''
+  A size-bounded directory of responses with least-recently-used eviction.
+  '''
+  def __init__(self, directory, ttl=300, maxBytes=100*1024*1024):
+    '''
+    :param directory: a local directory to keep the responses in; created if it does not exist.
+    :param ttl: seconds during which a stored response is served without revalidating it.
+    :param maxBytes: the total size of the bodies to keep.
+    '''
+    self._directory=directory
+    self._ttl=ttl
+    self._maxBytes=maxBytes
+    # Key -> metadata, least recently used first.
+    self._entries=OrderedDict()
+    self._numBytes=0
+    self._lock=threading.Lock()
+    self.numRequests=0
+    self.numHits=0
+    self.numRevalidated=0
+    self.numBytesSaved=0
+    os.makedirs(directory, exist_ok=True)
+    self._load()
+
+  @staticmethod
+  def key(url, headers=None, params=None):
+    '''
+    :return: the key of the response to a request; headers are part of it since they may hold different credentials.
+    '''
+    return sha256(json.dumps([url, headers or {}, params or {}], sort_keys=True, default=str).encode()).hexdigest()
+
+  def _path(self, key, extension):
+    return os.path.join(self._directory, key+extension)
+
+  def _load(self):
+    entries=[]
+    for name in os.listdir(self._directory):
+      if not name.endswith('.meta'): continue
+      key=name[:-len('.meta')]
+      try:
+        with open(self._path(key, '.meta')) as metaFile:
+          meta=json.load(metaFile)
+        entries.append((os.path.getmtime(self._path(key, '.meta')), key, meta))
+      except:
+        _logger.warning('Skipping cache entry {key}, which cannot be read.'.format(key=key), exc_info=True)
+    # Entries are touched when used, so their modification times give the order they were used in.
+    for used, key, meta in sorted(entries):
+      self._entries[key]=meta
+      self._numBytes+=meta['size']
+    self._evict()
+
+  def _remove(self, key):
+    meta=self._entries.pop(key, None)
+    if meta is not None: self._numBytes-=meta['size']
+    for extension in ['.meta', '.body']:
+      try:
+        os.remove(self._path(key, extension))
+      except FileNotFoundError:
+        pass
+
+  def _evict(self):
+    while self._numBytes>self._maxBytes and len(self._entries)>0:
+      self._remove(next(iter(self._entries)))
+
+  def _writeMeta(self, key, meta):
+    '''
+    Replace the metadata atomically; the body is written first, so a readable .meta always has a complete .body.
+    '''
+    temporaryPath=self._path(key, '.meta.tmp')
+    with open(temporaryPath, 'w') as metaFile:
+      json.dump(meta, metaFile)
+    os.replace(temporaryPath, self._path(key, '.meta'))
+
+  def lookup(self, key):
+    '''
+    :return (dict): the metadata of the entry (url, stored, etag, lastModified, size) or None if it is not cached.
+    '''
+    with self._lock:
+      meta=self._entries.get(key)
+      if meta is not None: self._entries.move_to_end(key)
+      return meta
+
+  def isFresh(self, meta):
+    return time.time()-meta['stored']<self._ttl
+
+  def read(self, key):
+    '''
+    :return (bytes): the body of the entry.
+    '''
+    with open(self._path(key, '.body'), 'rb') as bodyFile:
+      return bodyFile.read()
+
+  def store(self, key, url, response):
+    '''
+    Store a 200 response, unless it says it must not be stored.
+    '''
+    if 'no-store' in response.headers.get('Cache-Control', ''): return
+    content=response.content
+    meta={'url':url, 'stored':time.time(), 'etag':response.headers.get('ETag'),
+          'lastModified':response.headers.get('Last-Modified'), 'size':len(content)}
+    if meta['size']>self._maxBytes: return
+    with self._lock:
+      self._remove(key)
+      try:
+        temporaryPath=self._path(key, '.body.tmp')
+        with open(temporaryPath, 'wb') as bodyFile:
+          bodyFile.write(content)
+        os.replace(temporaryPath, self._path(key, '.body'))
+        self._writeMeta(key, meta)
+      except:
+        _logger.error('Cannot store the response from {url} in {directory}.'.format(url=url, directory=self._directory),
+                      exc_info=True)
+        return
+      self._entries[key]=meta
+      self._numBytes+=meta['size']
+      self._evict()
+
+  def renew(self, key, response=None):
+    '''
+    Mark an entry as just validated, taking any new validators from a 304 response.
+    '''
+    with self._lock:
+      meta=self._entries.get(key)
+      if meta is None: return
+      meta['stored']=time.time()
+      if response is not None:
+        meta['etag']=response.headers.get('ETag', meta['etag'])
+        meta['lastModified']=response.headers.get('Last-Modified', meta['lastModified'])
+      try:
+        self._writeMeta(key, meta)
+      except:
+        _logger.error('Cannot renew cache entry {key}.'.format(key=key), exc_info=True)
+
+  def touch(self, key):
+    try:
+      os.utime(self._path(key, '.meta'))
+    except OSError:
+      pass
+
+  def discard(self, key):
+    '''
+    Forget an entry, i.e. when its content could not be processed, so that it is downloaded again the next time.
+    '''
+    with self._lock:
+      self._remove(key)
+
+  def count(self, hit=False, revalidated=False, numBytesSaved=0):
+    with self._lock:
+      self.numRequests+=1
+      if hit: self.numHits+=1
+      if revalidated: self.numRevalidated+=1
+      self.numBytesSaved+=numBytesSaved
+
+  def __len__(self):
+    return len(self._entries)
+
+  def getStats(self):
+    '''
+    :return (dict): requests, hits (served without a request), revalidated (304s), the hit ratio of both over requests,
+             bytes saved, entries and bytes cached.
+    '''
+    with self._lock:
+      hits=self.numHits+self.numRevalidated
+      return {'requests':self.numRequests, 'hits':self.numHits, 'revalidated':self.numRevalidated,
+              'hitRatio':hits/self.numRequests if self.numRequests>0 else 0.0, 'bytesSaved':self.numBytesSaved,
+              'entries':len(self._entries), 'bytes':self._numBytes}
+
+class NotModifiedResponse(object):
+  '''
+  The parts of a requests.Response used by genericRest for content served from, or revalidated against, the cache.
+  '''
+  def __init__(self, url, meta):
+    self.url=url
+    self.status_code=304
+    self.content=b''
+    self.text=''
+    self.headers={}
+    if meta['etag'] is not None: self.headers['ETag']=meta['etag']
+    if meta['lastModified'] is not None: self.headers['Last-Modified']=meta['lastModified']
+    self.links={}
+    self.fromCache=True
+
+class CachingSession(object):
+  '''
+  Sends GET requests through a Session unless the cache has a fresh response, revalidating stale responses.
+  '''
+  def __init__(self, session, cache):
+    '''
+    :param session (Session): the session to send requests with.
+    :param cache (HttpCache): where responses are stored.
+    '''
+    self.session=session
+    self.cache=cache
+
+  def get(self, url, headers=None, params=None, **kwargs):
+    '''
+    :return: the response, or one with status 304 if it has not changed since it was stored.
+    '''
+    key=self.cache.key(url, headers, params)
+    meta=self.cache.lookup(key)
+    if meta is not None and self.cache.isFresh(meta):
+      self.cache.touch(key)
+      self.cache.count(hit=True, numBytesSaved=meta['size'])
+      return NotModifiedResponse(url, meta)
+    conditionalHeaders=dict(headers or {})
+    if meta is not None:
+      if meta['etag'] is not None: conditionalHeaders['If-None-Match']=meta['etag']
+      if meta['lastModified'] is not None: conditionalHeaders['If-Modified-Since']=meta['lastModified']
+    response=self.session.get(url, headers=conditionalHeaders, params=params, **kwargs)
+    if response.status_code==304 and meta is not None:
+      self.cache.renew(key, response)
+      self.cache.touch(key)
+      self.cache.count(revalidated=True, numBytesSaved=meta['size'])
+    else:
+      self.cache.count()
+      if response.status_code==200: self.cache.store(key, url, response)
+    return response
+
+  def discard(self, url, headers=None, params=None):
+    self.cache.discard(self.cache.key(url, headers, params))
+
+  def close(self):
+    self.session.close()
@@ -0,0 +1,197 @@
+# Keeps the requests sent to each host of an API within its quota, and backs off when the API says it is overloaded:
+#   - Every host has a token bucket that refills at up to rate requests per second, and a limit on the number of
+#     requests in progress.
+#   - Both adapt to the responses of the host (additive increase, multiplicative decrease): every success raises them
+#     back towards their maximum, every 429 Too Many Requests or 5xx halves them (at most once per cooldown.)
+#   - A Retry-After header pauses every request to the host until the time it gives.
+#   - Throttled and failed requests are retried after a jittered exponential backoff, up to tries times in all.
+#     limiter=RateLimiter(rate=5.0)
+#     session=RateLimitedSession(Session(), limiter)
+#     response=session.get(url, headers=headers, params=parameters)
+import email.utils
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+_logger=logging.getLogger(__name__)
+
+def _retryAfter(response):
+  '''
+  :return: the seconds to wait given by the Retry-After header of the response, or None if it has none.
+  '''
+  value=getattr(response, 'headers', {}).get('Retry-After')
+  if value is None: return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  try:
+    return max(0.0, email.utils.parsedate_to_datetime(value).timestamp()-time.time())
+  except (TypeError, ValueError):
+    _logger.warning('Ignoring Retry-After header "{value}", which is not a number of seconds or a date.'.format(
+      value=value))
+    return None
+
+class _Host(object):
+  '''
+  The token bucket, concurrency limit and pause of one host.
+  '''
+  def __init__(self, rate, burst, maxConcurrency):
+    self.rate=rate
+    self.concurrency=float(maxConcurrency)
+    self.tokens=float(burst)
+    self.updated=time.time()
+    self.active=0
+    self.pausedUntil=0.0
+    self.decreased=0.0
+    self.condition=threading.Condition()
+
+class RateLimiter(object):
+  '''
+  Adaptive per-host token buckets and concurrency limits.
+  '''
+  def __init__(self, rate=10.0, burst=None, minRate=0.1, maxConcurrency=4, tries=4, backoff=0.5, maxBackoff=60.0,
+               cooldown=1.0):
+    '''
+    :param rate: the most requests per second to send to each host, i.e. its quota.
+    :param burst: the number of requests that can be sent at once after a pause; defaults to rate.
+    :param minRate: the rate is never decreased below this.
+    :param maxConcurrency: the most requests in progress per host.
+    :param tries: the number of times a request is sent before its last response (or error) is returned.
+    :param backoff: seconds to wait before the first retry, doubling with every retry (before jitter.)
+    :param maxBackoff: the longest wait before a retry.
+    :param cooldown: seconds after a decrease during which other throttled responses do not decrease again, since they
+           were most likely sent before the first one arrived.
+    '''
+    if rate<=0 or minRate<=0: raise ValueError('The rate of requests must be more than 0 per second.')
+    self._maxRate=rate
+    self._burst=max(1.0, rate if burst is None else burst)
+    self._minRate=min(minRate, rate)
+    self._maxConcurrency=maxConcurrency
+    self._tries=tries
+    self._backoff=backoff
+    self._maxBackoff=maxBackoff
+    self._cooldown=cooldown
+    self._hosts={}
+    self._lock=threading.Lock()
+    self.numRequests=0
+    self.numThrottled=0
+    self.numRetries=0
+
+  def _host(self, url):
+    name=urlparse(url).netloc
+    with self._lock:
+      if name not in self._hosts: self._hosts[name]=_Host(self._maxRate, self._burst, self._maxConcurrency)
+      return self._hosts[name]
+
+  def acquire(self, url):
+    '''
+    Wait until a request can be sent to the host of url; every acquire must be followed by a release.
+    :return (_Host): pass to release.
+    '''
+    host=self._host(url)
+    with host.condition:
+      while True:
+        now=time.time()
+        host.tokens=min(self._burst, host.tokens+(now-host.updated)*host.rate)
+        host.updated=now
+        if host.pausedUntil>now:
+          wait=host.pausedUntil-now
+        elif host.active>=int(host.concurrency):
+          wait=None  # Until a request completes.
+        elif host.tokens<1.0:
+          wait=(1.0-host.tokens)/host.rate
+        else:
+          host.tokens-=1.0
+          host.active+=1
+          return host
+        host.condition.wait(wait)
+
+  def release(self, host, throttled=False, retryAfter=None):
+    '''
+    :param host: returned by acquire.
+    :param throttled: True for a 429 or 5xx response, which halves the rate and concurrency of the host.
+    :param retryAfter: seconds during which no request is to be sent to the host.
+    '''
+    with host.condition:
+      host.active-=1
+      now=time.time()
+      if throttled:
+        if now-host.decreased>=self._cooldown:
+          host.rate=max(self._minRate, host.rate/2)
+          host.concurrency=max(1.0, host.concurrency/2)
+          host.decreased=now
+      else:
+        host.rate=min(self._maxRate, host.rate+self._maxRate/10)
+        host.concurrency=min(float(self._maxConcurrency), host.concurrency+1/host.concurrency)
+      if retryAfter is not None: host.pausedUntil=max(host.pausedUntil, now+retryAfter)
+      host.condition.notify_all()
+    with self._lock:
+      self.numRequests+=1
+      if throttled: self.numThrottled+=1
+
+  def _wait(self, trial, retryAfter=None):
+    '''
+    :return: seconds to wait before retry number trial+1, with full jitter and no less than retryAfter.
+    '''
+    wait=random.uniform(0, min(self._maxBackoff, self._backoff*2**trial))
+    return wait if retryAfter is None else max(wait, retryAfter)
+
+  def request(self, session, method, url, **kwargs):
+    '''
+    Send a request through session, retrying it while it is throttled, fails with a 5xx or cannot connect.
+    :return: the last response; raises the last error if no response was received.
+    '''
+    for trial in range(self._tries):
+      host=self.acquire(url)
+      try:
+        response=session.request(method, url, **kwargs)
+      except Exception as ex:
+        self.release(host, throttled=True)
+        if trial+1==self._tries: raise
+        wait=self._wait(trial)
+        _logger.warning('Error calling {url}, retrying in {wait:.1f}s: {error}'.format(url=url, wait=wait, error=str(ex)))
+      else:
+        throttled=response.status_code==429 or response.status_code>=500
+        retryAfter=_retryAfter(response) if throttled else None
+        self.release(host, throttled=throttled, retryAfter=retryAfter)
+        if not throttled or trial+1==self._tries: return response
+        wait=self._wait(trial, retryAfter)
+        _logger.warning('{url} responded with status {status:d}, retrying in {wait:.1f}s.'.format(
+          url=url, status=response.status_code, wait=wait))
+        response.close()
+      with self._lock: self.numRetries+=1
+      time.sleep(wait)
+
+  def getStats(self):
+    '''
+    :return (dict): requests sent, throttled (429s, 5xx and errors), retries and the current rate and concurrency of
+             every host.
+    '''
+    with self._lock:
+      return {'requests':self.numRequests, 'throttled':self.numThrottled, 'retries':self.numRetries,
+              'hosts':dict((name, {'rate':host.rate, 'concurrency':int(host.concurrency)})
+                           for name, host in self._hosts.items())}
+
+class RateLimitedSession(object):
+  '''
+  Sends requests through a Session within the limits of a RateLimiter.
+  '''
+  def __init__(self, session, limiter):
+    '''
+    :param session (Session): the session to send requests with.
+    :param limiter (RateLimiter): shared by all sessions that call the same APIs.
+    '''
+    self.session=session
+    self.limiter=limiter
+
+  def request(self, method, url, **kwargs):
+    return self.limiter.request(self.session, method, url, **kwargs)
+
+  def get(self, url, **kwargs):
+    return self.request('GET', url, **kwargs)
+
+  def close(self):
+    self.session.close()
@@ -0,0 +1,94 @@
+# Remembers the IDs of content that has already been written/published (see DataProcessor._seenKey) so that polling an
+# API that returns unchanged data does not write the same content again. The most recent IDs are kept in memory in
+# least-recently-used order. With a path, IDs are also appended to a local file (one ID per line) that is read back
+# on start-up, so that a restarted process (or a warm Cloud Function instance) does not rewrite what it already wrote:
+#   seen=SeenSet(capacity=100000, path='/tmp/genericRest.seen')
+#   if not seen.contains(recordKey):
+#     ... write ...
+#     seen.add(recordKey)
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+_logger=logging.getLogger(__name__)
+
+class SeenSet(object):
+  '''
+  A bounded set of IDs with least-recently-used eviction and an optional append-only file.
+  '''
+  def __init__(self, capacity=100000, path=None):
+    '''
+    :param capacity: the number of IDs to remember.
+    :param path: a local file to keep the IDs in between runs (optional).
+    '''
+    self._capacity=capacity
+    self._path=path
+    self._ids=OrderedDict()
+    self._lock=threading.Lock()
+    self._linesInFile=0
+    self.numHits=0
+    self.numMisses=0
+    if path is not None: self._load()
+
+  def _load(self):
+    if not os.path.exists(self._path): return
+    try:
+      with open(self._path) as seenFile:
+        for line in seenFile:
+          key=line.strip()
+          if len(key)==0: continue
+          self._linesInFile+=1
+          self._ids[key]=True
+          self._ids.move_to_end(key)
+          if len(self._ids)>self._capacity: self._ids.popitem(last=False)
+    except:
+      _logger.error('Cannot load seen IDs from '+self._path+', starting empty.', exc_info=True)
+
+  def _compact(self):
+    '''
+    Rewrite the file with only the IDs that are remembered; replaced atomically so that an interrupted rewrite never
+    loses the file.
+    '''
+    temporaryPath=self._path+'.tmp'
+    with open(temporaryPath, 'w') as seenFile:
+      seenFile.write(''.join(key+'\n' for key in self._ids))
+    os.replace(temporaryPath, self._path)
+    self._linesInFile=len(self._ids)
+
+  def __len__(self):
+    return len(self._ids)
+
+  def contains(self, key):
+    '''
+    :return (bool): True if the ID has been added (and not evicted since); counted as a hit or a miss.
+    '''
+    with self._lock:
+      if key in self._ids:
+        self._ids.move_to_end(key)
+        self.numHits+=1
+        return True
+      self.numMisses+=1
+      return False
+
+  def add(self, key):
+    with self._lock:
+      if key in self._ids:
+        self._ids.move_to_end(key)
+        return
+      self._ids[key]=True
+      if len(self._ids)>self._capacity: self._ids.popitem(last=False)
+      if self._path is None: return
+      try:
+        if self._linesInFile>=2*self._capacity:
+          self._compact()
+        else:
+          with open(self._path, 'a') as seenFile:
+            seenFile.write(key+'\n')
+          self._linesInFile+=1
+      except:
+        _logger.error('Cannot save seen IDs to '+self._path, exc_info=True)
+
+  def getStats(self):
+    with self._lock:
+      return {'size':len(self._ids), 'hits':self.numHits, 'misses':self.numMisses}
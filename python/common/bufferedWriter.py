@@ -0,0 +1,202 @@
+# Writes records to Cloud Storage in batches instead of one object per record: records are buffered and written as one
+# object once the buffer reaches rollBytes or its oldest record is rollSeconds old. Objects are uploaded on background
+# threads so that the thread producing records only serializes them, and at most two objects per upload thread wait in
+# memory (writing blocks once they do.) Call close (or flush) to write what is still buffered; this also happens when
+# the process exits:
+#   writer=BufferedWriter('mgmt59000_twitter_tweets', lambda:'tweets/'+str(time.time())+'.json')
+#   writer.write(records, onWritten=lambda succeeded: ...)
+#   ...
+#   writer.close()
+# Records are written as NDJSON (one JSON object per line) unless an encoder is given (see flight.stream.outputFormats.)
+# Encoders that are not line based (Parquet, Avro) are given the records themselves, whose size is estimated from
+# their length as JSON.
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import storage
+
+from common import serialization
+
+_logger=logging.getLogger(__name__)
+
+class _NdjsonLines(object):
+  '''
+  Uncompressed newline delimited JSON, the default encoding.
+  '''
+  lineBased=True
+  extension='.json'
+  contentType='application/x-ndjson'
+
+  def encodeLines(self, lines):
+    return b'\n'.join(lines)+b'\n'
+
+class BufferedWriter(object):
+  '''
+  Buffers records for one bucket and uploads them as objects rolled on size or age.
+  '''
+  def __init__(self, bucket, createObjectKey, rollBytes=8*1024*1024, rollSeconds=60.0, uploadThreads=2,
+               bucketClient=None, encoder=None, chunkSize=None):
+    '''
+    :param bucket: the name of the bucket to write to.
+    :param createObjectKey: a function returning the name of the next object (including its path.)
+    :param rollBytes: write an object once this many bytes are buffered.
+    :param rollSeconds: write an object once the oldest buffered record is this many seconds old.
+    :param uploadThreads: the number of objects uploaded at the same time.
+    :param bucketClient: the bucket to write to; created once, the first time an object is written, if not given.
+    :param encoder: an encoder from outputFormats; defaults to uncompressed NDJSON.
+    :param chunkSize: upload objects in parts of this size (a multiple of 256KB) with resumable uploads if given.
+    '''
+    self._bucket=bucket
+    self._createObjectKey=createObjectKey
+    self._rollBytes=rollBytes
+    self._rollSeconds=rollSeconds
+    self._bucketClient=bucketClient
+    self._encoder=_NdjsonLines() if encoder is None else encoder
+    self._chunkSize=chunkSize
+    self._clientLock=threading.Lock()
+    self._lock=threading.Lock()
+    self._buffered=[]
+    self._bufferedBytes=0
+    self._oldest=None
+    # Called with the outcome of the upload of the object holding what is buffered.
+    self._onWritten=[]
+    # Bounds the number of objects held in memory while they wait to be uploaded.
+    self._numUploadSlots=2*uploadThreads
+    self._uploadSlots=threading.BoundedSemaphore(self._numUploadSlots)
+    self._uploads=ThreadPoolExecutor(max_workers=uploadThreads)
+    self.numFlushes=0
+    self.numFailed=0
+    self.numRecordsFlushed=0
+    self.numBytesFlushed=0
+    self.flushSeconds=0.0
+    self.lastFlush=None
+    self._closed=threading.Event()
+    self._roller=threading.Thread(target=self._rollOnAge, name='BufferedWriter-'+bucket, daemon=True)
+    self._roller.start()
+    atexit.register(self.close)
+
+  def _getBucketClient(self):
+    with self._clientLock:
+      if self._bucketClient is None: self._bucketClient=storage.Client().bucket(self._bucket)
+      return self._bucketClient
+
+  def _rollOnAge(self):
+    while not self._closed.wait(min(1.0, self._rollSeconds)):
+      with self._lock:
+        expired=self._oldest is not None and time.time()-self._oldest>=self._rollSeconds
+      if expired: self._roll()
+
+  def _roll(self):
+    '''
+    Hand the buffered records to an upload thread.
+    '''
+    with self._lock:
+      if len(self._buffered)==0: return
+      buffered, self._buffered=self._buffered, []
+      onWritten, self._onWritten=self._onWritten, []
+      self._bufferedBytes=0
+      self._oldest=None
+      key=self._createObjectKey()
+    self._uploadSlots.acquire()
+    try:
+      self._uploads.submit(self._upload, key, buffered, onWritten)
+    except RuntimeError:
+      # The interpreter is exiting (close is called at exit after the upload threads stop); upload on this thread.
+      self._upload(key, buffered, onWritten)
+
+  def _upload(self, key, buffered, onWritten=()):
+    start=time.time()
+    succeeded=False
+    try:
+      if self._encoder.lineBased:
+        content=self._encoder.encodeLines(buffered)
+      else:
+        content=self._encoder.encode(buffered)
+      self._getBucketClient().blob(key, chunk_size=self._chunkSize).upload_from_string(
+        content, content_type=self._encoder.contentType)
+      seconds=time.time()-start
+      with self._lock:
+        self.numFlushes+=1
+        self.numRecordsFlushed+=len(buffered)
+        self.numBytesFlushed+=len(content)
+        self.flushSeconds+=seconds
+        self.lastFlush={'records':len(buffered), 'bytes':len(content), 'seconds':seconds}
+      _logger.debug('Wrote {num:d} records ({bytes:d} bytes) to {key} in {seconds:.3f}s.'.format(
+        num=len(buffered), bytes=len(content), key=key, seconds=seconds))
+      succeeded=True
+    except:
+      with self._lock: self.numFailed+=1
+      _logger.error('Failed to write to GCS bucket {bucket}, object {objectName}.'.format(
+        bucket=self._bucket,
+        objectName=key
+      ), exc_info=True, stack_info=True)
+    finally:
+      # Before the slot is released, so that flush returns only once the callbacks have run.
+      for callback in onWritten:
+        try:
+          callback(succeeded)
+        except:
+          _logger.error('Error in a callback for object {objectName}.'.format(objectName=key), exc_info=True)
+      self._uploadSlots.release()
+
+  def write(self, records, onWritten=None):
+    '''
+    Buffer records, writing an object if the buffer is full.
+    :param records (list): dicts representing records.
+    :param onWritten: called with True once the object holding the records has been written, or with False if writing
+           it failed. Called right away (with True) if there are no records.
+    :return: the number of records buffered.
+    '''
+    if len(records)==0:
+      if onWritten is not None: onWritten(True)
+      return 0
+    if self._encoder.lineBased:
+      buffered=[serialization.dumps(record) for record in records]
+      numBytes=sum(map(len, buffered))+len(buffered)
+    else:
+      # Estimated from one record rather than serializing every record only to measure it.
+      buffered=records
+      numBytes=len(serialization.dumps(records[0]))*len(records)
+    with self._lock:
+      if self._oldest is None: self._oldest=time.time()
+      self._buffered.extend(buffered)
+      if onWritten is not None: self._onWritten.append(onWritten)
+      self._bufferedBytes+=numBytes
+      full=self._bufferedBytes>=self._rollBytes
+    if full: self._roll()
+    return len(buffered)
+
+  def flush(self):
+    '''
+    Write everything that is buffered and wait for all uploads to finish.
+    '''
+    self._roll()
+    # Every upload holds a slot until it is finished.
+    slots=0
+    try:
+      while slots<self._numUploadSlots:
+        self._uploadSlots.acquire()
+        slots+=1
+    finally:
+      for slot in range(slots): self._uploadSlots.release()
+
+  def close(self):
+    if self._closed.is_set(): return
+    self._closed.set()
+    self.flush()
+    self._uploads.shutdown(wait=True)
+    atexit.unregister(self.close)
+
+  def getStats(self):
+    '''
+    :return (dict): the number of objects written (flushes) and failed, the records and bytes they held, the average
+             seconds a flush took, the size of the last flush and the bytes still buffered.
+    '''
+    with self._lock:
+      return {'flushes':self.numFlushes, 'failed':self.numFailed, 'records':self.numRecordsFlushed,
+              'bytes':self.numBytesFlushed,
+              'flushSeconds':self.flushSeconds/self.numFlushes if self.numFlushes>0 else 0.0,
+              'lastFlush':self.lastFlush, 'bufferedBytes':self._bufferedBytes}
@@ -0,0 +1,102 @@
+# Serializes records to JSON as bytes, ready to be written to Cloud Storage or published to Pub/Sub, without building an
+# intermediate str. orjson is used when it is installed (pip install orjson); otherwise the standard library json
+# module is used. Both backends write compact JSON (no spaces after separators) encoded as UTF-8.
+#   line=dumps(record)
+#   content=dumpLines(records)  # newline delimited JSON
+# A Serializer additionally writes the keys of every record in a stable order (see Serializer.)
+import json
+
+try:
+  import orjson
+except ImportError:
+  orjson=None
+
+backend='orjson' if orjson is not None else 'json'
+
+_encoder=json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+def _dumpsStandard(value):
+  return _encoder.encode(value).encode('utf-8')
+
+if orjson is not None:
+  def dumps(value):
+    '''
+    :param value: any value that can be converted into JSON.
+    :return (bytes): the value as UTF-8 encoded JSON.
+    '''
+    try:
+      return orjson.dumps(value)
+    except TypeError:
+      # orjson is stricter (e.g. integers beyond 64 bits, keys that are not strings); let json handle those.
+      return _dumpsStandard(value)
+
+  def loads(data):
+    '''
+    :param data (bytes or str): JSON.
+    :return: the decoded value.
+    '''
+    return orjson.loads(data)
+else:
+  def dumps(value):
+    '''
+    :param value: any value that can be converted into JSON.
+    :return (bytes): the value as UTF-8 encoded JSON.
+    '''
+    return _dumpsStandard(value)
+
+  def loads(data):
+    '''
+    :param data (bytes or str): JSON.
+    :return: the decoded value.
+    '''
+    return json.loads(data)
+
+def dumpLines(values):
+  '''
+  :param values: an iterable of values that can be converted into JSON.
+  :return (bytes): newline delimited JSON with one line per value.
+  '''
+  return b'\n'.join(map(dumps, values))
+
+class Serializer(object):
+  '''
+  Serializes dicts with their keys in a stable order: the order of keyOrder, followed by any other keys sorted by name
+  (all keys sorted by name if keyOrder is not given.) Instead of sorting the keys of every record, the order is worked
+  out once for every distinct layout of keys, and records whose keys are already in order are written as they are.
+  '''
+  # Bounds the memory used to remember layouts when records have many different sets of keys.
+  maxLayouts=1024
+
+  def __init__(self, keyOrder=None):
+    '''
+    :param keyOrder: a list of the keys to write first, in this order.
+    '''
+    self._rank=dict((key, index) for index, key in enumerate(keyOrder or []))
+    # tuple of keys -> None if they are already in order, otherwise the keys in order.
+    self._layouts={}
+
+  def _sortKey(self, key):
+    return (self._rank.get(key, len(self._rank)), str(key))
+
+  def _ordered(self, record):
+    keys=tuple(record)
+    layout=self._layouts.get(keys, False)
+    if layout is False:
+      ordered=tuple(sorted(keys, key=self._sortKey))
+      layout=None if ordered==keys else ordered
+      if len(self._layouts)<self.maxLayouts: self._layouts[keys]=layout
+    if layout is None: return record
+    return dict((key, record[key]) for key in layout)
+
+  def dumps(self, record):
+    '''
+    :param record: a dict (other values are written as by dumps.)
+    :return (bytes): the record as UTF-8 encoded JSON.
+    '''
+    return dumps(self._ordered(record) if type(record)==dict else record)
+
+  def dumpLines(self, records):
+    '''
+    :return (bytes): newline delimited JSON with one line per record.
+    '''
+    return b'\n'.join(map(self.dumps, records))
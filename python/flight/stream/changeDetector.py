@@ -0,0 +1,146 @@
+# Change detection for the OpenSky scavenger. A ChangeDetector remembers the last state emitted for every aircraft
+# (keyed by icao24) and only lets a record through when the aircraft has moved, climbed, sped up or turned by more than
+# a threshold since then, or when the last emitted record has become too old.
+#
+# The table lives as long as the process, so a long-running poller only emits what changed between polls. It can be
+# saved to and loaded from a local file to survive restarts:
+#   detector=ChangeDetector.load('/tmp/flightDeltas.json')
+#   records=detector.filter(records, queryTime)
+#   detector.save('/tmp/flightDeltas.json')
+import json
+import logging
+import math
+import os
+
+_logger=logging.getLogger(__name__)
+
+_earthRadiusMeters=6371000.0
+
+class ChangeDetector(object):
+  '''
+  Filters converted flight records (dicts as produced by openSkyParser) down to those that changed meaningfully since
+  the last record emitted for the same aircraft.
+  '''
+  # Thresholds that can be given to the constructor or to setThresholds.
+  thresholdNames=['positionMeters', 'altitudeMeters', 'velocity', 'headingDegrees', 'maxStaleness', 'evictAfter']
+
+  def __init__(self, positionMeters=500.0, altitudeMeters=100.0, velocity=10.0, headingDegrees=10.0,
+               maxStaleness=300.0, evictAfter=3600.0):
+    '''
+    :param positionMeters: emit when the aircraft moved further than this from its last emitted position.
+    :param altitudeMeters: emit when the altitude changed by more than this.
+    :param velocity: emit when the velocity changed by more than this (m/s).
+    :param headingDegrees: emit when the heading changed by more than this (degrees).
+    :param maxStaleness: emit when the last record for the aircraft was emitted more than this many seconds ago.
+    :param evictAfter: forget aircraft that have not been emitted for this many seconds.
+    '''
+    self.positionMeters=positionMeters
+    self.altitudeMeters=altitudeMeters
+    self.velocity=velocity
+    self.headingDegrees=headingDegrees
+    self.maxStaleness=maxStaleness
+    self.evictAfter=evictAfter
+    # icao24 -> (emitted at, latitude, longitude, altitude, velocity, heading) of the last emitted record.
+    self._table={}
+    self.numEmitted=0
+    self.numSuppressed=0
+    self.numEvicted=0
+
+  def setThresholds(self, **thresholds):
+    for name, value in thresholds.items():
+      if name not in self.thresholdNames:
+        raise ValueError('Unknown change detection threshold "{name}".'.format(name=name))
+      setattr(self, name, float(value))
+
+  def __len__(self):
+    return len(self._table)
+
+  @staticmethod
+  def _exceeds(previous, current, threshold):
+    if previous is None or current is None: return previous is not current
+    return abs(current-previous)>threshold
+
+  def _changed(self, last, state):
+    if state[0]-last[0]>=self.maxStaleness: return True
+    if last[1] is None or state[1] is None or last[2] is None or state[2] is None:
+      if (last[1] is None)!=(state[1] is None) or (last[2] is None)!=(state[2] is None): return True
+    else:
+      # Equirectangular approximation, accurate enough for distances of a few kilometers.
+      x=math.radians(state[2]-last[2])*math.cos(math.radians((state[1]+last[1])/2))
+      y=math.radians(state[1]-last[1])
+      if _earthRadiusMeters*math.hypot(x, y)>self.positionMeters: return True
+    if self._exceeds(last[3], state[3], self.altitudeMeters): return True
+    if self._exceeds(last[4], state[4], self.velocity): return True
+    if last[5] is None or state[5] is None: return last[5] is not state[5]
+    turn=abs(state[5]-last[5])%360
+    return min(turn, 360-turn)>self.headingDegrees
+
+  def filter(self, records, now):
+    '''
+    :param records: a list of dicts representing flight records.
+    :param now: the time of the poll the records came from, in seconds since epoch.
+    :return (list): the records to emit. Records without an icao24 are always emitted.
+    '''
+    emitted=[]
+    for record in records:
+      icao24=record.get('icao24')
+      if icao24 is None:
+        emitted.append(record)
+        continue
+      state=(now, record.get('latitude'), record.get('longitude'), record.get('altitude'), record.get('velocity'),
+             record.get('heading'))
+      last=self._table.get(icao24)
+      if last is None or self._changed(last, state):
+        self._table[icao24]=state
+        emitted.append(record)
+      else:
+        self.numSuppressed+=1
+    self.numEmitted+=len(emitted)
+    self.evict(now)
+    return emitted
+
+  def evict(self, now):
+    '''
+    Forget aircraft whose last record was emitted more than evictAfter seconds before now.
+    :return: the number of aircraft forgotten.
+    '''
+    expired=[icao24 for icao24, state in self._table.items() if now-state[0]>self.evictAfter]
+    for icao24 in expired:
+      del self._table[icao24]
+    self.numEvicted+=len(expired)
+    return len(expired)
+
+  def getStats(self):
+    return {'aircraft':len(self._table), 'emitted':self.numEmitted, 'suppressed':self.numSuppressed,
+            'evicted':self.numEvicted}
+
+  def save(self, path):
+    '''
+    Write the state table and thresholds to a local file. The file is replaced atomically so that an interrupted save
+    never leaves a partial checkpoint behind.
+    '''
+    checkpoint={'thresholds':dict((name, getattr(self, name)) for name in self.thresholdNames),
+                'states':self._table}
+    temporaryPath=path+'.tmp'
+    with open(temporaryPath, 'w') as checkpointFile:
+      json.dump(checkpoint, checkpointFile)
+    os.replace(temporaryPath, path)
+
+  @classmethod
+  def load(cls, path, **thresholds):
+    '''
+    :param path: a file written by save. If it does not exist, an empty ChangeDetector is returned.
+    :param thresholds: thresholds that override the ones saved in the file.
+    :return (ChangeDetector):
+    '''
+    detector=cls()
+    if os.path.exists(path):
+      try:
+        with open(path) as checkpointFile:
+          checkpoint=json.load(checkpointFile)
+        detector.setThresholds(**checkpoint.get('thresholds', {}))
+        detector._table=dict((icao24, tuple(state)) for icao24, state in checkpoint.get('states', {}).items())
+      except:
+        _logger.error('Cannot load change detection checkpoint from '+path+', starting empty.', exc_info=True)
+    detector.setThresholds(**thresholds)
+    return detector
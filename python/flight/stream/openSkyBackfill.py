@@ -0,0 +1,227 @@
+# Backfills flight data for a past time range (e.g. after an outage) using OpenSky's historical state vectors. The
+# snapshot at every step of the range is fetched and written/published through the same Sinks as openSkyParser:
+#   - Timestamps are handed to a bounded pool of workers. Requests to OpenSky go out one at a time, as fast as its rate
+#     limit allows, while the other workers convert and write the snapshots already fetched.
+#   - Every finished timestamp is recorded in a local checkpoint file, so rerunning an interrupted backfill with the same
+#     checkpoint only fetches what is missing (including timestamps that failed.) Timestamps are only recorded once the
+#     sinks have been flushed without errors, every checkpointEvery snapshots, so that records still buffered by
+#     RollingStorage or waiting for Pub/Sub are never lost to a crash.
+# OpenSky only serves historical state vectors to registered users (and only for the last hour), so pass a username and
+# password:
+#   PYTHONPATH=~/classResources/python python ~/classResources/python/flight/stream/openSkyBackfill.py \
+#     -username me -password secret -start "2020-09-13 12:00:00" -end "2020-09-13 12:30:00" -step 60 \
+#     -checkpoint /tmp/backfill.json -storage -bucket prof-big-data_data -path flights_backfill
+import calendar
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from flight.stream.openSkyParser import Sinks, _getApi, _processFlightStates
+from flight.stream.opensky_api import OpenSkyApi
+
+_logger=logging.getLogger(__name__)
+
+def _parseTime(value):
+  '''
+  :param value: seconds since epoch or a UTC date and time formatted as YYYY-MM-DD HH:MM:SS (or YYYY-MM-DDTHH:MM:SS.)
+  :return (int): seconds since epoch.
+  '''
+  try:
+    return int(float(value))
+  except ValueError:
+    return calendar.timegm(datetime.datetime.strptime(value.replace('T', ' '), '%Y-%m-%d %H:%M:%S').timetuple())
+
+class OpenSkyBackfill(object):
+  '''
+  Fetches the OpenSky snapshots for every step of a time range and outputs their records.
+  '''
+  def __init__(self, sinks, start, end, step=60, checkpoint=None, workers=4, tries=3, limit=None, columnar=False,
+               api=None, debug=None, checkpointEvery=10):
+    '''
+    :param sinks (Sinks): where to output the records of each snapshot.
+    :param start: the first time to fetch, in seconds since epoch.
+    :param end: the last time to fetch (inclusive.)
+    :param step: seconds between the snapshots fetched.
+    :param checkpoint: a local file recording the timestamps already done.
+    :param workers: the number of snapshots fetched or processed at the same time.
+    :param tries: the number of times to try to fetch each snapshot.
+    :param limit: a limit on the number of rows to write/publish per snapshot.
+    :param columnar: decode snapshots into typed columns (see openSkyParser.)
+    :param api (OpenSkyApi): the client to use; defaults to the one shared with openSkyParser.
+    :param debug: set to 10 to see debug statements.
+    :param checkpointEvery: flush the sinks and record the timestamps processed once this many are waiting.
+    '''
+    self._sinks=sinks
+    self._timestamps=list(range(int(start), int(end)+1, int(step)))
+    self._checkpoint=checkpoint
+    self._workers=workers
+    self._tries=tries
+    self._limit=limit
+    self._columnar=columnar
+    self._api=_getApi() if api is None else api
+    self._debug=debug
+    self._checkpointEvery=checkpointEvery
+    # Requests are serialized; OpenSky's rate limit only lets one through per interval anyway.
+    self._fetchLock=threading.Lock()
+    self._lock=threading.Lock()
+    self._commitLock=threading.Lock()
+    self._completed=self._loadCheckpoint()
+    # Timestamps processed but not yet flushed, see _commit.
+    self._processed=[]
+    self.numFetched=0
+    self.numFailed=0
+    self.numRecords=0
+
+  def _loadCheckpoint(self):
+    if self._checkpoint is None or not os.path.exists(self._checkpoint): return set()
+    try:
+      with open(self._checkpoint) as checkpointFile:
+        return set(json.load(checkpointFile).get('completed', []))
+    except:
+      _logger.error('Cannot load backfill checkpoint from '+self._checkpoint+', starting over.', exc_info=True)
+      return set()
+
+  def _saveCheckpoint(self):
+    '''
+    Replace the checkpoint file atomically so that an interrupted save never leaves a partial checkpoint behind.
+    '''
+    if self._checkpoint is None: return
+    temporaryPath=self._checkpoint+'.tmp'
+    with open(temporaryPath, 'w') as checkpointFile:
+      json.dump({'completed':sorted(self._completed)}, checkpointFile)
+    os.replace(temporaryPath, self._checkpoint)
+
+  def _fetch(self, timestamp):
+    '''
+    :return: the snapshot at the given time or None if none of the tries succeeded.
+    '''
+    for trial in range(self._tries):
+      with self._fetchLock:
+        wait=self._api.get_states_wait()
+        if wait>0: time.sleep(wait)
+        try:
+          flightStates=self._api.get_states(time_secs=timestamp, columnar=self._columnar)
+        except:
+          _logger.error('Failed in call to OpenSky for time {timestamp:d}.'.format(timestamp=timestamp), exc_info=True)
+          flightStates=None
+        if flightStates is None and self._api.get_states_wait()==0:
+          # The request failed without counting against the rate limit; do not retry immediately.
+          time.sleep(self._api.get_states_interval())
+      if flightStates is not None: return flightStates
+    return None
+
+  def _backfill(self, timestamp):
+    flightStates=self._fetch(timestamp)
+    if flightStates is None:
+      with self._lock: self.numFailed+=1
+      _logger.warning('Cannot fetch flight data for time {timestamp:d}, will retry it on the next run.'.format(
+        timestamp=timestamp))
+      return
+    numRecords=_processFlightStates(flightStates, timestamp, self._sinks, limit=self._limit, debug=self._debug)
+    with self._lock:
+      self.numFetched+=1
+      self.numRecords+=numRecords
+      self._processed.append(timestamp)
+      due=len(self._processed)>=self._checkpointEvery
+    if due: self._commit()
+
+  def _commit(self):
+    '''
+    Flush the sinks and record the timestamps processed before the flush as completed, unless anything failed to be
+    written or published, in which case they are fetched again on the next run.
+    '''
+    with self._commitLock:
+      with self._lock:
+        processed, self._processed=self._processed, []
+      if len(processed)==0: return
+      if not self._sinks.flush():
+        with self._lock: self.numFailed+=len(processed)
+        _logger.warning('Failed to output some records of {num:d} snapshots, will retry them on the next run.'.format(
+          num=len(processed)))
+        return
+      with self._lock:
+        self._completed.update(processed)
+        try:
+          self._saveCheckpoint()
+        except:
+          _logger.error('Cannot save backfill checkpoint to '+self._checkpoint, exc_info=True, stack_info=True)
+
+  def run(self):
+    '''
+    Fetch and output every timestamp in the range that is not already in the checkpoint.
+    :return (dict): the statistics of the backfill (see getStats.)
+    '''
+    remaining=[timestamp for timestamp in self._timestamps if timestamp not in self._completed]
+    _logger.info(json.dumps({'log':'Backfilling {num:d} of {total:d} snapshots.'.format(
+      num=len(remaining), total=len(self._timestamps))}))
+    with ThreadPoolExecutor(max_workers=self._workers) as executor:
+      for future in [executor.submit(self._backfill, timestamp) for timestamp in remaining]:
+        try:
+          future.result()
+        except:
+          with self._lock: self.numFailed+=1
+          _logger.error('Failed to process flight data.', exc_info=True, stack_info=True)
+    self._commit()
+    return self.getStats()
+
+  def getStats(self):
+    return {'snapshots':len(self._timestamps), 'completed':len(self._completed.intersection(self._timestamps)),
+            'fetched':self.numFetched, 'failed':self.numFailed, 'records':self.numRecords}
+
+if __name__=='__main__':
+  defaultProjectId=os.environ.get('GOOGLE_CLOUD_PROJECT','no_project')
+
+  parser=ArgumentParser(description='Backfill flight data from OpenSky for a past time range and store in Google Cloud.')
+  parser.add_argument('-start',help='The first time to fetch, in seconds since epoch or as "YYYY-MM-DD HH:MM:SS" UTC.',required=True)
+  parser.add_argument('-end',help='The last time to fetch, in seconds since epoch or as "YYYY-MM-DD HH:MM:SS" UTC.',required=True)
+  parser.add_argument('-step',help='Seconds between the snapshots fetched.',default=60,type=int)
+  parser.add_argument('-checkpoint',help='A local file recording the snapshots done so that an interrupted backfill can resume.',default=None)
+  parser.add_argument('-workers',help='The number of snapshots fetched or processed at the same time.',default=4,type=int)
+  parser.add_argument('-username',help='OpenSky user name (historical data requires an account.)',default=None)
+  parser.add_argument('-password',help='OpenSky password.',default=None)
+  parser.add_argument('-separateLines',action='store_true',help='Store each flight record as a separate file or post as a separate pub/sub entry.')
+  parser.add_argument('-limit',help='The maximum number of entries to process per snapshot.',default=None,type=int)
+  parser.add_argument('-log',action='store_true',help='Print out log statements.')
+  parser.add_argument('-credentials',help='Provide a file name of a local file which has credentials for Google Cloud.',default=None)
+  parser.add_argument('-columnar',action='store_true',help='Decode flight data into typed columns instead of one object per aircraft.')
+
+  parser.add_argument('-storage',action='store_true',help='Store as files in Google Cloud Storage.')
+  parser.add_argument('-pubsub',action='store_true',help='Write to a Pub/Sub queue.')
+
+  storageArgs=parser.add_argument_group('storage')
+  storageArgs.add_argument('-bucket',help='The name of the bucket where data is to be stored.',default=None)
+  storageArgs.add_argument('-path',help='The path within the bucket where data is to be stored.',default='flights_backfill')
+  storageArgs.add_argument('-format',help='The format of stored files: json, json.gz, json.zst, parquet or avro.',default=None)
+
+  pubsubArgs=parser.add_argument_group('pub/sub')
+  pubsubArgs.add_argument('-projectId',help='The ID of the project that contains the Pub/Sub queue.',default=defaultProjectId)
+  pubsubArgs.add_argument('-topic', help='The Pub/Sub topic to write data to.',default=None)
+
+  args=parser.parse_args()
+  debug=10 if args.log else None
+  if debug is not None: logging.getLogger().setLevel(debug)
+
+  credentials=None
+  if args.credentials is not None:
+    try:
+      with open(args.credentials) as credentialsContent:
+        credentials=json.load(credentialsContent)
+    except:
+      _logger.error('Cannot load local credentials from path '+args.credentials,exc_info=True,stack_info=True)
+
+  sinks=Sinks(separateLines=args.separateLines,
+              bucket=(args.bucket if args.bucket is not None else args.projectId+'_data') if args.storage else None,
+              path=args.path, projectId=args.projectId, topic=args.topic if args.pubsub else None,
+              credentials=credentials, format=args.format)
+  api=OpenSkyApi(username=args.username, password=args.password) if args.username is not None else None
+  backfill=OpenSkyBackfill(sinks, _parseTime(args.start), _parseTime(args.end), step=args.step,
+                           checkpoint=args.checkpoint, workers=args.workers, limit=args.limit,
+                           columnar=args.columnar, api=api, debug=debug)
+  stats=backfill.run()
+  sinks.close()
+  _logger.info(json.dumps({'log':'OpenSky backfill finished.', 'stats':stats}))
@@ -7,6 +7,24 @@
 #   path: path within the bucket to process the data in (defaults to "flights_streaming".)
 #   separateLines: will create a separate file/message for each record instead of a file/message
 #                  for all records returned from the API call if this flag is present.
+#   columnar: decode the OpenSky snapshot into typed columns and convert rows column by column instead of creating
+#             one object per aircraft (much less CPU and memory for a full world snapshot.)
+#   stream: decode the OpenSky response while it is being downloaded and stop reading it as soon as limit records have
+#           been collected. Records are written/published in batches of streamBatchSize so memory stays flat. Cannot be
+#           combined with columnar (unless tileSize is given, which does not stream.) A response that turns out to be
+#           truncated is requested again, so the records written/published before it broke off are output twice.
+#   delta: only write/publish an aircraft's record when it moved meaningfully since the last record written for it
+#          (see ChangeDetector.) The table of last records is kept between calls within the same process.
+#   deltaCheckpoint: a local file to load the delta table from and save it to after every call.
+#   deltaThresholds: a dict overriding the ChangeDetector thresholds, e.g. {"positionMeters":1000,"maxStaleness":600}.
+#   bbox: only pull flights within [min_latitude, max_latitude, min_longitude, max_longitude].
+#   tileSize: split bbox into tiles of this many degrees (a number or [latitude, longitude]) that are requested
+#             concurrently; tiles that have been empty in recent polls are skipped.
+#   track: keep the latest positions of every aircraft in memory between calls within the same process (see TrackStore.)
+#   record: a local path to record every OpenSky response to (see responseArchive.)
+#   replay: a local path of recorded responses to use instead of calling OpenSky; replaySpeed makes replaying faster.
+#   format: the format of files written to GCS: json (default), json.gz, json.zst, parquet or avro (see outputFormats.)
+#           parquet and avro files always hold all the records of a snapshot and cannot be combined with separateLines.
 #
 # You can test out this code from the command-line:
 #   (Make sure to set your PYTHONPATH to include the code, such as the following for a LINUX system, such as from Cloud Shell:
@@ -43,14 +61,23 @@ import os
 from argparse import ArgumentParser
 import json
 import logging
+import threading
+import time
 
 from google.cloud import storage
 import datetime
 
-from google.cloud.pubsub_v1 import PublisherClient
+from google.cloud.pubsub_v1 import PublisherClient, types
 from google.oauth2 import service_account
 
-from flight.stream.opensky_api import OpenSkyApi
+from common import serialization
+from common.bufferedWriter import BufferedWriter
+from flight.stream.changeDetector import ChangeDetector
+from flight.stream.opensky_api import OpenSkyApi, OpenSkyStateColumns, OpenSkyStatesStream
+from flight.stream.outputFormats import getEncoder
+from flight.stream.responseArchive import RecordingOpenSkyApi, ReplayOpenSkyApi
+from flight.stream.rowConverter import RowConverter
+from flight.stream.trackStore import TrackStore
 
 logging.basicConfig(format='%(asctime)s.%(msecs)03dZ,%(pathname)s:%(lineno)d,%(levelname)s,%(module)s,%(funcName)s: %(message)s',
                     datefmt="%Y-%m-%d %H:%M:%S")
@@ -58,6 +85,82 @@ _logger = logging.getLogger(__name__)
 
 numTries=5 # Number of times to try to get data from OpenSky.
 defaultLimit=30
+streamBatchSize=1000 # Number of records to write/publish at a time when streaming.
+publishTimeout=60 # Number of seconds to wait for queued messages to be published before returning.
+
+# One OpenSky client per process so that warm Cloud Function invocations reuse its connections.
+_api=None
+
+def _getApi():
+  '''
+  :return (OpenSkyApi): the OpenSky client shared by all calls within this process.
+  '''
+  global _api
+  if _api is None: _api = OpenSkyApi()
+  return _api
+
+def _useArchive(record=None, replay=None, replaySpeed=None):
+  '''
+  Replace the OpenSky client shared by all calls within this process with one that records its responses to, or
+  replays them from, a local archive (see responseArchive.) Does nothing if the client already does so.
+  :param record: the path of an archive to record responses to.
+  :param replay: the path of an archive to replay responses from.
+  :param replaySpeed: how many times faster than recorded to replay responses.
+  '''
+  global _api
+  if replay is not None:
+    if not isinstance(_api, ReplayOpenSkyApi):
+      _api = ReplayOpenSkyApi(replay, speed=1.0 if replaySpeed is None else float(replaySpeed))
+  elif record is not None:
+    if not isinstance(_api, RecordingOpenSkyApi):
+      _api = RecordingOpenSkyApi(record)
+
+# The delta table survives between polls within the same process.
+_changeDetector=None
+
+def _getChangeDetector(checkpoint=None, thresholds=None):
+  '''
+  :param checkpoint: a local file to load the table of last emitted records from the first time this is called.
+  :param thresholds: a dict of ChangeDetector thresholds to apply.
+  :return (ChangeDetector): the change detector shared by all calls within this process.
+  '''
+  global _changeDetector
+  if _changeDetector is None:
+    _changeDetector = ChangeDetector.load(checkpoint) if checkpoint is not None else ChangeDetector()
+  if thresholds is not None: _changeDetector.setThresholds(**thresholds)
+  return _changeDetector
+
+# The tracks of all aircraft survive between polls within the same process.
+_trackStore=None
+
+def _getTrackStore(capacity=None, evictAfter=None):
+  '''
+  :param capacity: the number of positions to keep per aircraft the first time this is called.
+  :param evictAfter: forget aircraft that have not been seen for this many seconds.
+  :return (TrackStore): the track store shared by all calls within this process.
+  '''
+  global _trackStore
+  if _trackStore is None:
+    _trackStore = TrackStore() if capacity is None else TrackStore(capacity=capacity)
+  if evictAfter is not None: _trackStore.evictAfter = evictAfter
+  return _trackStore
+
+# Converter compiled from schema/openSky_bigQuery.json the first time it is needed (False if that failed.)
+_rowConverter=None
+
+def _getRowConverter():
+  '''
+  :return (RowConverter): the converter shared by all calls within this process or None if the schema cannot be
+          compiled, in which case _convertRow is used.
+  '''
+  global _rowConverter
+  if _rowConverter is None:
+    try:
+      _rowConverter = RowConverter()
+    except:
+      _logger.error('Cannot compile a row converter from the schema, using _convertRow.',exc_info=True)
+      _rowConverter = False
+  return _rowConverter if _rowConverter else None
 
 class RequestTemplate(object):
   '''
@@ -68,7 +171,9 @@ class RequestTemplate(object):
   def __init__(self,
                query='',limit=None,debug=False,separateLines=True,
                projectId='',topic='',
-               bucket='',path='',storage=False,pubsub=False):
+               bucket='',path='',storage=False,pubsub=False,columnar=False,stream=False,
+               delta=False,deltaCheckpoint=None,deltaThresholds=None,
+               bbox=None,tileSize=None,format=None,track=False,record=None,replay=None,replaySpeed=None):
     if query is not None:
       if type(query) == str:
         if not query.startswith('"'): query = '"' + query + '"'
@@ -83,6 +188,18 @@ class RequestTemplate(object):
                'bucket': bucket if bucket is not None else '',
                'path': path if path is not None else ''}
     if separateLines: message['separateLines']=True
+    if columnar: message['columnar']=True
+    if stream: message['stream']=True
+    if delta: message['delta']=True
+    if deltaCheckpoint is not None: message['deltaCheckpoint']=deltaCheckpoint
+    if deltaThresholds is not None: message['deltaThresholds']=deltaThresholds
+    if bbox is not None: message['bbox']=bbox
+    if tileSize is not None: message['tileSize']=tileSize
+    if format is not None: message['format']=format
+    if track: message['track']=True
+    if record is not None: message['record']=record
+    if replay is not None: message['replay']=replay
+    if replaySpeed is not None: message['replaySpeed']=replaySpeed
     self.args = {'message': json.dumps(message)}
   
   def get_json(self):
@@ -132,6 +249,15 @@ def _getMessageJSON(request):
     messageJSON = message
   return messageJSON
 
+def _checkSeparateLines(separateLines, encoder):
+  '''
+  Raise a ValueError for separateLines with an encoder that is not line based, which would write a Parquet or Avro
+  file (with its own header and schema) for every record.
+  '''
+  if separateLines and encoder is not None and not encoder.lineBased:
+    raise ValueError('Cannot write {extension} files one record per file; use a JSON format with separateLines.'.format(
+      extension=encoder.extension))
+
 class Storage(object):
   '''
   The Storage class handles writing parsed output to Cloud Storage.
@@ -142,50 +268,230 @@ class Storage(object):
     '''
     :return: returns a unique file name to store results in.
     '''
-    filename = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + '_' + str(self._increment)
-    self._increment += 1
+    with self._nameLock:
+      filename = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + '_' + str(self._increment)
+      self._increment += 1
     return filename
   
-  def __init__(self, bucket, folder=None, separateLines=False, project=None, credentials=None):
+  def __init__(self, bucket, folder=None, separateLines=False, project=None, credentials=None, encoder=None,
+               bucketClient=None):
+    '''
+    :param encoder: an encoder from outputFormats to write files with; by default records are written as plain JSON.
+           Only line based encoders can be combined with separateLines.
+    :param bucketClient: a bucket to use instead of creating one from a storage Client (i.e. a fake for tests.)
+    '''
+    _checkSeparateLines(separateLines, encoder)
     self._bucket = bucket
-    if credentials is not None:
-      gcClient=storage.Client(
-        project=credentials['project_id'],
-        credentials=service_account.Credentials.from_service_account_info(credentials)
-      )
-    elif project is not None:
-      gcClient=storage.Client(project=project)
+    if bucketClient is not None:
+      self._client = bucketClient
     else:
-      gcClient=storage.Client()
-    self._client = gcClient.bucket(self._bucket)
+      if credentials is not None:
+        gcClient=storage.Client(
+          project=credentials['project_id'],
+          credentials=service_account.Credentials.from_service_account_info(credentials)
+        )
+      elif project is not None:
+        gcClient=storage.Client(project=project)
+      else:
+        gcClient=storage.Client()
+      self._client = gcClient.bucket(self._bucket)
     self._path = ('flightData' if folder is None else folder)
     self._separateLines = separateLines
+    self._encoder = encoder
+    # Storage may be shared by several threads (see openSkyBackfill.)
+    self._nameLock = threading.Lock()
+    self._statsLock = threading.Lock()
+    self.numFailed = 0
+  
+  def _failed(self, fullpath):
+    _logger.error('Error writing to {path}'.format(path=fullpath),exc_info=True,stack_info=True)
+    with self._statsLock: self.numFailed += 1
+  
+  def _write(self, fullpath, content):
+    try:
+      self._client.blob(fullpath).upload_from_string(content, content_type=self._encoder.contentType)
+    except Exception as ex:
+      self._failed(fullpath)
   
   def process(self, data):
     '''
     Will write data as a series of JSON objects, one per line. NOTE that this is not a JSON list of JSON objects. Big Query will ingest the series of JSON objects on separate lines.
     :param data (list): a list of dicts representing records.
     '''
-    rows = map(lambda row: json.dumps(row), data)
+    if self._encoder is not None:
+      if self._separateLines:
+        for row in data:
+          self._write(self._path + '/' + self._createFileName() + self._encoder.extension, self._encoder.encode([row]))
+      elif len(data) > 0:
+        fullpath=self._path + '/' + self._createFileName() + self._encoder.extension
+        _logger.debug('Storing in file {path}.'.format(path=fullpath))
+        self._write(fullpath, self._encoder.encode(data))
+      return
+    rows = map(serialization.dumps, data)
     if self._separateLines:
       _logger.debug(json.dumps({'log': 'Storing as separate files within {path}.'.format(path=self._path)}))
       for row in rows:
         fullpath=self._path + '/' + self._createFileName()
         try:
-          self._client.blob(fullpath).upload_from_string(row)
+          self._client.blob(fullpath).upload_from_string(row, content_type='application/x-ndjson')
         except Exception as ex:
-          _logger.error('Error writing to {path}'.format(path=fullpath),exc_info=True,stack_info=True)
+          self._failed(fullpath)
     else:
       fullpath=self._path + '/' + self._createFileName()
-      _logger.debug('Storing in file {path}.'.format(path=self._path + '/' + self._createFileName()))
+      _logger.debug('Storing in file {path}.'.format(path=fullpath))
       try:
-        self._client.blob(fullpath).upload_from_string('\n'.join(rows))
+        self._client.blob(fullpath).upload_from_string(b'\n'.join(rows), content_type='application/x-ndjson')
       except Exception as ex:
-        _logger.error('Error writing to {path}'.format(path=fullpath),exc_info=True,stack_info=True)
+        self._failed(fullpath)
+  
+  def flush(self):
+    '''
+    Nothing is buffered; process writes synchronously.
+    '''
+    pass
+  
+  def getStats(self):
+    '''
+    :return (dict): the number of files that failed to be written.
+    '''
+    with self._statsLock:
+      return {'failed':self.numFailed}
+  
+  def close(self):
+    self.flush()
+
+class RollingStorage(Storage):
+  '''
+  Buffers records and writes them to Cloud Storage as one object once rollBytes have been buffered or the oldest
+  buffered record is rollSeconds old, instead of one object per call or per record (see common.bufferedWriter.)
+  Objects are uploaded on background threads with resumable uploads of chunkSize bytes. Call close (or flush) to write
+  what is still buffered; this also happens when the process exits.
+  '''
+  def __init__(self, bucket, folder=None, project=None, credentials=None,
+               rollBytes=64*1024*1024, rollSeconds=300.0, uploadThreads=2, chunkSize=8*1024*1024, encoder=None,
+               bucketClient=None):
+    '''
+    :param bucket: the bucket to write to.
+    :param folder: the path within the bucket to write to.
+    :param project: the project ID to use.
+    :param credentials: a dict of credentials for Google Cloud (optional).
+    :param rollBytes: write an object once this many bytes are buffered.
+    :param rollSeconds: write an object once the oldest buffered record is this many seconds old.
+    :param uploadThreads: the number of objects uploaded at the same time.
+    :param chunkSize: the size of each part of a resumable upload (a multiple of 256KB.)
+    :param encoder: an encoder from outputFormats; defaults to uncompressed NDJSON.
+    :param bucketClient: a bucket to use instead of creating one from a storage Client (i.e. a fake for tests.)
+    '''
+    super().__init__(bucket, folder=folder, separateLines=False, project=project, credentials=credentials,
+                     encoder=getEncoder('json') if encoder is None else encoder, bucketClient=bucketClient)
+    self._writer = BufferedWriter(bucket, self._createObjectKey, rollBytes=rollBytes, rollSeconds=rollSeconds,
+                                  uploadThreads=uploadThreads, bucketClient=self._client, encoder=self._encoder,
+                                  chunkSize=chunkSize)
+  
+  def _createObjectKey(self):
+    return self._path + '/' + self._createFileName() + self._encoder.extension
+  
+  def process(self, data):
+    '''
+    Buffer data, writing an object if the buffer is full.
+    :param data (list): a list of dicts representing records.
+    '''
+    self._writer.write(data)
+  
+  def flush(self):
+    '''
+    Write everything that is buffered and wait for all uploads to finish.
+    '''
+    self._writer.flush()
+  
+  def close(self):
+    self._writer.close()
+  
+  def getStats(self):
+    '''
+    :return (dict): the objects written and failed and the records and bytes they held (see BufferedWriter.getStats.)
+    '''
+    return self._writer.getStats()
+
+class _FlowControl(object):
+  '''
+  Bounds the number and size of messages that have been handed to Pub/Sub but not yet confirmed.
+  '''
+  def __init__(self, maxMessages, maxBytes):
+    self._maxMessages = maxMessages
+    self._maxBytes = maxBytes
+    self._messages = 0
+    self._bytes = 0
+    self._condition = threading.Condition()
+  
+  def acquire(self, size):
+    '''
+    Block until a message of the given size fits. A message bigger than maxBytes is let through once nothing else is
+    outstanding.
+    '''
+    with self._condition:
+      while self._messages > 0 and (self._messages >= self._maxMessages or self._bytes+size > self._maxBytes):
+        self._condition.wait()
+      self._messages += 1
+      self._bytes += size
+  
+  def release(self, size):
+    with self._condition:
+      self._messages -= 1
+      self._bytes -= size
+      self._condition.notify_all()
+  
+  def wait(self, timeout=None):
+    '''
+    Block until all outstanding messages have been confirmed.
+    :return (bool): False if the timeout expired first.
+    '''
+    with self._condition:
+      return self._condition.wait_for(lambda: self._messages == 0, timeout=timeout)
+  
+  def outstanding(self):
+    with self._condition:
+      return (self._messages, self._bytes)
+
+class _PublishBatch(object):
+  '''
+  Tracks the messages queued by one call to Publish.process and logs the throughput once all of them are confirmed.
+  '''
+  def __init__(self, topicPath):
+    self._topicPath = topicPath
+    self._lock = threading.Lock()
+    self._start = time.time()
+    self._pending = 1  # Held until all messages are queued so that the batch cannot complete early.
+    self.numMessages = 0
+    self.numBytes = 0
+    self.numPublished = 0
+    self.numFailed = 0
+  
+  def queued(self, size):
+    with self._lock:
+      self._pending += 1
+      self.numMessages += 1
+      self.numBytes += size
+  
+  def done(self, succeeded):
+    with self._lock:
+      if succeeded is not None:
+        if succeeded: self.numPublished += 1
+        else: self.numFailed += 1
+      self._pending -= 1
+      complete = self._pending == 0
+    if complete:
+      seconds = time.time()-self._start
+      _logger.debug(json.dumps({'log': 'Published {num:d} of {total:d} messages ({bytes:d} bytes) to {topic} in {seconds:.3f}s, {rate:.1f} messages/s.'.format(
+        num=self.numPublished, total=self.numMessages, bytes=self.numBytes, topic=self._topicPath, seconds=seconds,
+        rate=self.numPublished/seconds if seconds > 0 else 0.0)}))
 
 class Publish(object):
   '''
-  Publishes a message in a Pub/Sub queue when the process method is called.
+  Publishes messages in a Pub/Sub queue when the process method is called. The Pub/Sub client batches messages in the
+  background (see maxMessages, maxBytes and maxLatency) and confirmations are collected by callbacks, so process only
+  blocks when more than maxOutstandingMessages/maxOutstandingBytes are waiting to be confirmed. Instances are meant to be
+  kept for the life of the process; call flush to wait for everything that has been queued.
   '''
   _increment = 0
 
@@ -193,50 +499,108 @@ class Publish(object):
     '''
     :return: returns a unique key for each entry.
     '''
-    key = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + '_' + str(self._increment)
-    self._increment += 1
+    with self._keyLock:
+      key = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + '_' + str(self._increment)
+      self._increment += 1
     return key
   
-  def __init__(self, projectId, topic, separateLines=False, credentials=None):
+  def __init__(self, projectId, topic, separateLines=False, credentials=None,
+               maxMessages=500, maxBytes=1000000, maxLatency=0.05,
+               maxOutstandingMessages=5000, maxOutstandingBytes=50000000,
+               publisher=None):
+    '''
+    :param projectId: the project that contains the topic.
+    :param topic: the Pub/Sub topic to publish to.
+    :param separateLines: publish each record as a separate message if True.
+    :param credentials: a dict of credentials for Google Cloud (optional).
+    :param maxMessages: the maximum number of messages the client sends in one request.
+    :param maxBytes: the maximum size in bytes of one request.
+    :param maxLatency: the maximum number of seconds the client waits to fill a request.
+    :param maxOutstandingMessages: block process while this many messages are waiting to be confirmed.
+    :param maxOutstandingBytes: block process while this many bytes are waiting to be confirmed.
+    :param publisher: a client to use instead of creating a PublisherClient (i.e. a fake for tests.)
+    '''
     self._topicPath='projects/{project}/topics/{topic}'.format(project=projectId,topic=topic)
-    if credentials is not None:
-      self._publisher=PublisherClient(
-        credentials=service_account.Credentials.from_service_account_info(credentials)
-      )
+    if publisher is not None:
+      self._publisher=publisher
     else:
-      self._publisher=PublisherClient()
+      batchSettings=types.BatchSettings(max_bytes=maxBytes, max_latency=maxLatency, max_messages=maxMessages)
+      if credentials is not None:
+        self._publisher=PublisherClient(
+          batch_settings=batchSettings,
+          credentials=service_account.Credentials.from_service_account_info(credentials)
+        )
+      else:
+        self._publisher=PublisherClient(batch_settings=batchSettings)
     self._separateLines = separateLines
+    # Keys are written sorted by name so that identical records always produce identical messages.
+    self._serializer = serialization.Serializer()
+    self._flowControl = _FlowControl(maxOutstandingMessages, maxOutstandingBytes)
+    # Publish may be shared by several threads (see openSkyBackfill.)
+    self._keyLock = threading.Lock()
+    self._statsLock = threading.Lock()
+    self.numPublished = 0
+    self.numFailed = 0
+    self.numBytes = 0
+  
+  def _published(self, batch, size, key, future):
+    succeeded = True
+    try:
+      # Very verbose logging: _logger.debug('Published message ID: '+str(future.result()))
+      future.result()
+    except:
+      succeeded = False
+      _logger.error('Error publishing {key} to {topic}'.format(key=key,topic=self._topicPath),exc_info=True,stack_info=True)
+    with self._statsLock:
+      if succeeded:
+        self.numPublished += 1
+        self.numBytes += size
+      else:
+        self.numFailed += 1
+    self._flowControl.release(size)
+    batch.done(succeeded)
+  
+  def _publish(self, batch, data, key):
+    size = len(data)
+    self._flowControl.acquire(size)
+    try:
+      # Very verbose logging: _logger.debug('Publishing: '+str(data))
+      future = self._publisher.publish(self._topicPath, data=data, query=key)
+    except:
+      self._flowControl.release(size)
+      with self._statsLock: self.numFailed += 1
+      _logger.error('Error publishing {key} to {topic}'.format(key=key,topic=self._topicPath),exc_info=True,stack_info=True)
+      return
+    batch.queued(size)
+    future.add_done_callback(lambda completed: self._published(batch, size, key, completed))
   
   def process(self, data):
     '''
     Will write data as a series of JSON objects, one per line. NOTE that this is not a JSON list of JSON objects. Big Query will ingest the series of JSON objects on separate lines.
     :param data (list): a list of dicts representing records.
+    :return (int): the number of messages queued for publishing.
     '''
-    rows = map(lambda row: json.dumps(row,sort_keys=True), data)
+    batch = _PublishBatch(self._topicPath)
     if self._separateLines:
-      futures=[]
-      for row in rows:
-        key=self._createKey()
-        try:
-          # Very verbose logging: _logger.debug('Publishing: '+row)
-          futures.append(self._publisher.publish(self._topicPath, data=row.encode('utf-8'), query=key))
-        except:
-          _logger.error('Error publishing {key} to {topic}'.format(key=key,topic=self._topicPath),exc_info=True,stack_info=True)
-      numMessagesPublished=0
-      for index,futurePublish in enumerate(futures):
-        try:
-          # Very verbose logging: _logger.debug('Published message ID: '+str(futurePublish.result()))
-          futurePublish.result()
-          numMessagesPublished+=1
-        except:
-          _logger.error('Error while publishing message #'+str(index),exc_info=True,stack_info=True)
-      _logger.debug('Published '+str(numMessagesPublished)+' messages.')
+      for row in data:
+        self._publish(batch, self._serializer.dumps(row), self._createKey())
     else:
-      key=self._createKey()
-      try:
-        self._publisher.publish(self._topicPath, data=('\n'.join(rows)).encode('utf-8'), query=self._createKey())
-      except:
-        _logger.error('Error publishing {key} to {topic}'.format(key=key, topic=self._topicPath),exc_info=True,stack_info=True)
+      self._publish(batch, self._serializer.dumpLines(data), self._createKey())
+    batch.done(None)
+    return batch.numMessages
+  
+  def flush(self, timeout=None):
+    '''
+    Wait until every queued message has been confirmed (or has failed).
+    :return (bool): False if the timeout expired first.
+    '''
+    return self._flowControl.wait(timeout=timeout)
+  
+  def getStats(self):
+    outstandingMessages, outstandingBytes = self._flowControl.outstanding()
+    with self._statsLock:
+      return {'published':self.numPublished, 'failed':self.numFailed, 'bytes':self.numBytes,
+              'outstandingMessages':outstandingMessages, 'outstandingBytes':outstandingBytes}
 
 def _convertTimestamp(timestamp):
   '''
@@ -253,7 +617,7 @@ def _convertTimestamp(timestamp):
 
 def _convert(data,dataType):
   if data is not None:
-    if dataType==str: return data.strip()
+    if dataType==str: return data.strip() if type(data)==str else str(data)
     elif dataType==int: return int(data)
     elif dataType==float: return float(data)
     elif dataType==bool: return bool(data)
@@ -307,22 +671,334 @@ def _convertRow(flightState, queryTime):
   if query_time_bq is not None: row['query_time_bq'] = query_time_bq if query_time_bq is not None else ""
   return row
 
-def _getLatestFlightData():
-  api = OpenSkyApi()
-  for trial in range(numTries):
+# Columns of OpenSkyStateColumns used to create each field of a row, in the same order as _convertRow.
+_columnFields = [('icao24','icao24',str), ('callsign','callsign',str), ('origin','origin_country',str),
+                 ('time','time_position',int), ('contact','last_contact',int),
+                 ('longitude','longitude',float), ('latitude','latitude',float), ('altitude','geo_altitude',float),
+                 ('on_ground','on_ground',bool), ('velocity','velocity',float), ('heading','heading',float),
+                 ('vertical_rate','vertical_rate',float), ('sensors','sensors',str),
+                 ('baro_altitude','baro_altitude',float), ('squawk','squawk',int), ('spi','spi',bool),
+                 ('position_source','position_source',int)]
+
+def _convertColumn(flightColumns, key, dataType, size):
+  '''
+  Convert the first size values of one column of an OpenSkyStateColumns, like _convert does for a single value.
+  :return (list): the converted values with None where the value is null.
+  '''
+  values = flightColumns.columns[key]
+  valid = flightColumns.valid[key]
+  if key not in OpenSkyStateColumns.typecodes:
+    return [_convert(value,dataType) for value in values[:size]]
+  elif dataType==bool:
+    return [bool(value) if present else None for value, present in zip(values[:size], valid[:size])]
+  # Typed arrays already hold ints and floats.
+  return [value if present else None for value, present in zip(values[:size], valid[:size])]
+
+def _convertColumns(flightColumns, queryTime, limit=None):
+  '''
+  Vectorized counterpart of _convertRow: converts a whole OpenSkyStateColumns snapshot one column at a time and only
+  creates the output rows at the end, without any intermediate object per aircraft.
+  :param flightColumns (OpenSkyStateColumns): the snapshot to convert.
+  :param queryTime: time OpenSky was queried.
+  :param limit: a limit on the number of rows to convert.
+  :return (list): a list of dicts, one per aircraft, without any of the fields that are None.
+  '''
+  size = flightColumns.size if limit is None else min(flightColumns.size, limit)
+  names = []
+  outputColumns = []
+  for name, key, dataType in _columnFields:
+    names.append(name)
+    outputColumns.append(_convertColumn(flightColumns, key, dataType, size))
+  # Following are additional fields added by this code to create timestamps that can be used with BigQuery as date fields.
+  for name, key in [('time_bq','time_position'), ('contact_bq','last_contact')]:
+    names.append(name)
+    outputColumns.append([_convertTimestamp(value) if present else None
+                          for value, present in zip(flightColumns.columns[key][:size], flightColumns.valid[key][:size])])
+  names.append('query_time_bq')
+  outputColumns.append([_convertTimestamp(queryTime)]*size)
+  
+  rows = []
+  for values in zip(*outputColumns):
+    row = {name: value for name, value in zip(names, values) if value is not None}
+    if len(row) > 0: rows.append(row)
+  return rows
+
+class _BrokenStream(Exception):
+  '''
+  Raised when reading a streamed snapshot fails (a truncated or malformed response or a dropped connection), as opposed
+  to converting or outputting its records.
+  '''
+  pass
+
+def _streamRecords(flightStream, queryTime, limit=None, batchSize=streamBatchSize):
+  '''
+  Convert the state vectors of an OpenSkyStatesStream while the response is being read. The stream, and with it the
+  connection to OpenSky, is closed as soon as limit records have been collected.
+  :param flightStream (OpenSkyStatesStream): the streamed snapshot to convert.
+  :param queryTime: time OpenSky was queried.
+  :param limit: a limit on the number of records to return.
+  :param batchSize: the maximum number of records in each batch.
+  :return: yields lists of at most batchSize dicts representing records, without any of the fields that are None.
+           Raises _BrokenStream if the stream cannot be read to its end.
+  '''
+  converter = _getRowConverter()
+  timestamps = {}
+  try:
+    records = []
+    numRecords = 0
+    flightStates = iter(flightStream.states)
+    while True:
+      try:
+        flightState = next(flightStates)
+      except StopIteration:
+        break
+      except (ValueError, IOError) as ex:
+        raise _BrokenStream('Cannot read the streamed OpenSky response.') from ex
+      if converter is not None:
+        trimmedRecord = converter.convertRow(flightState, queryTime, timestamps)
+      else:
+        trimmedRecord = dict(filter(lambda item: item[1] is not None, _convertRow(flightState, queryTime).items()))
+      if len(trimmedRecord) > 0:
+        records.append(trimmedRecord)
+        numRecords += 1
+      if len(records)>=batchSize:
+        yield records
+        records = []
+      if limit is not None and numRecords>=limit: break
+    if len(records) > 0: yield records
+  finally:
+    flightStream.close()
+
+def _collectRecords(flightStates, queryTime, limit=None):
+  '''
+  :param flightStates: an OpenSkyStates, OpenSkyStateColumns or OpenSkyStatesStream returned by OpenSkyApi.get_states.
+  :param queryTime: time OpenSky was queried.
+  :param limit: a limit on the number of records to return.
+  :return (list): a list of dicts representing records, without any of the fields that are None.
+  '''
+  if isinstance(flightStates, OpenSkyStateColumns):
+    return _convertColumns(flightStates, queryTime, limit=limit)
+  if isinstance(flightStates, OpenSkyStatesStream):
+    return [record for records in _streamRecords(flightStates, queryTime, limit=limit) for record in records]
+  converter = _getRowConverter()
+  if converter is not None:
+    return converter.convertRows(flightStates.states, queryTime, limit=limit)
+  records = []
+  for flightDict in map(lambda flightState: _convertRow(flightState, queryTime), flightStates.states):
+    trimmedRecord = dict(filter(lambda item: item[1] is not None, flightDict.items()))
+    if len(trimmedRecord) > 0:
+      try:
+        # If the record has at least one non-empty field, process it.
+        records.append(trimmedRecord)
+      except:
+        _logger.error('ERROR cannot process record.',exc_info=True,stack_info=True)
+    if limit is not None and len(records)>=limit: break
+  return records
+
+def _checkDecoding(columnar, stream, tileSize):
+  '''
+  Raise a ValueError for columnar together with stream, which OpenSkyApi.get_states refuses, instead of failing every
+  try. Tiles are never streamed, so they can be decoded into columns either way.
+  '''
+  if columnar and stream and tileSize is None:
+    raise ValueError('A streamed snapshot cannot be decoded into columns, use either columnar or stream.')
+
+def _getLatestFlightData(columnar=False, stream=False, tries=numTries, bbox=None, tileSize=None, stopped=None):
+  '''
+  :param columnar: return an OpenSkyStateColumns instead of an OpenSkyStates.
+  :param stream: return an OpenSkyStatesStream instead of an OpenSkyStates (not used when tileSize is given.)
+  :param tries: the number of times to try to get data from OpenSky.
+  :param bbox: only get flights within [min_latitude, max_latitude, min_longitude, max_longitude].
+  :param tileSize: request bbox as concurrent tiles of this size in degrees.
+  :param stopped (threading.Event): give up (returning None) as soon as this is set while waiting for the rate limit.
+  :return: the latest snapshot from OpenSky or None if none of the tries succeeded.
+  '''
+  _checkDecoding(columnar, stream, tileSize)
+  api = _getApi()
+  for trial in range(tries):
+    # The client-side rate limit counts from when the last response arrived, so a request sent before then (even the
+    # first try, e.g. from the poller) would only be refused and waste the try.
+    wait = api.get_states_wait()
+    if wait > 0:
+      if stopped is None:
+        time.sleep(wait)
+      elif stopped.wait(wait):
+        return None
     try:
       _logger.debug('Requesting latest flights from OpenSky.')
-      flightStates = api.get_states()
-      if flightStates is not None: return flightStates
+      if bbox is not None and tileSize is not None:
+        flightStates = api.get_states_tiled(bbox, tile_size=tileSize, columnar=columnar)
+      else:
+        flightStates = api.get_states(columnar=columnar, stream=stream, bbox=() if bbox is None else bbox)
+      if flightStates is not None:
+        _logger.debug(json.dumps({'log': 'OpenSky connection stats.', 'stats': api.get_connection_stats()}))
+        return flightStates
     except:
       _logger.error('Failed in call to OpenSky.',exc_info=True)
   return None
 
+# Publishers are kept for the life of the process, keyed by (projectId, topic, separateLines).
+_publishers={}
+
+def _getPublisher(projectId, topic, separateLines=False, credentials=None):
+  '''
+  :return (Publish): the publisher shared by all calls within this process for the given topic.
+  '''
+  key=(projectId, topic, separateLines)
+  if key not in _publishers:
+    _publishers[key]=Publish(projectId, topic, separateLines=separateLines, credentials=credentials)
+  return _publishers[key]
+
+class Sinks(object):
+  '''
+  The outputs for flight records. The Storage and Publish instances are created when they are first needed and kept
+  for later snapshots, so a long-running process creates each client only once.
+  '''
+  def __init__(self, separateLines=False, bucket=None, path=None, projectId=None, topic=None, credentials=None,
+               rollBytes=None, rollSeconds=None, format=None):
+    '''
+    :param separateLines: output each flight record as a separate item if True.
+    :param bucket: output to a bucket in GCS if not null.
+    :param path: the path of a directory within the bucket to write output to.
+    :param projectId: the project ID to use (required if publishing to a Pub/Sub queue).
+    :param topic: the Pub/Sub topic to use if publishing to a queue.
+    :param credentials: a dict of credentials for Google Cloud (optional).
+    :param rollBytes: buffer records and write them as one object of about this many bytes (see RollingStorage.)
+    :param rollSeconds: buffer records and write them as one object at least this often (see RollingStorage.)
+    :param format: the format of files written to the bucket (see outputFormats.getEncoder); plain JSON by default.
+           Unless rollBytes or rollSeconds is given, only JSON formats can be combined with separateLines.
+    '''
+    self._encoder = getEncoder(format) if bucket is not None and format is not None else None
+    # Rolled files always hold many records, whatever separateLines is.
+    if rollBytes is None and rollSeconds is None: _checkSeparateLines(separateLines, self._encoder)
+    self._rollBytes = rollBytes
+    self._rollSeconds = rollSeconds
+    self._separateLines = separateLines
+    self._bucket = bucket
+    self._path = path
+    self._projectId = projectId
+    self._topic = topic
+    self._credentials = credentials
+    self._storage = None
+    self._publisher = None
+    self._lock = threading.Lock()
+    # Failures already reported by flush.
+    self._numFailedFlushed = 0
+  
+  def process(self, records, debug=None):
+    '''
+    :param records (list): a list of dicts representing records.
+    :param debug: set to log what was written.
+    :return (int): the number of records written plus the number of records published.
+    '''
+    numProcessed=0
+    if self._bucket is not None:
+      with self._lock:
+        if self._storage is None:
+          encoder = self._encoder
+          if self._rollBytes is not None or self._rollSeconds is not None:
+            rolling = dict((name, value) for name, value in [('rollBytes', self._rollBytes), ('rollSeconds', self._rollSeconds)]
+                           if value is not None)
+            self._storage = RollingStorage(self._bucket, folder=self._path, project=self._projectId,
+                                           credentials=self._credentials, encoder=encoder, **rolling)
+          else:
+            self._storage = Storage(self._bucket, folder=self._path, separateLines=self._separateLines,
+                                    project=self._projectId, credentials=self._credentials, encoder=encoder)
+      self._storage.process(records)
+      numProcessed+=len(records)
+      if debug is not None: _logger.debug(json.dumps({
+        'log': 'Stored {num:d} records in folder {path} of bucket {bucket}'.format(
+          num=len(records), path=self._path, bucket=self._bucket)}))
+    
+    if self._topic is not None and self._projectId is not None:
+      with self._lock:
+        if self._publisher is None:
+          self._publisher=_getPublisher(self._projectId,self._topic,separateLines=self._separateLines,credentials=self._credentials)
+      self._publisher.process(records)
+      numProcessed+=len(records)
+      if debug is not None: _logger.debug(json.dumps({
+        'log': 'Published {num:d} records to topic {topic}'.format(
+          num=len(records), topic=self._topic)}))
+    return numProcessed
+  
+  def flush(self):
+    '''
+    Wait until everything given to process has been written/published.
+    :return (bool): True if everything given to process since the last flush was output, False if a write or a
+             publication failed (or publishing timed out) in the meantime.
+    '''
+    complete = True
+    numFailed = 0
+    if self._storage is not None:
+      self._storage.flush()
+      numFailed += self._storage.getStats()['failed']
+    if self._publisher is not None:
+      if not self._publisher.flush(timeout=publishTimeout):
+        _logger.error('Timed out waiting for messages to be published to {topic}.'.format(topic=self._topic))
+        complete = False
+      numFailed += self._publisher.getStats()['failed']
+    with self._lock:
+      if numFailed > self._numFailedFlushed: complete = False
+      self._numFailedFlushed = numFailed
+    return complete
+  
+  def close(self):
+    if self._storage is not None:
+      self._storage.close()
+    self.flush()
+  
+  def getPublishStats(self):
+    return self._publisher.getStats() if self._publisher is not None else None
+
+def _processFlightStates(flightStates, queryTime, sinks, limit=None, changeDetector=None, trackStore=None, debug=None):
+  '''
+  Convert a snapshot from OpenSky into records and write/publish them.
+  :param flightStates: an OpenSkyStates, OpenSkyStateColumns or OpenSkyStatesStream returned by OpenSkyApi.get_states.
+  :param queryTime: time OpenSky was queried.
+  :param sinks (Sinks): where to output the records.
+  :param limit: a limit on the number of rows to write/publish.
+  :param changeDetector (ChangeDetector): only output records that changed meaningfully if given.
+  :param trackStore (TrackStore): add the positions in the snapshot to these tracks if given. Streamed snapshots only
+         add the records that were read (see limit.)
+  :param debug: set to 10 to see debug statements.
+  :return (int): the number of records written plus the number of records published.
+  '''
+  if isinstance(flightStates, OpenSkyStatesStream):
+    batches = _streamRecords(flightStates, queryTime, limit=limit)
+  else:
+    if trackStore is not None: trackStore.addStates(flightStates, now=queryTime)
+    batches = [_collectRecords(flightStates, queryTime, limit=limit)]
+  
+  numProcessed=0
+  for records in batches:
+    if trackStore is not None and isinstance(flightStates, OpenSkyStatesStream):
+      trackStore.addRecords(records, queryTime)
+    if changeDetector is not None:
+      numFound=len(records)
+      records=changeDetector.filter(records, queryTime)
+      if debug is not None: _logger.debug(json.dumps({'log': 'Kept {num:d} of {numFound:d} records that changed.'.format(
+        num=len(records), numFound=numFound)}))
+    if len(records) == 0: continue
+    if debug is not None: _logger.debug(json.dumps({'log': 'Found {num:d} records to process.'.format(num=len(records))}))
+    # Found records to process and/or publish.
+    numProcessed+=sinks.process(records, debug=debug)
+  return numProcessed
+
+def _saveChangeDetector(changeDetector, deltaCheckpoint):
+  if changeDetector is not None and deltaCheckpoint is not None:
+    try:
+      changeDetector.save(deltaCheckpoint)
+    except:
+      _logger.error('Cannot save change detection checkpoint to '+deltaCheckpoint,exc_info=True,stack_info=True)
+
 def _scavengeRows(separateLines=False,
                   bucket=None,path=None,
                   projectId=None,topic=None,
                   debug=None,limit=None,
-                  credentials=None):
+                  credentials=None,
+                  columnar=False,stream=False,
+                  delta=False,deltaCheckpoint=None,deltaThresholds=None,
+                  bbox=None,tileSize=None,format=None,track=False):
   '''
   :param separateLines: output each flight record as a separate item if True.
   :param bucket: output to a bucket in GCS if not null.
@@ -333,44 +1009,41 @@ def _scavengeRows(separateLines=False,
   :param limit: a limit on the number of rows to write/publish.
   :param credentials: expecting a dict with keys for type,project_id,private_key_id,private_key,client_email,client_id,auth_url,token_url,auth_provider_x509_cert_url,client_x509_cert_url;
          this is optional; no need to pass in credentials when run from within Google's infrastructure.
+  :param columnar: decode the snapshot into typed columns and convert it column by column if True.
+  :param stream: decode the snapshot while it is being downloaded and write/publish it in batches if True.
+  :param delta: only output records of aircraft that changed meaningfully since their last output record if True.
+  :param deltaCheckpoint: a local file to load the table of last output records from and save it to.
+  :param deltaThresholds: a dict of ChangeDetector thresholds.
+  :param bbox: only pull flights within [min_latitude, max_latitude, min_longitude, max_longitude].
+  :param tileSize: request bbox as concurrent tiles of this size in degrees.
+  :param format: the format of files written to the bucket (see outputFormats.getEncoder.)
+  :param track: add the positions in the snapshot to the process-wide TrackStore if True.
   '''
   queryTime = datetime.datetime.now().timestamp()
   if debug is not None:
     _logger.debug(json.dumps({'log': 'Scavenging rows at {queryTime}.'.format(queryTime=str(queryTime))}))
-  flightStates=_getLatestFlightData()
+  sinks=Sinks(separateLines=separateLines, bucket=bucket, path=path, projectId=projectId, topic=topic,
+              credentials=credentials, format=format)
   numProcessed=0
-  if flightStates is not None:
-    records = []
-    for flightDict in map(lambda flightState: _convertRow(flightState, queryTime), flightStates.states):
-      trimmedRecord = dict(filter(lambda item: item[1] is not None, flightDict.items()))
-      if len(trimmedRecord) > 0:
-        try:
-          # If the record has at least one non-empty field, process it.
-          records.append(trimmedRecord)
-        except:
-          _logger.error('ERROR cannot process record.',exc_info=True,stack_info=True)
-      if limit is not None and len(records)>limit: break
-    
-    if len(records) > 0:
-      if debug is not None: _logger.debug(json.dumps({'log': 'Found {num:d} records to process.'.format(num=len(records))}))
-      # Found records to process and/or publish.
-      if bucket is not None:
-        storage = Storage(bucket, folder=path, separateLines=separateLines,project=projectId,credentials=credentials)
-        storage.process(records)
-        numProcessed+=len(records)
-        if debug is not None: _logger.debug(json.dumps({
-          'log': 'Stored {num:d} records in folder {path} of bucket {bucket}'.format(
-            num=len(records), path=path, bucket=bucket)}))
-      
-      if topic is not None and projectId is not None:
-        publisher=Publish(projectId,topic,separateLines=separateLines,credentials=credentials)
-        publisher.process(records)
-        numProcessed+=len(records)
-        if debug is not None: _logger.debug(json.dumps({
-          'log': 'Published {num:d} records to topic {topic}'.format(
-            num=len(records), topic=topic)}))
-  else:
-    if debug is not None: _logger.debug(json.dumps({'log': 'No flight records were found.'}))
+  for trial in range(numTries):
+    flightStates=_getLatestFlightData(columnar=columnar,stream=stream,bbox=bbox,tileSize=tileSize)
+    if flightStates is None:
+      if debug is not None: _logger.debug(json.dumps({'log': 'No flight records were found.'}))
+      break
+    changeDetector=_getChangeDetector(deltaCheckpoint, deltaThresholds) if delta else None
+    try:
+      numProcessed+=_processFlightStates(flightStates, queryTime, sinks, limit=limit, changeDetector=changeDetector,
+                                         trackStore=_getTrackStore() if track else None, debug=debug)
+    except _BrokenStream:
+      # A streamed response is only decoded (and can only turn out to be truncated or malformed) after the request
+      # succeeded, outside the tries of _getLatestFlightData. Errors of the sinks are not retried.
+      if trial+1==numTries: raise
+      _logger.warning('Streamed OpenSky response broke off, requesting it again.', exc_info=True)
+      continue
+    finally:
+      sinks.flush()
+    _saveChangeDetector(changeDetector, deltaCheckpoint)
+    break
   return numProcessed
 
 def parse(request,credentials=None):
@@ -426,6 +1099,20 @@ def parse(request,credentials=None):
     except:
       limit=None
   if limit is None: limit=defaultLimit
+  columnar=messageJSON.get('columnar',False)
+  stream=messageJSON.get('stream',False)
+  delta=messageJSON.get('delta',False)
+  deltaCheckpoint=messageJSON.get('deltaCheckpoint',None)
+  deltaThresholds=messageJSON.get('deltaThresholds',None)
+  bbox=messageJSON.get('bbox',None)
+  if type(bbox)==str: bbox=json.loads(bbox) if len(bbox.strip())>0 else None
+  tileSize=messageJSON.get('tileSize',None)
+  if type(tileSize)==str: tileSize=json.loads(tileSize) if len(tileSize.strip())>0 else None
+  track=messageJSON.get('track',False)
+  _useArchive(record=messageJSON.get('record',None), replay=messageJSON.get('replay',None),
+              replaySpeed=messageJSON.get('replaySpeed',None))
+  outputFormat=messageJSON.get('format',None)
+  if outputFormat is not None and len(outputFormat.strip())==0: outputFormat=None
   
   _logger.info(json.dumps({'log': 'Parsed message is ' + json.dumps(messageJSON)}))
   if publish:
@@ -436,7 +1123,10 @@ def parse(request,credentials=None):
                 bucket=bucket,path=path,
                 projectId=projectId,topic=topic,
                 debug=debug,limit=limit,
-                credentials=credentials)
+                credentials=credentials,
+                columnar=columnar,stream=stream,
+                delta=delta,deltaCheckpoint=deltaCheckpoint,deltaThresholds=deltaThresholds,
+                bbox=bbox,tileSize=tileSize,format=outputFormat,track=track)
   return json.dumps(messageJSON)+' handled '+str(numProcessed)+' items.'
 
 if __name__ == '__main__':
@@ -456,6 +1146,16 @@ if __name__ == '__main__':
   parser.add_argument('-limit',help='The maximum number of entries to pull from OpenSky.',default=defaultLimit,type=int)
   parser.add_argument('-log',action='store_true',help='Print out log statements.')
   parser.add_argument('-credentials',help='Provide a file name of a local file which has credentials for Google Cloud.',default=None)
+  parser.add_argument('-columnar',action='store_true',help='Decode flight data into typed columns instead of one object per aircraft.')
+  parser.add_argument('-stream',action='store_true',help='Decode flight data while it is downloaded and stop downloading once the limit is reached.')
+  parser.add_argument('-delta',action='store_true',help='Only output records of aircraft that moved meaningfully since they were last output.')
+  parser.add_argument('-deltaCheckpoint',help='A local file to keep the last output record of each aircraft in between runs.',default=None)
+  parser.add_argument('-bbox',nargs=4,type=float,help='Only pull flights within min_latitude max_latitude min_longitude max_longitude.',default=None)
+  parser.add_argument('-tileSize',nargs='+',type=float,help='Request the bbox as tiles of this many degrees of latitude (and longitude).',default=None)
+  parser.add_argument('-track',action='store_true',help='Keep the latest positions of every aircraft in memory.')
+  parser.add_argument('-record',help='Record every OpenSky response to this local path.',default=None)
+  parser.add_argument('-replay',help='Replay the OpenSky responses recorded at this local path instead of calling OpenSky.',default=None)
+  parser.add_argument('-replaySpeed',help='How many times faster than recorded to replay responses.',default=None,type=float)
 
   parser.add_argument('-storage',action='store_true',help='Store as files in Google Cloud Storage.')
   parser.add_argument('-pubsub',action='store_true',help='Write to a Pub/Sub queue.')
@@ -463,6 +1163,7 @@ if __name__ == '__main__':
   storageArgs=parser.add_argument_group('storage')
   storageArgs.add_argument('-bucket',help='The name of the bucket where data is to be stored.',default=None)
   storageArgs.add_argument('-path',help='The path within the bucket where data is to be stored.',default='flights_streaming')
+  storageArgs.add_argument('-format',help='The format of stored files: json, json.gz, json.zst, parquet or avro.',default=None)
 
   pubsubArgs=parser.add_argument_group('pub/sub')
   pubsubArgs.add_argument('-projectId',help='The ID of the project that contains the Pub/Sub queue.',default=defaultProjectId)
@@ -482,6 +1183,16 @@ if __name__ == '__main__':
   requestArgs={}
   requestArgs['query']=args.query
   requestArgs['limit']=args.limit
+  requestArgs['columnar']=args.columnar
+  requestArgs['stream']=args.stream
+  requestArgs['delta']=args.delta
+  requestArgs['deltaCheckpoint']=args.deltaCheckpoint
+  requestArgs['bbox']=args.bbox
+  requestArgs['tileSize']=args.tileSize
+  requestArgs['track']=args.track
+  requestArgs['record']=args.record
+  requestArgs['replay']=args.replay
+  requestArgs['replaySpeed']=args.replaySpeed
   projectId=defaultProjectId if args.projectId is None else args.projectId
   requestArgs['projectId']=args.projectId
   if args.pubsub:
@@ -491,6 +1202,7 @@ if __name__ == '__main__':
     requestArgs['storage']=args.storage
     requestArgs['path']=args.path
     requestArgs['bucket']=args.bucket if args.bucket is not None else projectId+'_data'
+    requestArgs['format']=args.format
   exampleRequest = RequestTemplate(**requestArgs)
   
   parse(exampleRequest,credentials=credentials)
\ No newline at end of file
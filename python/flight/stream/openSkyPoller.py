@@ -0,0 +1,243 @@
+# Long-running alternative to triggering openSkyParser.parse from Cloud Scheduler. The poller keeps one OpenSky client,
+# one set of outputs (and the delta table, if used) for its whole life and polls OpenSky continuously:
+#   - Polls are scheduled on the boundaries of OpenSky's rate limit window (every 10s anonymously, 5s with an account.)
+#   - A poll that overruns its window skips the windows it missed instead of queueing them up.
+#   - A failed poll backs off exponentially, with jitter, before trying again on a later window.
+#   - With track set, the latest positions of every aircraft are kept in poller.trackStore for queries.
+#   - getStats() reports the lag behind schedule, skipped polls and the latency of fetching from OpenSky.
+#
+# Run it from the command-line (the flags match openSkyParser.py):
+#   PYTHONPATH=~/classResources/python python ~/classResources/python/flight/stream/openSkyPoller.py -storage -bucket prof-big-data_data -path flights_streaming
+import json
+import logging
+import math
+import os
+import random
+import signal
+import threading
+import time
+from argparse import ArgumentParser
+
+from flight.stream.openSkyParser import Sinks, _checkDecoding, _getApi, _getChangeDetector, _getLatestFlightData, \
+  _getTrackStore, _processFlightStates, _saveChangeDetector, _useArchive
+
+_logger=logging.getLogger(__name__)
+
+class _Measure(object):
+  '''
+  Keeps the last, minimum, maximum and average of a measurement.
+  '''
+  def __init__(self):
+    self.count=0
+    self.total=0.0
+    self.last=None
+    self.min=None
+    self.max=None
+
+  def add(self, value):
+    self.count+=1
+    self.total+=value
+    self.last=value
+    self.min=value if self.min is None else min(self.min, value)
+    self.max=value if self.max is None else max(self.max, value)
+
+  def toDict(self):
+    return {'last':self.last, 'min':self.min, 'max':self.max,
+            'avg':self.total/self.count if self.count>0 else None}
+
+class OpenSkyPoller(object):
+  '''
+  Polls OpenSky on a fixed schedule and writes/publishes every snapshot through the same Sinks.
+  '''
+  def __init__(self, sinks, interval=None, limit=None, columnar=False, stream=False,
+               delta=False, deltaCheckpoint=None, deltaThresholds=None, bbox=None, tileSize=None,
+               track=False, trackCapacity=None, trackEvictAfter=None, maxBackoff=300.0, statsEvery=60, debug=None):
+    '''
+    :param sinks (Sinks): where to output the records of each snapshot.
+    :param interval: seconds between polls. Defaults to, and cannot be less than, OpenSky's rate limit window.
+    :param limit: a limit on the number of rows to write/publish per poll.
+    :param columnar: decode snapshots into typed columns (see openSkyParser.)
+    :param stream: decode snapshots while they are downloaded (see openSkyParser); cannot be combined with columnar.
+    :param delta: only output records of aircraft that changed meaningfully (see openSkyParser.)
+    :param deltaCheckpoint: a local file to load the delta table from and save it to after every poll.
+    :param deltaThresholds: a dict of ChangeDetector thresholds.
+    :param bbox: only poll flights within [min_latitude, max_latitude, min_longitude, max_longitude].
+    :param tileSize: request bbox as concurrent tiles of this size in degrees.
+    :param track: keep the latest positions of every aircraft in trackStore.
+    :param trackCapacity: the number of positions to keep per aircraft.
+    :param trackEvictAfter: forget aircraft that have not been seen for this many seconds.
+    :param maxBackoff: the longest time in seconds to back off after consecutive failures.
+    :param statsEvery: log the statistics every this many polls.
+    :param debug: set to 10 to see debug statements.
+    '''
+    _checkDecoding(columnar, stream, tileSize)
+    minimumInterval=_getApi().get_states_interval()
+    self._interval=minimumInterval if interval is None else max(float(interval), minimumInterval)
+    self._sinks=sinks
+    self._limit=limit
+    self._columnar=columnar
+    self._stream=stream
+    self._bbox=bbox
+    self._tileSize=tileSize
+    self._deltaCheckpoint=deltaCheckpoint
+    self._changeDetector=_getChangeDetector(deltaCheckpoint, deltaThresholds) if delta else None
+    self.trackStore=_getTrackStore(trackCapacity, trackEvictAfter) if track else None
+    self._maxBackoff=maxBackoff
+    self._statsEvery=statsEvery
+    self._debug=debug
+    self._stopped=threading.Event()
+
+    self.numPolls=0
+    self.numFailures=0
+    self.numSkipped=0
+    self.numRecords=0
+    self._consecutiveFailures=0
+    self._lag=_Measure()
+    self._fetchLatency=_Measure()
+
+  def _nextWindow(self, after):
+    '''
+    :return: the start of the first rate limit window at or after the given time.
+    '''
+    return math.ceil(after/self._interval-1e-9)*self._interval
+
+  def _backoff(self):
+    '''
+    :return: seconds to wait after the latest failure; "full jitter" exponential backoff that never waits less than one
+             interval.
+    '''
+    ceiling=min(self._maxBackoff, self._interval*(2**self._consecutiveFailures))
+    return self._interval+random.uniform(0, max(0.0, ceiling-self._interval))
+
+  def poll(self):
+    '''
+    Fetch one snapshot from OpenSky (a single try) and output its records.
+    :return (bool): True if a snapshot was retrieved.
+    '''
+    queryTime=time.time()
+    flightStates=_getLatestFlightData(columnar=self._columnar, stream=self._stream, tries=1,
+                                      bbox=self._bbox, tileSize=self._tileSize, stopped=self._stopped)
+    self._fetchLatency.add(time.time()-queryTime)
+    if flightStates is None: return False
+    self.numRecords+=_processFlightStates(flightStates, queryTime, self._sinks, limit=self._limit,
+                                          changeDetector=self._changeDetector, trackStore=self.trackStore,
+                                          debug=self._debug)
+    _saveChangeDetector(self._changeDetector, self._deltaCheckpoint)
+    return True
+
+  def run(self, maxPolls=None):
+    '''
+    Poll until stop() is called (or maxPolls polls have been made.)
+    '''
+    scheduled=self._nextWindow(time.time())
+    while not self._stopped.is_set() and (maxPolls is None or self.numPolls<maxPolls):
+      if self._stopped.wait(max(0.0, scheduled-time.time())): break
+      self._lag.add(time.time()-scheduled)
+      try:
+        succeeded=self.poll()
+      except:
+        _logger.error('Failed to process flight data.', exc_info=True, stack_info=True)
+        succeeded=False
+      self.numPolls+=1
+      finished=time.time()
+
+      if succeeded:
+        self._consecutiveFailures=0
+        after=scheduled+self._interval
+      else:
+        self.numFailures+=1
+        self._consecutiveFailures+=1
+        after=finished+self._backoff()
+        _logger.warning('Poll failed {num:d} times in a row, backing off until {time}.'.format(
+          num=self._consecutiveFailures, time=time.strftime('%H:%M:%S', time.localtime(after))))
+      # Skip the windows that have already passed instead of trying to catch up on them.
+      nextScheduled=self._nextWindow(max(after, finished))
+      missed=int(round((nextScheduled-scheduled)/self._interval))-1
+      if succeeded and missed>0: self.numSkipped+=missed
+      scheduled=nextScheduled
+
+      if self._statsEvery is not None and self.numPolls%self._statsEvery==0:
+        _logger.info(json.dumps({'log':'OpenSky poller stats.', 'stats':self.getStats()}))
+
+  def stop(self):
+    self._stopped.set()
+
+  def getStats(self):
+    '''
+    :return (dict): polls, failures, skipped polls, records output, lag behind schedule and fetch latency in seconds.
+    '''
+    stats={'interval':self._interval, 'polls':self.numPolls, 'failures':self.numFailures,
+           'skipped':self.numSkipped, 'records':self.numRecords,
+           'lag':self._lag.toDict(), 'fetchLatency':self._fetchLatency.toDict(),
+           'connections':_getApi().get_connection_stats(), 'publish':self._sinks.getPublishStats()}
+    if self._changeDetector is not None: stats['delta']=self._changeDetector.getStats()
+    if self.trackStore is not None: stats['tracks']=self.trackStore.getStats()
+    return stats
+
+if __name__=='__main__':
+  defaultProjectId=os.environ.get('GOOGLE_CLOUD_PROJECT','no_project')
+
+  parser=ArgumentParser(description='Continuously pull flight streaming data from OpenSky and store in Google Cloud.')
+  parser.add_argument('-separateLines',action='store_true',help='Store each flight record as a separate file or post as a separate pub/sub entry.')
+  parser.add_argument('-limit',help='The maximum number of entries to process per poll.',default=None,type=int)
+  parser.add_argument('-interval',help='Seconds between polls (at least the OpenSky rate limit.)',default=None,type=float)
+  parser.add_argument('-maxBackoff',help='The longest time in seconds to wait after failures.',default=300.0,type=float)
+  parser.add_argument('-maxPolls',help='Stop after this many polls.',default=None,type=int)
+  parser.add_argument('-log',action='store_true',help='Print out log statements.')
+  parser.add_argument('-credentials',help='Provide a file name of a local file which has credentials for Google Cloud.',default=None)
+  parser.add_argument('-columnar',action='store_true',help='Decode flight data into typed columns instead of one object per aircraft.')
+  parser.add_argument('-stream',action='store_true',help='Decode flight data while it is downloaded.')
+  parser.add_argument('-delta',action='store_true',help='Only output records of aircraft that moved meaningfully since they were last output.')
+  parser.add_argument('-deltaCheckpoint',help='A local file to keep the last output record of each aircraft in between runs.',default=None)
+  parser.add_argument('-bbox',nargs=4,type=float,help='Only poll flights within min_latitude max_latitude min_longitude max_longitude.',default=None)
+  parser.add_argument('-tileSize',nargs='+',type=float,help='Request the bbox as tiles of this many degrees of latitude (and longitude).',default=None)
+  parser.add_argument('-track',action='store_true',help='Keep the latest positions of every aircraft in memory.')
+  parser.add_argument('-record',help='Record every OpenSky response to this local path.',default=None)
+  parser.add_argument('-replay',help='Replay the OpenSky responses recorded at this local path instead of calling OpenSky.',default=None)
+  parser.add_argument('-replaySpeed',help='How many times faster than recorded to replay responses.',default=None,type=float)
+  parser.add_argument('-trackCapacity',help='The number of positions to keep per aircraft.',default=None,type=int)
+  parser.add_argument('-trackEvictMinutes',help='Forget aircraft that have not been seen for this many minutes.',default=None,type=float)
+
+  parser.add_argument('-storage',action='store_true',help='Store as files in Google Cloud Storage.')
+  parser.add_argument('-pubsub',action='store_true',help='Write to a Pub/Sub queue.')
+
+  storageArgs=parser.add_argument_group('storage')
+  storageArgs.add_argument('-bucket',help='The name of the bucket where data is to be stored.',default=None)
+  storageArgs.add_argument('-path',help='The path within the bucket where data is to be stored.',default='flights_streaming')
+  storageArgs.add_argument('-rollMegabytes',help='Buffer records and write one file once this many megabytes are buffered.',default=None,type=float)
+  storageArgs.add_argument('-rollSeconds',help='Buffer records and write one file at least this often.',default=None,type=float)
+  storageArgs.add_argument('-format',help='The format of stored files: json, json.gz, json.zst, parquet or avro.',default=None)
+
+  pubsubArgs=parser.add_argument_group('pub/sub')
+  pubsubArgs.add_argument('-projectId',help='The ID of the project that contains the Pub/Sub queue.',default=defaultProjectId)
+  pubsubArgs.add_argument('-topic', help='The Pub/Sub topic to write data to.',default=None)
+
+  args=parser.parse_args()
+  debug=10 if args.log else None
+  if debug is not None: logging.getLogger().setLevel(debug)
+
+  credentials=None
+  if args.credentials is not None:
+    try:
+      with open(args.credentials) as credentialsContent:
+        credentials=json.load(credentialsContent)
+    except:
+      _logger.error('Cannot load local credentials from path '+args.credentials,exc_info=True,stack_info=True)
+
+  _useArchive(record=args.record, replay=args.replay, replaySpeed=args.replaySpeed)
+  sinks=Sinks(separateLines=args.separateLines,
+              bucket=(args.bucket if args.bucket is not None else args.projectId+'_data') if args.storage else None,
+              path=args.path, projectId=args.projectId, topic=args.topic if args.pubsub else None,
+              credentials=credentials,
+              rollBytes=int(args.rollMegabytes*1024*1024) if args.rollMegabytes is not None else None,
+              rollSeconds=args.rollSeconds, format=args.format)
+  poller=OpenSkyPoller(sinks, interval=args.interval, limit=args.limit, columnar=args.columnar, stream=args.stream,
+                       delta=args.delta, deltaCheckpoint=args.deltaCheckpoint, bbox=args.bbox,
+                       tileSize=args.tileSize, track=args.track, trackCapacity=args.trackCapacity,
+                       trackEvictAfter=args.trackEvictMinutes*60 if args.trackEvictMinutes is not None else None,
+                       maxBackoff=args.maxBackoff, debug=debug)
+  signal.signal(signal.SIGTERM, lambda signum, frame: poller.stop())
+  signal.signal(signal.SIGINT, lambda signum, frame: poller.stop())
+  poller.run(maxPolls=args.maxPolls)
+  sinks.close()
+  _logger.info(json.dumps({'log':'OpenSky poller stopped.', 'stats':poller.getStats()}))
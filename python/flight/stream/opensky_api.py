@@ -22,10 +22,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import calendar
+import codecs
+import json
 import logging
 import pprint
 import requests
+import threading
 
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 from collections import defaultdict
 import time
@@ -93,16 +99,212 @@ class OpenSkyStates(object):
         return pprint.pformat(self.__dict__, indent=4)
 
 
+class OpenSkyStateColumns(object):
+    """ Column-oriented (struct-of-arrays) representation of the airspace as seen by OpenSky at a particular time.
+    Instead of one `StateVector` per vehicle, every field of `StateVector.keys` is held in a single column. It has the
+    following fields:
+
+      |  **time** - in seconds since epoch (Unix time stamp). Gives the validity period of all states.
+      |  **size** - the number of state vectors in the snapshot
+      |  **columns** - a dict from field name to its column. Numeric and boolean fields are typed `array.array`s (see
+         `OpenSkyStateColumns.typecodes`), all other fields are lists.
+      |  **valid** - a dict from field name to a `bytearray` null mask; entry i is 1 if the field is present for vehicle i
+    """
+    # array typecodes of the numeric and boolean fields. Fields not listed here keep their decoded values in a list.
+    typecodes = {"time_position": "q", "last_contact": "q", "longitude": "d", "latitude": "d",
+                 "baro_altitude": "d", "on_ground": "b", "velocity": "d", "heading": "d", "vertical_rate": "d",
+                 "geo_altitude": "d", "spi": "b", "position_source": "b"}
+    # Placeholders stored in the typed arrays where the field is null; always check the null mask first.
+    _fill = {"q": 0, "d": float("nan"), "b": 0}
+
+    def __init__(self, j):
+        self.time = j.get("time")
+        states = j.get("states")
+        if states is None:
+            states = []
+        self.size = len(states)
+        self.columns = {}
+        self.valid = {}
+        # zip(*states) transposes the rows into one tuple per field but cuts every field to the shortest row, so rows
+        # are first padded with None to the fields of StateVector (like StateVector, additional entries are ignored.)
+        num_keys = len(StateVector.keys)
+        if any(len(state) != num_keys for state in states):
+            states = [list(state[:num_keys]) + [None] * (num_keys - len(state)) for state in states]
+        transposed = list(zip(*states)) if self.size > 0 else [()] * num_keys
+        for index, key in enumerate(StateVector.keys):
+            values = transposed[index]
+            self.valid[key] = bytearray(value is not None for value in values)
+            typecode = OpenSkyStateColumns.typecodes.get(key)
+            if typecode is None:
+                self.columns[key] = list(values)
+            else:
+                fill = OpenSkyStateColumns._fill[typecode]
+                if typecode == "d":
+                    self.columns[key] = array(typecode, [fill if value is None else value for value in values])
+                else:
+                    self.columns[key] = array(typecode, [fill if value is None else int(value) for value in values])
+
+    def column(self, key):
+        """ :return: a list of the values of the given field with None where the field is null """
+        return [value if present else None for value, present in zip(self.columns[key], self.valid[key])]
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return "<OpenSkyStateColumns@time=%s size=%d>" % (str(self.time), self.size)
+
+
+class OpenSkyStatesStream(object):
+    """ Represents the state of the airspace as seen by OpenSky at a particular time, decoded incrementally from a
+    streamed HTTP response. It has the following fields:
+
+      |  **time** - in seconds since epoch (Unix time stamp). None until it has been read from the response (OpenSky
+         sends it before the states.)
+      |  **states** - an iterator of `StateVector`, decoded one at a time while the response body is read
+
+    Stop iterating at any point and call `close` to release the connection without reading the rest of the body.
+    Only one state vector and one chunk of the body are held in memory at a time.
+    """
+    _whitespace = " \t\n\r"
+
+    def __init__(self, response, chunk_size=64 * 1024, on_close=None):
+        self._response = response
+        self._on_close = on_close
+        self._chunks = response.iter_content(chunk_size=chunk_size)
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self.time = None
+        self._decoded = self._decode()
+        # Read up to the first state vector so that fields sent before the states (i.e. time) are available.
+        self._first = next(self._decoded, None)
+        self.states = self._states()
+
+    def _states(self):
+        if self._first is not None:
+            first, self._first = self._first, None
+            yield first
+            for state in self._decoded:
+                yield state
+        # The body has been read completely; release the connection (and count it) without waiting for close.
+        self.close()
+
+    def __iter__(self):
+        return self.states
+
+    def _fill(self):
+        """ Read the next chunk of the body into the buffer, dropping what has already been decoded.
+
+        :return: False if the body has been read completely
+        """
+        if self._eof:
+            return False
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        for chunk in self._chunks:
+            text = self._text_decoder.decode(chunk)
+            if len(text) > 0:
+                self._buffer += text
+                return True
+        self._buffer += self._text_decoder.decode(b"", final=True)
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """ :return: the next non-whitespace character without consuming it, or None at the end of the body """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in self._whitespace:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, characters):
+        c = self._peek()
+        if c is None or c not in characters:
+            raise ValueError("Unexpected {0!r} in states response, expected one of {1!r}".format(c, characters))
+        self._pos += 1
+        return c
+
+    def _value(self):
+        """ Decode the next complete JSON value, reading more of the body as needed. """
+        self._peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer may continue in the next chunk.
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def _decode(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key != "states":
+                value = self._value()
+                # Only known fields are kept; anything else the response carries must not shadow attributes.
+                if key == "time":
+                    self.time = value
+            elif self._peek() != "[":
+                self._value()  # null if there have been no states received
+            else:
+                self._expect("[")
+                if self._peek() != "]":
+                    while True:
+                        yield StateVector(self._value())
+                        if self._expect(",]") == "]":
+                            break
+                else:
+                    self._expect("]")
+            if self._expect(",}") == "}":
+                break
+
+    def close(self):
+        """ Stop reading the response and release the connection. """
+        self._decoded.close()
+        self._response.close()
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close(self._response)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return "<OpenSkyStatesStream@time=%s>" % str(self.time)
+
+
 class OpenSkyApi(object):
     """
     Main class of the OpenSky Network API. Instances retrieve data from OpenSky via HTTP
     """
-    def __init__(self, username=None, password=None):
+    def __init__(self, username=None, password=None, timeout=(10.0, 60.0), pool_connections=1, pool_maxsize=10):
         """ Create an instance of the API client. If you do not provide username and password requests will be
         anonymous which imposes some limitations.
 
+        The client keeps one HTTP session for its whole lifetime so that connections to OpenSky are kept alive and
+        reused between requests. Responses are requested gzip/deflate compressed.
+
         :param username: an OpenSky username (optional)
         :param password: an OpenSky password for the given username (optional)
+        :param timeout: seconds to wait for OpenSky, either one number or a (connect, read) tuple
+        :param pool_connections: the number of hosts to keep a connection pool for
+        :param pool_maxsize: the maximum number of connections to keep alive per host
         """
         if username is not None:
             self._auth = (username, password)
@@ -110,15 +312,92 @@ class OpenSkyApi(object):
             self._auth = ()
         self._api_url = "https://opensky-network.org/api"
         self._last_requests = defaultdict(lambda: 0)
+        self._timeout = timeout
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+        self._session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+        # Guards the counters and _empty_tiles, which are updated by the threads requesting tiles.
+        self._counter_lock = threading.Lock()
+        self._bytes_on_wire = 0
+        self._bytes_decoded = 0
+        self._num_requests = 0
+        # tile bbox -> [number of consecutive polls it was empty, number of polls it has been skipped since]
+        self._empty_tiles = defaultdict(lambda: [0, 0])
+
+    def _count_response(self, r):
+        """ Add the size of a fully read (or closed) response to the byte counters. """
+        try:
+            size = r.raw.tell()
+            with self._counter_lock:
+                self._bytes_on_wire += size
+        except Exception:
+            logger.debug("Cannot count the bytes received for {0:s}".format(r.url))
+
+    def get_connection_stats(self):
+        """ Counters for the requests made by this client, to confirm that connections are reused:
+
+          |  **requests** - the number of requests sent to OpenSky
+          |  **connections** - the number of connections opened
+          |  **reused** - the number of requests sent over an already open connection
+          |  **bytes_on_wire** - the number of (compressed) response body bytes received
+          |  **bytes_decoded** - the number of response body bytes after decompression (requests that were not streamed)
+        """
+        with self._counter_lock:
+            stats = {"requests": self._num_requests,
+                     "bytes_on_wire": self._bytes_on_wire, "bytes_decoded": self._bytes_decoded}
+        connections = 0
+        pool_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools[key]
+            connections += pool.num_connections
+            pool_requests += pool.num_requests
+        stats["connections"] = connections
+        stats["reused"] = max(pool_requests - connections, 0)
+        return stats
+
+    def close(self):
+        """ Close all connections kept alive by this client. """
+        self._session.close()
+
+    def _get_content(self, url_post, callee, params=None):
+        """ :return: the (decompressed) body of the response as bytes, or None if the request was not successful """
+        with self._counter_lock:
+            self._num_requests += 1
+        r = self._session.get("{0:s}{1:s}".format(self._api_url, url_post),
+                              auth=self._auth, params=params, timeout=self._timeout)
+        self._count_response(r)
+        with self._counter_lock:
+            self._bytes_decoded += len(r.content)
+        if r.status_code == 200:
+            self._last_requests[callee] = time.time()
+            return r.content
+        else:
+            logger.debug("Response not OK. Status {0:d} - {1:s}".format(r.status_code, r.reason))
+        return None
 
     def _get_json(self, url_post, callee, params=None):
-        r = requests.get("{0:s}{1:s}".format(self._api_url, url_post),
-                         auth=self._auth, params=params, timeout=60.00)
+        content = self._get_content(url_post, callee, params=params)
+        if content is not None:
+            return json.loads(content)
+        return None
+
+    def _get_stream(self, url_post, callee, params=None):
+        """ Like _get_json, but returns the response with its body still unread so that it can be decoded
+        incrementally. The caller must close the response. """
+        with self._counter_lock:
+            self._num_requests += 1
+        r = self._session.get("{0:s}{1:s}".format(self._api_url, url_post),
+                              auth=self._auth, params=params, timeout=self._timeout, stream=True)
         if r.status_code == 200:
             self._last_requests[callee] = time.time()
-            return r.json()
+            return r
         else:
             logger.debug("Response not OK. Status {0:d} - {1:s}".format(r.status_code, r.reason))
+            r.close()
+            self._count_response(r)
         return None
 
     def _check_rate_limit(self, time_diff_noauth, time_diff_auth, func):
@@ -128,10 +407,20 @@ class OpenSkyApi(object):
         :param time_diff_auth: the minimum time between two requests in seconds if using authentication
         :param func: the API function to evaluate
         """
-        if len(self._auth) < 2:
-            return abs(time.time() - self._last_requests[func]) >= time_diff_noauth
-        else:
-            return abs(time.time() - self._last_requests[func]) >= time_diff_auth
+        return self._rate_limit_wait(time_diff_noauth, time_diff_auth, func) <= 0
+
+    def _rate_limit_wait(self, time_diff_noauth, time_diff_auth, func):
+        """ seconds until _check_rate_limit will let a request for func through (0 if it would now) """
+        time_diff = time_diff_noauth if len(self._auth) < 2 else time_diff_auth
+        return max(0.0, self._last_requests[func] + time_diff - time.time())
+
+    def get_states_interval(self):
+        """ :return: the minimum number of seconds between two calls of get_states (10 if anonymous, 5 otherwise) """
+        return 10 if len(self._auth) < 2 else 5
+
+    def get_states_wait(self):
+        """ :return: seconds to wait before get_states will not be blocked by the client-side rate limit """
+        return self._rate_limit_wait(10, 5, self.get_states)
 
     @staticmethod
     def _check_lat(lat):
@@ -143,15 +432,20 @@ class OpenSkyApi(object):
         if lon < -180 or lon > 180:
             raise ValueError("Invalid longitude {:f}! Must be in [-180, 180]".format(lon))
 
-    def get_states(self, time_secs=0, icao24=None, serials=None, bbox=()):
+    def get_states(self, time_secs=0, icao24=None, serials=None, bbox=(), columnar=False, stream=False):
         """ Retrieve state vectors for a given time. If time = 0 the most recent ones are taken.
         Optional filters may be applied for ICAO24 addresses.
 
         :param time_secs: time as Unix time stamp (seconds since epoch) or datetime. The datetime must be in UTC!
         :param icao24: optionally retrieve only state vectors for the given ICAO24 address(es). The parameter can either be a single address as str or an array of str containing multiple addresses
         :param bbox: optionally retrieve state vectors within a bounding box. The bbox must be a tuple of exactly four values [min_latitude, max_latitude, min_longitude, max_latitude] each in WGS84 decimal degrees.
-        :return: OpenSkyStates if request was successful, None otherwise
+        :param columnar: decode the snapshot into an OpenSkyStateColumns instead of one StateVector per vehicle.
+        :param stream: return an OpenSkyStatesStream that decodes state vectors while the response is being read. Cannot be
+            combined with columnar.
+        :return: OpenSkyStates (or OpenSkyStateColumns if columnar, OpenSkyStatesStream if stream) if request was successful, None otherwise
         """
+        if columnar and stream:
+            raise ValueError("A streamed response cannot be decoded into columns, use either columnar or stream")
         if not self._check_rate_limit(10, 5, self.get_states):
             logger.debug("Blocking request due to rate limit")
             return None
@@ -175,12 +469,132 @@ class OpenSkyApi(object):
         elif len(bbox) > 0:
             raise ValueError("Invalid bounding box! Must be [min_latitude, max_latitude, min_longitude, max_latitude]")
 
+        if stream:
+            r = self._get_stream("/states/all", self.get_states, params=params)
+            if r is not None:
+                return OpenSkyStatesStream(r, on_close=self._count_response)
+            return None
+
         states_json = self._get_json("/states/all", self.get_states,
                                      params=params)
         if states_json is not None:
+            if columnar:
+                return OpenSkyStateColumns(states_json)
             return OpenSkyStates(states_json)
         return None
 
+    @staticmethod
+    def _make_tiles(bbox, tile_size):
+        """ Split a bounding box into tiles of at most tile_size = (latitude degrees, longitude degrees). """
+        if tile_size[0] <= 0 or tile_size[1] <= 0:
+            raise ValueError("Invalid tile size {0!r}! Must be positive".format(tuple(tile_size)))
+        if bbox[0] > bbox[1] or bbox[2] > bbox[3]:
+            raise ValueError("Invalid bounding box {0!r}! Minimums must not exceed maximums".format(tuple(bbox)))
+        tiles = []
+        min_lat = bbox[0]
+        while min_lat < bbox[1]:
+            max_lat = min(min_lat + tile_size[0], bbox[1])
+            min_lon = bbox[2]
+            while min_lon < bbox[3]:
+                max_lon = min(min_lon + tile_size[1], bbox[3])
+                tiles.append((round(min_lat, 6), round(max_lat, 6), round(min_lon, 6), round(max_lon, 6)))
+                min_lon = max_lon
+            min_lat = max_lat
+        return tiles
+
+    def _skip_tile(self, tile, skip_empty_after, reprobe_every):
+        """ :return: True if the tile was empty in the last skip_empty_after polls and is not due to be probed again """
+        if skip_empty_after is None:
+            return False
+        with self._counter_lock:
+            empty = self._empty_tiles[tile]
+            if empty[0] < skip_empty_after or empty[1] + 1 >= reprobe_every:
+                empty[1] = 0
+                return False
+            empty[1] += 1
+            return True
+
+    def get_states_tiled(self, bbox, tile_size=(10.0, 10.0), time_secs=0, max_workers=4, columnar=False,
+                         skip_empty_after=3, reprobe_every=6):
+        """ Retrieve state vectors within a bounding box by splitting it into tiles that are requested concurrently.
+        Vehicles reported by more than one tile are merged, keeping the state vector with the latest last_contact.
+        The client-side rate limit of get_states counts from the last tile sent, so get_states (and the next tiled
+        request) is blocked for one interval after it (see get_states_wait.)
+
+        :param bbox: the region of interest as [min_latitude, max_latitude, min_longitude, max_longitude] in WGS84 decimal degrees.
+        :param tile_size: the (latitude, longitude) size of a tile in degrees. A single number is used for both.
+        :param time_secs: time as Unix time stamp (seconds since epoch) or datetime. The datetime must be in UTC!
+        :param max_workers: the maximum number of tiles requested at the same time.
+        :param columnar: return an OpenSkyStateColumns instead of an OpenSkyStates.
+        :param skip_empty_after: skip tiles that were empty in this many consecutive polls (None to never skip.)
+        :param reprobe_every: request a skipped tile again every this many polls, to notice when it fills up.
+        :return: OpenSkyStates (or OpenSkyStateColumns if columnar) if at least one tile was retrieved, None otherwise
+        """
+        if len(bbox) != 4:
+            raise ValueError("Invalid bounding box! Must be [min_latitude, max_latitude, min_longitude, max_latitude]")
+        OpenSkyApi._check_lat(bbox[0])
+        OpenSkyApi._check_lat(bbox[1])
+        OpenSkyApi._check_lon(bbox[2])
+        OpenSkyApi._check_lon(bbox[3])
+        if not self._check_rate_limit(10, 5, self.get_states):
+            logger.debug("Blocking request due to rate limit")
+            return None
+        if not isinstance(tile_size, (tuple, list)):
+            tile_size = (tile_size, tile_size)
+        elif len(tile_size) == 1:
+            tile_size = (tile_size[0], tile_size[0])
+
+        t = time_secs
+        if type(time_secs) == datetime:
+            t = calendar.timegm(t.timetuple())
+
+        tiles = [tile for tile in OpenSkyApi._make_tiles(bbox, tile_size)
+                 if not self._skip_tile(tile, skip_empty_after, reprobe_every)]
+
+        sent = []
+
+        def get_tile(tile):
+            params = {"time": int(t), "lamin": tile[0], "lamax": tile[1], "lomin": tile[2], "lomax": tile[3]}
+            sent.append(time.time())
+            try:
+                return self._get_json("/states/all", self.get_states, params=params)
+            except Exception:
+                logger.debug("Failed to retrieve tile {0!r}".format(tile), exc_info=True)
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tiles)))) as executor:
+            responses = list(executor.map(get_tile, tiles))
+        if len(sent) > 0:
+            # Successful tiles already stamped the time of their response, which is never earlier.
+            with self._counter_lock:
+                self._last_requests[self.get_states] = max(self._last_requests[self.get_states], max(sent))
+
+        snapshot_time = None
+        merged = {}
+        num_retrieved = 0
+        for tile, states_json in zip(tiles, responses):
+            if states_json is None:
+                continue
+            num_retrieved += 1
+            if states_json.get("time") is not None:
+                snapshot_time = max(snapshot_time or 0, states_json["time"])
+            states = states_json.get("states") or []
+            with self._counter_lock:
+                empty = self._empty_tiles[tile]
+                empty[0] = 0 if len(states) > 0 else empty[0] + 1
+            for state in states:
+                # icao24 is at index 0 and last_contact at index 4 of a state vector.
+                known = merged.get(state[0])
+                if known is None or (state[4] or 0) > (known[4] or 0):
+                    merged[state[0]] = state
+        logger.debug("Retrieved {0:d} of {1:d} tiles".format(num_retrieved, len(tiles)))
+        if num_retrieved == 0 and len(tiles) > 0:
+            return None
+        states_json = {"time": snapshot_time, "states": list(merged.values())}
+        if columnar:
+            return OpenSkyStateColumns(states_json)
+        return OpenSkyStates(states_json)
+
     def get_my_states(self, time_secs=0, icao24=None, serials=None):
         """ Retrieve state vectors for your own sensors. Authentication is required for this operation.
         If time = 0 the most recent ones are taken. Optional filters may be applied for ICAO24 addresses and sensor
@@ -0,0 +1,210 @@
+# Encoders that turn a batch of flight records (dicts as produced by openSkyParser) into the contents of one file.
+# The column types of the Parquet and Avro encoders come from the BigQuery schema in schema/openSky_bigQuery.json so
+# that the files load into BigQuery without schema detection:
+#   json      -- newline delimited JSON (what Storage writes by default.)
+#   json.gz   -- gzip compressed newline delimited JSON; BigQuery loads it directly.
+#   json.zst  -- zstd compressed newline delimited JSON, for archiving (BigQuery cannot load zstd JSON.) Needs zstandard.
+#   parquet   -- Parquet with row groups sized from the data. Needs pyarrow.
+#   avro      -- Avro with timestamp-micros logical types (load with --use_avro_logical_types.) Needs fastavro.
+# The optional libraries are not part of requirements_flight-streaming.txt; add the ones for the formats you use.
+import datetime
+import gzip
+import io
+import json
+import os
+
+from common import serialization
+
+try:
+  import pyarrow
+  import pyarrow.compute
+  import pyarrow.parquet
+except ImportError:
+  pyarrow=None
+
+try:
+  import fastavro
+except ImportError:
+  fastavro=None
+
+try:
+  import zstandard
+except ImportError:
+  zstandard=None
+
+_schemaFolder='schema'
+_timestampFormat='%Y-%m-%d %H:%M:%S'
+
+def loadSchema(name='openSky_bigQuery.json'):
+  '''
+  Find and read a BigQuery schema file. The schema folder is looked for in the folders above this file, which covers
+  both the repository layout and the Cloud Function zip created by sh/createFlightStreamingZip.sh.
+  :param name: the file name of the schema within the schema folder.
+  :return (list): the list of fields of the schema.
+  '''
+  folder=os.path.dirname(os.path.abspath(__file__))
+  while True:
+    path=os.path.join(folder, _schemaFolder, name)
+    if os.path.exists(path):
+      with open(path) as schemaFile:
+        return json.load(schemaFile)
+    parent=os.path.dirname(folder)
+    if parent==folder: raise Exception('Cannot find {schema}/{name} above {here}.'.format(
+      schema=_schemaFolder, name=name, here=os.path.dirname(os.path.abspath(__file__))))
+    folder=parent
+
+def _toString(value):
+  return value if value is None or type(value)==str else str(value)
+
+def _toTimestamp(value, cache):
+  '''
+  Parse a timestamp written by openSkyParser, remembering the result since most records share a few timestamps.
+  '''
+  if value is None: return None
+  parsed=cache.get(value)
+  if parsed is None:
+    parsed=datetime.datetime.strptime(value, _timestampFormat)
+    cache[value]=parsed
+  return parsed
+
+class NdjsonEncoder(object):
+  '''
+  Newline delimited JSON, optionally compressed with gzip or zstd.
+  '''
+  # Line based encoders can be given lines that have already been serialized (see encodeLines.)
+  lineBased=True
+  _extensions={None:'.json', 'gzip':'.json.gz', 'zstd':'.json.zst'}
+  _contentTypes={None:'application/x-ndjson', 'gzip':'application/gzip', 'zstd':'application/zstd'}
+
+  def __init__(self, compression=None, level=None):
+    '''
+    :param compression: None, 'gzip' or 'zstd'.
+    :param level: the compression level (defaults to 6 for gzip and 3 for zstd.)
+    '''
+    if compression not in self._extensions:
+      raise ValueError('Unknown compression "{compression}".'.format(compression=compression))
+    if compression=='zstd' and zstandard is None:
+      raise Exception('zstd output requires the zstandard library (pip install zstandard).')
+    self._compression=compression
+    self._level=level
+    self.extension=self._extensions[compression]
+    # Compressed files are stored as is (no Content-Encoding) so that BigQuery reads the compressed bytes.
+    self.contentType=self._contentTypes[compression]
+
+  def encodeLines(self, lines):
+    '''
+    :param lines: a list of bytes, each a record serialized as JSON.
+    :return (bytes): the contents of the file.
+    '''
+    data=b'\n'.join(lines)
+    if self._compression=='gzip':
+      return gzip.compress(data, compresslevel=6 if self._level is None else self._level)
+    if self._compression=='zstd':
+      return zstandard.ZstdCompressor(level=3 if self._level is None else self._level).compress(data)
+    return data
+
+  def encode(self, records):
+    '''
+    :param records: a list of dicts representing records.
+    :return (bytes): the contents of the file.
+    '''
+    return self.encodeLines([serialization.dumps(record) for record in records])
+
+class ParquetEncoder(object):
+  '''
+  Parquet with the columns of a BigQuery schema. Records are turned into one column per field before they are written.
+  Fields of records that are not in the schema are not written.
+  '''
+  lineBased=False
+  _types={'STRING':'string', 'INTEGER':'int64', 'FLOAT':'float64', 'BOOLEAN':'bool_', 'TIMESTAMP':'string'}
+
+  def __init__(self, schema=None, rowGroupBytes=128*1024*1024, compression='snappy'):
+    '''
+    :param schema: a list of BigQuery fields; defaults to schema/openSky_bigQuery.json.
+    :param rowGroupBytes: the target in-memory size of a row group.
+    :param compression: the Parquet compression codec.
+    '''
+    if pyarrow is None: raise Exception('Parquet output requires the pyarrow library (pip install pyarrow).')
+    self._fields=loadSchema() if schema is None else schema
+    self._rowGroupBytes=rowGroupBytes
+    self._compression=compression
+    self._schema=pyarrow.schema([pyarrow.field(field['name'], self._arrowType(field['type']),
+                                               nullable=field.get('mode', 'NULLABLE')!='REQUIRED')
+                                 for field in self._fields])
+    self.extension='.parquet'
+    self.contentType='application/octet-stream'
+
+  @staticmethod
+  def _arrowType(bigQueryType):
+    if bigQueryType=='TIMESTAMP': return pyarrow.timestamp('s')
+    return getattr(pyarrow, ParquetEncoder._types[bigQueryType])()
+
+  def _column(self, field, records):
+    values=[record.get(field['name']) for record in records]
+    if field['type']=='STRING':
+      return pyarrow.array([_toString(value) for value in values], type=pyarrow.string())
+    if field['type']=='TIMESTAMP':
+      return pyarrow.compute.strptime(pyarrow.array(values, type=pyarrow.string()), format=_timestampFormat, unit='s')
+    return pyarrow.array(values, type=self._arrowType(field['type']))
+
+  def encode(self, records):
+    table=pyarrow.Table.from_arrays([self._column(field, records) for field in self._fields], schema=self._schema)
+    bytesPerRow=max(1, table.nbytes//max(1, table.num_rows))
+    output=io.BytesIO()
+    pyarrow.parquet.write_table(table, output, compression=self._compression,
+                                row_group_size=max(1, self._rowGroupBytes//bytesPerRow))
+    return output.getvalue()
+
+class AvroEncoder(object):
+  '''
+  Avro with the fields of a BigQuery schema. Fields of records that are not in the schema are not written.
+  '''
+  lineBased=False
+  _types={'STRING':'string', 'INTEGER':'long', 'FLOAT':'double', 'BOOLEAN':'boolean',
+          'TIMESTAMP':{'type':'long', 'logicalType':'timestamp-micros'}}
+
+  def __init__(self, schema=None, codec='deflate', name='flight'):
+    '''
+    :param schema: a list of BigQuery fields; defaults to schema/openSky_bigQuery.json.
+    :param codec: the Avro block compression codec.
+    :param name: the name of the Avro record.
+    '''
+    if fastavro is None: raise Exception('Avro output requires the fastavro library (pip install fastavro).')
+    self._fields=loadSchema() if schema is None else schema
+    self._codec=codec
+    self._schema=fastavro.parse_schema({
+      'type':'record', 'name':name,
+      'fields':[{'name':field['name'], 'type':['null', self._types[field['type']]], 'default':None}
+                for field in self._fields]})
+    self._converters=[(field['name'], field['type']) for field in self._fields]
+    self.extension='.avro'
+    self.contentType='application/octet-stream'
+
+  def _rows(self, records):
+    timestamps={}
+    for record in records:
+      row={}
+      for name, bigQueryType in self._converters:
+        value=record.get(name)
+        if bigQueryType=='STRING': value=_toString(value)
+        elif bigQueryType=='TIMESTAMP': value=_toTimestamp(value, timestamps)
+        row[name]=value
+      yield row
+
+  def encode(self, records):
+    output=io.BytesIO()
+    fastavro.writer(output, self._schema, self._rows(records), codec=self._codec)
+    return output.getvalue()
+
+def getEncoder(outputFormat, schema=None):
+  '''
+  :param outputFormat: one of json, json.gz, json.zst, parquet or avro.
+  :param schema: a list of BigQuery fields for the parquet and avro formats; defaults to schema/openSky_bigQuery.json.
+  :return: an encoder with encode(records) returning bytes and extension and contentType properties.
+  '''
+  if outputFormat in [None, 'json']: return NdjsonEncoder()
+  if outputFormat in ['json.gz', 'gzip']: return NdjsonEncoder(compression='gzip')
+  if outputFormat in ['json.zst', 'zstd']: return NdjsonEncoder(compression='zstd')
+  if outputFormat=='parquet': return ParquetEncoder(schema=schema)
+  if outputFormat=='avro': return AvroEncoder(schema=schema)
+  raise ValueError('Unknown output format "{outputFormat}".'.format(outputFormat=outputFormat))
@@ -0,0 +1,225 @@
+# Records the raw responses of OpenSky to a local archive and replays them without a network connection, so that the
+# whole parse/convert/output path of openSkyParser can be benchmarked and regression-tested on the same data:
+#   - An archive is two append-only files: PATH.data holds every response body as its own gzip member and PATH.index
+#     holds one JSON line per response with the time it was recorded, the request and where its body is in PATH.data.
+#   - RecordingOpenSkyApi is an OpenSkyApi that appends every successful response to an archive.
+#   - ReplayOpenSkyApi is an OpenSkyApi that serves the archived responses in the order they were recorded, reading
+#     them through a memory map, at the speed they were recorded (or speed times faster.)
+# Use the same options (columnar, stream, bbox, ...) for replaying as for recording; responses are served in order,
+# whatever the request. From the command-line:
+#   python openSkyParser.py -record /tmp/opensky ...   then   python openSkyPoller.py -replay /tmp/opensky -replaySpeed 10 ...
+import gzip
+import io
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+
+from flight.stream.opensky_api import OpenSkyApi
+
+_logger=logging.getLogger(__name__)
+
+class ResponseArchive(object):
+  '''
+  An append-only archive of response bodies with an index of when they were recorded.
+  '''
+  def __init__(self, path):
+    '''
+    :param path: the archive is stored in path+'.data' and path+'.index'.
+    '''
+    self._dataPath=path+'.data'
+    self._indexPath=path+'.index'
+    self._lock=threading.Lock()
+    self._map=None
+    self._mapSize=0
+
+  def append(self, url, params, content, recorded=None):
+    '''
+    :param url: the path of the request within the API.
+    :param params: the parameters of the request.
+    :param content (bytes): the body of the response.
+    :param recorded: the time the response was received; defaults to now.
+    '''
+    compressed=gzip.compress(content, compresslevel=6)
+    with self._lock:
+      with open(self._dataPath, 'ab') as dataFile:
+        offset=dataFile.tell()
+        dataFile.write(compressed)
+      entry={'recorded':time.time() if recorded is None else recorded, 'url':url,
+             'params':dict((key, value) for key, value in (params or {}).items() if value is not None),
+             'offset':offset, 'length':len(compressed), 'size':len(content)}
+      # The index line is written last so that a crash never indexes a body that is not completely written.
+      with open(self._indexPath, 'a') as indexFile:
+        indexFile.write(json.dumps(entry)+'\n')
+
+  def entries(self):
+    '''
+    :return (list): the index entries in the order they were recorded.
+    '''
+    if not os.path.exists(self._indexPath): return []
+    entries=[]
+    with open(self._indexPath) as indexFile:
+      for line in indexFile:
+        try:
+          entries.append(json.loads(line))
+        except ValueError:
+          _logger.warning('Skipping a partially written line of '+self._indexPath)
+    return entries
+
+  def read(self, entry):
+    '''
+    :param entry: an entry returned by entries.
+    :return (bytes): the body of the response.
+    '''
+    with self._lock:
+      end=entry['offset']+entry['length']
+      if self._map is None or end>self._mapSize:
+        # The data file has grown (or has not been mapped yet.)
+        self.close()
+        with open(self._dataPath, 'rb') as dataFile:
+          self._map=mmap.mmap(dataFile.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapSize=len(self._map)
+      return gzip.decompress(self._map[entry['offset']:end])
+
+  def close(self):
+    if self._map is not None:
+      self._map.close()
+      self._map=None
+
+class RecordingOpenSkyApi(OpenSkyApi):
+  '''
+  An OpenSkyApi that appends the body of every successful response to a ResponseArchive. Streamed responses are read
+  completely before they are recorded and decoded.
+  '''
+  def __init__(self, path, *args, **kwargs):
+    '''
+    :param path: the path of the archive (see ResponseArchive.)
+    Other arguments are passed to OpenSkyApi.
+    '''
+    super().__init__(*args, **kwargs)
+    self.archive=ResponseArchive(path)
+
+  def _get_content(self, url_post, callee, params=None):
+    content=super()._get_content(url_post, callee, params=params)
+    if content is not None: self.archive.append(url_post, params, content)
+    return content
+
+  def _get_stream(self, url_post, callee, params=None):
+    r=super()._get_stream(url_post, callee, params=params)
+    if r is None: return None
+    try:
+      content=r.content
+    finally:
+      r.close()
+      self._count_response(r)
+    self.archive.append(url_post, params, content)
+    return _ArchivedResponse(url_post, content, 0)
+
+class _ArchivedResponse(object):
+  '''
+  The parts of a requests.Response used by OpenSkyStatesStream, served from memory.
+  '''
+  def __init__(self, url, content, compressedSize):
+    self.url=url
+    self.status_code=200
+    self._content=memoryview(content)
+    # OpenSkyApi._count_response counts raw.tell() as the bytes received.
+    self.raw=io.BytesIO()
+    self.raw.seek(compressedSize)
+
+  def iter_content(self, chunk_size=1):
+    for start in range(0, len(self._content), chunk_size):
+      yield bytes(self._content[start:start+chunk_size])
+
+  def close(self):
+    pass
+
+class ReplayOpenSkyApi(OpenSkyApi):
+  '''
+  An OpenSkyApi that serves the responses of a ResponseArchive instead of calling OpenSky. Response i is served no
+  earlier than (recorded time of i - recorded time of the first response)/speed after the first request.
+  '''
+  def __init__(self, path, speed=1.0, loop=False, *args, **kwargs):
+    '''
+    :param path: the path of the archive (see ResponseArchive.)
+    :param speed: how many times faster than recorded to serve the responses.
+    :param loop: start over at the end of the archive instead of returning no more responses.
+    Other arguments are passed to OpenSkyApi.
+    '''
+    if speed<=0: raise ValueError('The replay speed must be positive.')
+    super().__init__(*args, **kwargs)
+    self.archive=ResponseArchive(path)
+    self._entries=self.archive.entries()
+    if len(self._entries)==0: raise ValueError('There are no responses in the archive at '+path)
+    self._speed=speed
+    self._loop=loop
+    self._next=0
+    self._loops=0
+    self._started=None
+    self._replayLock=threading.Lock()
+
+  def _check_rate_limit(self, time_diff_noauth, time_diff_auth, func):
+    # Responses are paced by their recorded times instead.
+    return True
+
+  def _rate_limit_wait(self, time_diff_noauth, time_diff_auth, func):
+    return 0.0
+
+  def get_states_interval(self):
+    return super().get_states_interval()/self._speed
+
+  def _nextEntry(self):
+    '''
+    :return: the next entry and the time it is to be served, or None at the end of the archive.
+    '''
+    with self._replayLock:
+      if self._next>=len(self._entries):
+        if not self._loop: return None
+        self._next=0
+        self._loops+=1
+      entry=self._entries[self._next]
+      self._next+=1
+      now=time.time()
+      if self._started is None: self._started=now
+      first=self._entries[0]['recorded']
+      duration=self._entries[-1]['recorded']-first
+      due=self._started+(self._loops*duration+entry['recorded']-first)/self._speed
+    return entry, due
+
+  def _replay(self):
+    nextEntry=self._nextEntry()
+    if nextEntry is None:
+      _logger.debug('No more responses to replay.')
+      return None
+    entry, due=nextEntry
+    wait=due-time.time()
+    if wait>0: time.sleep(wait)
+    with self._counter_lock:
+      self._num_requests+=1
+    content=self.archive.read(entry)
+    with self._counter_lock:
+      self._bytes_on_wire+=entry['length']
+    return entry, content
+
+  def _get_content(self, url_post, callee, params=None):
+    replayed=self._replay()
+    if replayed is None: return None
+    entry, content=replayed
+    with self._counter_lock:
+      self._bytes_decoded+=len(content)
+    self._last_requests[callee]=time.time()
+    return content
+
+  def _get_stream(self, url_post, callee, params=None):
+    replayed=self._replay()
+    if replayed is None: return None
+    entry, content=replayed
+    self._last_requests[callee]=time.time()
+    # Already counted by _replay.
+    return _ArchivedResponse(url_post, content, 0)
+
+  def close(self):
+    super().close()
+    self.archive.close()
@@ -0,0 +1,109 @@
+# Builds a converter from OpenSky state vectors to flight records that is specialized for one BigQuery schema. Instead
+# of calling openSkyParser._convert for every field and formatting the same few timestamps over and over, the schema is
+# compiled once into a single Python function with one inlined conversion per field, and timestamps are formatted once
+# per distinct epoch second within a snapshot:
+#   converter=RowConverter()  # schema/openSky_bigQuery.json
+#   records=converter.convertRows(flightStates.states, queryTime)
+# print(converter.source) shows the generated function.
+import datetime
+import logging
+
+from flight.stream.outputFormats import loadSchema
+
+_logger=logging.getLogger(__name__)
+
+# Record fields, in the order openSkyParser._convertRow creates them, and the StateVector fields they come from.
+_sources=[('icao24','icao24'), ('callsign','callsign'), ('origin','origin_country'), ('time','time_position'),
+          ('contact','last_contact'), ('longitude','longitude'), ('latitude','latitude'), ('altitude','geo_altitude'),
+          ('on_ground','on_ground'), ('velocity','velocity'), ('heading','heading'), ('vertical_rate','vertical_rate'),
+          ('sensors','sensors'), ('baro_altitude','baro_altitude'), ('squawk','squawk'), ('spi','spi'),
+          ('position_source','position_source')]
+# TIMESTAMP fields and the StateVector fields they are formatted from (None for the time OpenSky was queried.)
+_timestampSources=[('time_bq','time_position'), ('contact_bq','last_contact'), ('query_time_bq',None)]
+# The table declares time and contact as STRING, but they have always been written to JSON as epoch seconds, which
+# BigQuery converts; keep them as numbers so records do not change (Parquet and Avro write them as strings.)
+_typeOverrides={'time':'INTEGER', 'contact':'INTEGER'}
+# As openSkyParser._convert does; sensors is a list of serial numbers, written as its string representation.
+_conversions={'STRING':'({value}.strip() if type({value}) is str else str({value}))', 'INTEGER':'int({value})',
+              'FLOAT':'float({value})', 'BOOLEAN':'bool({value})'}
+
+def formatTimestamp(value, timestamps):
+  '''
+  Format a time in seconds like openSkyParser._convertTimestamp and remember the result in timestamps.
+  :return: a string representation of a date and time or else None if the translation failed.
+  '''
+  try:
+    formatted=datetime.datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+  except:
+    formatted=None
+  timestamps[value]=formatted
+  return formatted
+
+def _generate(fields):
+  '''
+  :param fields: a list of BigQuery fields.
+  :return (str): the source of a convertRow(state, queryTime, timestamps) function for the fields.
+  '''
+  types=dict((field['name'], _typeOverrides.get(field['name'], field['type'])) for field in fields)
+  known=set(name for name, source in _sources+_timestampSources)
+  unknown=[name for name in types if name not in known]
+  if len(unknown)>0: raise ValueError('No OpenSky source for schema fields {fields}.'.format(fields=', '.join(unknown)))
+
+  lines=['def convertRow(state, queryTime, timestamps):', '  row = {}']
+  for name, source in _sources:
+    if name not in types: continue
+    lines.append('  value = state.{source}'.format(source=source))
+    lines.append('  if value is not None: row[{name!r}] = {conversion}'.format(
+      name=name, conversion=_conversions[types[name]].format(value='value')))
+  # Timestamps are added last, as in _convertRow.
+  for name, source in _timestampSources:
+    if name not in types: continue
+    value='queryTime' if source is None else 'state.{source}'.format(source=source)
+    lines.append('  value = {value}'.format(value=value))
+    lines.append('  if value is not None:')
+    lines.append('    value = timestamps.get(value) or formatTimestamp(value, timestamps)')
+    lines.append('    if value is not None: row[{name!r}] = value'.format(name=name))
+  lines.append('  return row')
+  return '\n'.join(lines)+'\n'
+
+class RowConverter(object):
+  '''
+  Converts StateVectors into records with the fields of a BigQuery schema, without any of the fields that are None.
+  '''
+  def __init__(self, schema=None, name='openSky_bigQuery'):
+    '''
+    :param schema: a list of BigQuery fields; defaults to schema/openSky_bigQuery.json.
+    :param name: a name for the generated code, shown in tracebacks.
+    '''
+    self.fields=loadSchema() if schema is None else schema
+    self.source=_generate(self.fields)
+    namespace={'formatTimestamp':formatTimestamp}
+    exec(compile(self.source, '<rowConverter:{name}>'.format(name=name), 'exec'), namespace)
+    self._convertRow=namespace['convertRow']
+
+  def convertRow(self, flightState, queryTime, timestamps=None):
+    '''
+    :param flightState (StateVector): the state to convert.
+    :param queryTime: time OpenSky was queried.
+    :param timestamps: a dict of formatted timestamps shared by all the states of a snapshot.
+    :return (dict): the record, which is empty if all its fields are None.
+    '''
+    return self._convertRow(flightState, queryTime, {} if timestamps is None else timestamps)
+
+  def convertRows(self, flightStates, queryTime, limit=None, timestamps=None):
+    '''
+    :param flightStates: an iterable of StateVectors.
+    :param queryTime: time OpenSky was queried.
+    :param limit: a limit on the number of records to return.
+    :param timestamps: a dict of formatted timestamps to share with other calls for the same snapshot.
+    :return (list): the records that have at least one field.
+    '''
+    convertRow=self._convertRow
+    timestamps={} if timestamps is None else timestamps
+    records=[]
+    for flightState in flightStates:
+      record=convertRow(flightState, queryTime, timestamps)
+      if len(record)>0:
+        records.append(record)
+        if limit is not None and len(records)>=limit: break
+    return records
@@ -0,0 +1,179 @@
+# In-memory tracks of the aircraft seen by the OpenSky scavenger. Every aircraft (keyed by icao24) gets a ring buffer of
+# its latest positions that is a single fixed-size array of doubles, so the memory used per aircraft is bounded by the
+# capacity and does not grow with the number of snapshots:
+#   tracks=TrackStore(capacity=120, evictAfter=600)
+#   tracks.addStates(api.get_states())
+#   tracks.last('abc123', 10)
+#   tracks.window('abc123', start, end)
+# Aircraft that have not been seen for evictAfter seconds are forgotten.
+import math
+import sys
+import threading
+from array import array
+
+from flight.stream.opensky_api import OpenSkyStateColumns
+
+# The values kept for every position, in this order. Missing values are stored as NaN.
+fieldNames=['time', 'latitude', 'longitude', 'altitude', 'velocity', 'heading']
+_numFields=len(fieldNames)
+_nan=float('nan')
+
+class _Track(object):
+  '''
+  A ring buffer of the latest positions of one aircraft, oldest first.
+  '''
+  __slots__=('values', 'capacity', 'start', 'count', 'lastSeen')
+
+  def __init__(self, capacity):
+    self.values=array('d', bytes(8*_numFields*capacity))
+    self.capacity=capacity
+    self.start=0
+    self.count=0
+    self.lastSeen=None
+
+  def _time(self, index):
+    return self.values[((self.start+index)%self.capacity)*_numFields]
+
+  def append(self, position):
+    '''
+    :param position: a tuple of the values of fieldNames; the time must not be None.
+    :return (bool): False if the position is not newer than the latest one (OpenSky repeats the last position report
+             until a new one is received.)
+    '''
+    if self.count>0 and position[0]<=self._time(self.count-1): return False
+    if self.count<self.capacity:
+      slot=(self.start+self.count)%self.capacity
+      self.count+=1
+    else:
+      slot=self.start
+      self.start=(self.start+1)%self.capacity
+    offset=slot*_numFields
+    for index, value in enumerate(position):
+      self.values[offset+index]=_nan if value is None else value
+    return True
+
+  def get(self, index):
+    offset=((self.start+index)%self.capacity)*_numFields
+    return tuple(None if math.isnan(value) else value for value in self.values[offset:offset+_numFields])
+
+  def firstAtOrAfter(self, time):
+    '''
+    :return: the index of the first position at or after time (count if there is none.)
+    '''
+    low, high=0, self.count
+    while low<high:
+      middle=(low+high)//2
+      if self._time(middle)<time: low=middle+1
+      else: high=middle
+    return low
+
+class TrackStore(object):
+  '''
+  Keeps the last capacity positions of every aircraft seen in OpenSky snapshots. Safe to query from other threads while
+  snapshots are being added.
+  '''
+  def __init__(self, capacity=120, evictAfter=600.0):
+    '''
+    :param capacity: the number of positions kept per aircraft.
+    :param evictAfter: forget aircraft that have not been seen for this many seconds.
+    '''
+    self.capacity=capacity
+    self.evictAfter=evictAfter
+    self._tracks={}
+    self._lock=threading.Lock()
+    self.numPositions=0
+    self.numRepeated=0
+    self.numEvicted=0
+
+  def __len__(self):
+    return len(self._tracks)
+
+  def _add(self, icao24, position, seen):
+    if icao24 is None or position[0] is None: return
+    if seen is None: seen=position[0]
+    track=self._tracks.get(icao24)
+    if track is None:
+      track=self._tracks[icao24]=_Track(self.capacity)
+    track.lastSeen=seen if track.lastSeen is None else max(seen, track.lastSeen)
+    if track.append(position): self.numPositions+=1
+    else: self.numRepeated+=1
+
+  def addStates(self, flightStates, now=None):
+    '''
+    Add the position of every aircraft of a snapshot. States without a time_position are not added.
+    :param flightStates: an OpenSkyStates, OpenSkyStateColumns or list of StateVectors.
+    :param now: the time of the snapshot; defaults to its time.
+    '''
+    if now is None: now=getattr(flightStates, 'time', None)
+    if isinstance(flightStates, OpenSkyStateColumns):
+      columns=[flightStates.column(key) for key in
+               ['icao24', 'time_position', 'latitude', 'longitude', 'geo_altitude', 'velocity', 'heading', 'last_contact']]
+      with self._lock:
+        for values in zip(*columns):
+          self._add(values[0], values[1:7], now if now is not None else values[7])
+    else:
+      states=flightStates if type(flightStates)==list else flightStates.states
+      with self._lock:
+        for state in states:
+          self._add(state.icao24, (state.time_position, state.latitude, state.longitude, state.geo_altitude,
+                                   state.velocity, state.heading), now if now is not None else state.last_contact)
+    if now is not None: self.evict(now)
+
+  def addRecords(self, records, now):
+    '''
+    Add the positions of flight records (dicts as produced by openSkyParser.)
+    :param now: the time of the snapshot the records came from.
+    '''
+    with self._lock:
+      for record in records:
+        self._add(record.get('icao24'), tuple(record.get(name) for name in fieldNames), now)
+    self.evict(now)
+
+  def last(self, icao24, k=1):
+    '''
+    :return (list): up to the last k positions of the aircraft, oldest first, as tuples of the values of fieldNames.
+    '''
+    with self._lock:
+      track=self._tracks.get(icao24)
+      if track is None: return []
+      return [track.get(index) for index in range(max(0, track.count-k), track.count)]
+
+  def window(self, icao24, start, end):
+    '''
+    :return (list): the positions of the aircraft with start <= time < end, oldest first.
+    '''
+    with self._lock:
+      track=self._tracks.get(icao24)
+      if track is None: return []
+      return [track.get(index) for index in range(track.firstAtOrAfter(start), track.firstAtOrAfter(end))]
+
+  def evict(self, now):
+    '''
+    Forget aircraft that were last seen more than evictAfter seconds before now.
+    :return: the number of aircraft forgotten.
+    '''
+    with self._lock:
+      expired=[icao24 for icao24, track in self._tracks.items() if now-track.lastSeen>self.evictAfter]
+      for icao24 in expired:
+        del self._tracks[icao24]
+      self.numEvicted+=len(expired)
+    return len(expired)
+
+  def bytesPerAircraft(self):
+    '''
+    :return: the memory used by the track of one aircraft (its ring buffer, the buffer's header and the key.)
+    '''
+    track=_Track(self.capacity)
+    return sys.getsizeof(track)+sys.getsizeof(track.values)+sys.getsizeof('abc123')
+
+  def memoryUsage(self):
+    '''
+    :return: the memory used by the store in bytes; at most bytesPerAircraft() for each aircraft plus the table.
+    '''
+    with self._lock:
+      return sys.getsizeof(self._tracks)+sum(sys.getsizeof(icao24)+sys.getsizeof(track)+sys.getsizeof(track.values)
+                                             for icao24, track in self._tracks.items())
+
+  def getStats(self):
+    return {'aircraft':len(self._tracks), 'positions':self.numPositions, 'repeated':self.numRepeated,
+            'evicted':self.numEvicted, 'bytes':self.memoryUsage()}
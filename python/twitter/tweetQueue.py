@@ -0,0 +1,219 @@
+# Decouples receiving a stream from processing it: the thread receiving the stream only puts payloads in a bounded queue
+# and a pool of workers takes them out and processes them, so slow uploads or errors never hold up the connection.
+# When the queue is full, the overflow policy decides what happens to the next payload:
+#   block      -- wait for room in the queue (the stream is read no faster than it is processed.)
+#   dropOldest -- discard the payload that has waited longest to make room.
+#   spill      -- append the payload to a local file, which the workers go back to once the queue is empty. The offset
+#                 of the next payload to take out is kept next to it (spillPath+'.offset') so that a restarted queue
+#                 resumes where the previous one stopped.
+#     tweetQueue=TweetQueue(listener.parseData, workers=4, capacity=1000, overflow='spill', spillPath='/tmp/tweets.spill')
+#     tweetQueue.put(data)
+#     ...
+#     tweetQueue.close()
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+_logger=logging.getLogger(__name__)
+
+overflowPolicies=['block', 'dropOldest', 'spill']
+
+class TweetQueue(object):
+  '''
+  A bounded queue of payloads processed by a pool of worker threads.
+  '''
+  def __init__(self, handler, workers=2, capacity=1000, overflow='block', spillPath=None):
+    '''
+    :param handler: called with every payload on one of the workers; what it returns is ignored.
+    :param workers: the number of payloads processed at the same time.
+    :param capacity: the number of payloads held in memory.
+    :param overflow: one of block, dropOldest or spill (see above.)
+    :param spillPath: the local file payloads spill to; required for spill.
+    '''
+    if overflow not in overflowPolicies:
+      raise ValueError('Unknown overflow policy "{overflow}", use one of {policies}.'.format(
+        overflow=overflow, policies=', '.join(overflowPolicies)))
+    if overflow=='spill' and spillPath is None: raise ValueError('A spill path is required to spill to disk.')
+    self._handler=handler
+    self._capacity=capacity
+    self._overflow=overflow
+    self._spillPath=spillPath
+    self._offsetPath=None if spillPath is None else spillPath+'.offset'
+    # (time received, payload), oldest first.
+    self._payloads=collections.deque()
+    self._condition=threading.Condition()
+    self._spillOffset=0
+    self._numSpillPending=0
+    self._active=0
+    self._closed=False
+    self.numReceived=0
+    self.numProcessed=0
+    self.numFailed=0
+    self.numDropped=0
+    self.numSpilled=0
+    self.lagSeconds=0.0
+    if spillPath is not None and os.path.exists(spillPath): self._recoverSpill()
+    self._workers=[threading.Thread(target=self._work, name='TweetQueue-{index:d}'.format(index=index), daemon=True)
+                   for index in range(workers)]
+    for worker in self._workers:
+      worker.start()
+
+  def _recoverSpill(self):
+    '''
+    Count the payloads a previous run spilled but did not get to, so that they are processed first.
+    '''
+    if os.path.exists(self._offsetPath):
+      try:
+        with open(self._offsetPath) as offsetFile:
+          self._spillOffset=min(int(offsetFile.read()), os.path.getsize(self._spillPath))
+      except:
+        _logger.error('Cannot read the spill offset from '+self._offsetPath+', starting from the beginning.',
+                      exc_info=True)
+    with open(self._spillPath, 'rb') as spillFile:
+      spillFile.seek(self._spillOffset)
+      self._numSpillPending=sum(1 for line in spillFile if len(line.strip())>0)
+    if self._numSpillPending>0:
+      _logger.info('Found {num:d} spilled payloads in {path}.'.format(num=self._numSpillPending, path=self._spillPath))
+
+  def _spill(self, received, payload):
+    if type(payload)==bytes: payload=payload.decode('utf-8')
+    with open(self._spillPath, 'a') as spillFile:
+      spillFile.write(json.dumps({'received':received, 'payload':payload})+'\n')
+    self._numSpillPending+=1
+    self.numSpilled+=1
+
+  def _saveSpillOffset(self):
+    '''
+    Replaced atomically so that an interrupted write never loses the offset.
+    '''
+    temporaryPath=self._offsetPath+'.tmp'
+    with open(temporaryPath, 'w') as offsetFile:
+      offsetFile.write(str(self._spillOffset))
+    os.replace(temporaryPath, self._offsetPath)
+
+  def _unspill(self):
+    '''
+    :return: (None, the oldest line in the spill file), decoded by the worker (see _decodeSpilled); called with the
+             condition held.
+    '''
+    while True:
+      with open(self._spillPath, 'rb') as spillFile:
+        spillFile.seek(self._spillOffset)
+        line=spillFile.readline()
+        self._spillOffset=spillFile.tell()
+      if len(line.strip())>0 or len(line)==0: break
+    self._numSpillPending-=1
+    if self._numSpillPending==0:
+      # Everything spilled has been taken out; start the file over.
+      os.remove(self._spillPath)
+      if os.path.exists(self._offsetPath): os.remove(self._offsetPath)
+      self._spillOffset=0
+    else:
+      try:
+        self._saveSpillOffset()
+      except:
+        _logger.error('Cannot save the spill offset to '+self._offsetPath, exc_info=True)
+    return (None, line)
+
+  @staticmethod
+  def _decodeSpilled(line):
+    '''
+    :return: (time received, payload) of a line of the spill file.
+    '''
+    spilled=json.loads(line)
+    return (spilled['received'], spilled['payload'])
+
+  def put(self, payload):
+    '''
+    Queue a payload, applying the overflow policy if the queue is full. Only blocks with the block policy.
+    '''
+    received=time.time()
+    with self._condition:
+      if self._closed: raise RuntimeError('Cannot put a payload in a closed TweetQueue.')
+      self.numReceived+=1
+      if self._overflow=='spill' and (self._numSpillPending>0 or len(self._payloads)>=self._capacity):
+        # Once spilling, keep spilling until the file is drained so that payloads stay in order.
+        self._spill(received, payload)
+      else:
+        while len(self._payloads)>=self._capacity:
+          if self._overflow=='dropOldest':
+            self._payloads.popleft()
+            self.numDropped+=1
+          else:
+            self._condition.wait()
+        self._payloads.append((received, payload))
+      self._condition.notify_all()
+
+  def _take(self):
+    '''
+    :return: the next (time received, payload), or None once the queue is closed and empty; called with the condition
+             held.
+    '''
+    while True:
+      if len(self._payloads)>0:
+        taken=self._payloads.popleft()
+        # Room for a blocked put.
+        self._condition.notify_all()
+        return taken
+      if self._numSpillPending>0: return self._unspill()
+      if self._closed: return None
+      self._condition.wait()
+
+  def _work(self):
+    while True:
+      with self._condition:
+        taken=self._take()
+        if taken is None: return
+        self._active+=1
+      received, payload=taken
+      try:
+        # Spilled payloads are decoded here so that a corrupt line is counted as failed and the worker keeps going.
+        if received is None: received, payload=self._decodeSpilled(payload)
+        self._handler(payload)
+        failed=False
+      except:
+        failed=True
+        _logger.error('Error processing payload.', exc_info=True)
+      with self._condition:
+        self._active-=1
+        if received is not None: self.lagSeconds=time.time()-received
+        if failed:
+          self.numFailed+=1
+        else:
+          self.numProcessed+=1
+        self._condition.notify_all()
+
+  def join(self):
+    '''
+    Wait until every payload put so far has been processed.
+    '''
+    with self._condition:
+      while len(self._payloads)>0 or self._numSpillPending>0 or self._active>0:
+        self._condition.wait()
+
+  def close(self):
+    '''
+    Process every payload put so far and stop the workers.
+    '''
+    with self._condition:
+      if self._closed: return
+      self._closed=True
+      self._condition.notify_all()
+    for worker in self._workers:
+      worker.join()
+
+  def getStats(self):
+    '''
+    :return (dict): depth (payloads in memory), spilled (payloads waiting on disk), the seconds the oldest payload has
+             waited (lag) and between receiving and processing the last payload (lastLag), and the number of payloads
+             received, processed, failed, dropped and spilled in all.
+    '''
+    with self._condition:
+      oldest=self._payloads[0][0] if len(self._payloads)>0 else None
+      return {'depth':len(self._payloads), 'spilled':self._numSpillPending,
+              'lag':time.time()-oldest if oldest is not None else 0.0, 'lastLag':self.lagSeconds,
+              'received':self.numReceived, 'processed':self.numProcessed, 'failed':self.numFailed,
+              'dropped':self.numDropped, 'totalSpilled':self.numSpilled}
@@ -22,13 +22,16 @@ import datetime
 import json
 import logging
 import re
+import threading
 import time
 
 import tweepy
-from google.cloud import storage
-from google.cloud.exceptions import Forbidden
 from google.cloud.pubsub_v1 import PublisherClient
 
+from common.bufferedWriter import BufferedWriter
+from twitter.tweetQueue import TweetQueue
+from twitter.userCache import UserCache
+
 logging.basicConfig(
   format='%(asctime)s.%(msecs)03dZ,%(pathname)s:%(lineno)d,%(levelname)s,%(module)s,%(funcName)s: %(message)s',
   datefmt="%Y-%m-%d %H:%M:%S")
@@ -88,6 +91,31 @@ def _getMessageJSON(request):
     messageJSON=message
   return messageJSON
 
+class _Confirmation(object):
+  '''
+  Calls onConfirmed once each of a number of outputs reported that it succeeded, and never if any of them failed.
+  '''
+  def __init__(self, numOutputs, onConfirmed):
+    self._lock=threading.Lock()
+    self._remaining=numOutputs
+    self._failed=False
+    self._onConfirmed=onConfirmed
+    if numOutputs==0: onConfirmed()
+  
+  def done(self, succeeded):
+    with self._lock:
+      self._failed=self._failed or not succeeded
+      self._remaining-=1
+      confirmed=self._remaining==0 and not self._failed
+    if confirmed: self._onConfirmed()
+  
+  def published(self, future):
+    try:
+      succeeded=future.exception() is None
+    except:
+      succeeded=False
+    self.done(succeeded)
+
 class MyListener(tweepy.StreamingClient):
   """Custom StreamListener for streaming data."""
   
@@ -186,62 +214,160 @@ class MyListener(tweepy.StreamingClient):
     return cleaned
   
   @classmethod
-  def extractTweet(cls, tweet, query, delim=None):
+  def _compilePlan(cls):
     '''
-    Will process a single tweet and produce one or more records of tweet data. A single tweet may reference a tweet that it is retweeting, in which case this method returns both as tweet data records.
-    :param tweet: the JSON from twitter representing one tweet.
-    :param query: query that the tweet is a search result for.
-    :return: returns one or more records of tweet data.
+    Build the extraction plan of this class from its configuration: a dict from the name of a field of a tweet to the
+    function that copies it into a tweet row. Built once per class (see _getPlan) instead of testing every field of
+    every tweet against each list of fields.
+    :return: a dict of field name to handler(tweetRow, field, value).
     '''
-    if type(tweet)==bytes: return cls.extractTweet(json.loads(tweet.decode('utf-8')),query,delim=delim)
-    if 'tweet' in tweet: return cls.extractTweet(tweet['tweet'], query,delim=delim)
-    if 'data' in tweet: return cls.extractTweet(tweet['data'],query,delim=delim)
-    tweetRows=[]
+    def copyValue(tweetRow, field, value):
+      tweetRow[field]=value
+    
+    def singleReference(tweetRow, field, value):
+      # These nested elements only contain one object.
+      referencedEntities=cls.extractReference(field, value)
+      if len(referencedEntities)>0: tweetRow[field]=referencedEntities[0]
+    
+    def multipleReferences(tweetRow, field, value):
+      # Capture potentially multiple references.
+      referencedEntities=cls.extractReference(field, value)
+      if len(referencedEntities)>0: tweetRow[field]=referencedEntities
+    
+    def flattenObject(tweetRow, field, value):
+      # Flatten the field that has an object value.
+      itemsFromObject=cls.extractFromObject(field, value)
+      if len(itemsFromObject)>0: tweetRow.update(itemsFromObject)
+    
+    def exactLocation(tweetRow, field, value):
+      # Pull out the components of the coordinates and store as separate fields.
+      if 'coordinates' in value:
+        coordinates=cls.extractExactLocation(field, value[
+          'coordinates'])  # All coordinate fields have a property named "coordinates".
+        if coordinates: tweetRow.update(coordinates)
+    
+    def unnestEntities(tweetRow, field, value):
+      # Unnest the entities object.
+      for entityType, entity in value.items():
+        # Capture each referenced entity.
+        referencedEntities=cls.extractReference(entityType, entity)
+        if len(referencedEntities)>0: tweetRow[entityType]=referencedEntities
+    
+    # Added from the lowest to the highest precedence, so that a field in several lists gets the first handler that
+    # applies to it.
+    plan={'entities':unnestEntities}
+    plan.update((field, exactLocation) for field in cls._coordinateFields)
+    plan.update((field, flattenObject) for field in cls._objectFields)
+    plan.update((field, multipleReferences) for field in cls._tweetReferences)
+    plan.update((field, singleReference) for field in ['user', 'retweeted_status'])
+    plan.update((field, copyValue) for field in cls._tweetFields)
+    return plan
+  
+  @classmethod
+  def _getPlan(cls):
+    if '_plan' not in cls.__dict__: cls._plan=cls._compilePlan()
+    return cls._plan
+  
+  @classmethod
+  def _addUser(cls, userData, userRows, userCache):
+    '''
+    Add a user row for userData unless userCache has output the user with the same profile. With a userCache, a user
+    found more than once in the same tweet gets one row.
+    '''
+    if userCache is None:
+      userRows.append(cls._extractUser(userData))
+    elif userCache.changed(userData):
+      userRow=cls._extractUser(userData)
+      if userRow not in userRows: userRows.append(userRow)
+  
+  @classmethod
+  def _collectUsers(cls, value, userRows, userCache=None):
+    '''
+    Add a user row for every "user" object within value (see extractUsers.)
+    '''
+    if type(value)==dict:
+      for field, nested in value.items():
+        if nested is not None:
+          if field=='user':
+            cls._addUser(nested, userRows, userCache)
+          elif type(nested) in [dict, list]:
+            cls._collectUsers(nested, userRows, userCache)
+    elif type(value)==list:
+      for element in value:
+        cls._collectUsers(element, userRows, userCache)
+  
+  @classmethod
+  def _extract(cls, tweet, query, delim, raw, tweetRows, userRows, userCache=None):
+    '''
+    Add the tweet rows of tweet (and of any tweet it retweets) to tweetRows and the user rows within it to userRows in
+    one pass over its fields.
+    :param raw: the JSON text of tweet as received, or None to serialize tweet again.
+    :param userCache (UserCache): only add rows for users that are new or changed (optional).
+    '''
+    plan=cls._getPlan()
     tweetRow={}
     for field, value in tweet.items():
       if value is not None:
-        if field in cls._tweetFields:
-          tweetRow[field]=value
-        elif field in ['user', 'retweeted_status']:
-          # These nested elements only contain one object.
-          referencedEntities=cls.extractReference(field, value)
-          if len(referencedEntities)>0: tweetRow[field]=referencedEntities[0]
-        elif field in cls._tweetReferences:
-          # Capture potentially multiple references.
-          referencedEntities=cls.extractReference(field, value)
-          if len(referencedEntities)>0: tweetRow[field]=referencedEntities
-        elif field in cls._objectFields.keys():
-          # Flatten the field that has an object value.
-          itemsFromObject=cls.extractFromObject(field, value)
-          if len(itemsFromObject)>0: tweetRow.update(itemsFromObject)
-        elif field in cls._coordinateFields.keys():
-          # Pull out the components of the coordinates and store as separate fields.
-          if 'coordinates' in value:
-            coordinates=cls.extractExactLocation(field, value[
-              'coordinates'])  # All coordinate fields have a property named "coordinates".
-            if len(coordinates)>0: tweetRow.update(coordinates)
-        elif field=='entities':
-          # Unnest the entities object.
-          for entityType, entity in value.items():
-            # Capture each referenced entity.
-            referencedEntities=cls.extractReference(entityType, entity)
-            if len(referencedEntities)>0: tweetRow[entityType]=referencedEntities
+        handler=plan.get(field)
+        if handler is not None: handler(tweetRow, field, value)
         
         if field=='retweeted_status':
           try:
-            nestedTweets=cls.extractTweet(tweet['retweeted_status'], query, delim=delim)
-            tweetRows.extend(nestedTweets)
+            cls._extract(value, query, delim, None, tweetRows, userRows, userCache)
           except:
-            _logger.error('SKIPPING Cannot parse nested tweet '+str(tweet['retweeted_status']), exc_info=True,
-                          stack_info=True)
+            _logger.error('SKIPPING Cannot parse nested tweet '+str(value), exc_info=True, stack_info=True)
+        elif field=='user':
+          cls._addUser(value, userRows, userCache)
+        elif type(value) in [dict, list]:
+          cls._collectUsers(value, userRows, userCache)
     tweetRow['query']=query
     if delim is None:
       # Convert empty fields for the multivalue fields into empty arrays for BigQuery since REPEATED type fields cannot be null.
       for multivalueField in MyListener._multivalueTweetFields:
         if multivalueField not in tweetRow or tweetRow[multivalueField] is None: tweetRow[multivalueField]=[]
-    tweetRow['raw']=json.dumps(tweet)
+    tweetRow['raw']=json.dumps(tweet) if raw is None else raw
     tweetRows.append(cls._cleanTweet(tweetRow, delim=delim))
-    return tweetRows
+  
+  @classmethod
+  def extract(cls, tweet, query, delim=None, userCache=None):
+    '''
+    Extract the tweet rows (see extractTweet) and the user rows (see extractUsers) of a tweet in a single pass.
+    :param tweet: the JSON from twitter representing one tweet, either as received (bytes or str) or parsed.
+    :param query: query that the tweet is a search result for.
+    :param delim: a delimiter to join multivalue fields with instead of outputting arrays.
+    :param userCache (UserCache): only output rows for users that are new or whose profile changed (optional); call
+           userCache.remember with the user rows once they have been output.
+    :return: (tweet rows, user rows)
+    '''
+    raw=None
+    if type(tweet)==bytes: tweet=tweet.decode('utf-8')
+    if type(tweet)==str:
+      # Keep the text as received for the "raw" field instead of serializing the tweet again.
+      raw=tweet
+      tweet=json.loads(tweet)
+    tweetRows=[]
+    userRows=[]
+    envelope=None
+    while 'tweet' in tweet or 'data' in tweet:
+      envelope=tweet
+      tweet=tweet['tweet'] if 'tweet' in tweet else tweet['data']
+      raw=None
+    if envelope is not None:
+      # Users can also be found in the rest of the envelope.
+      cls._collectUsers(dict((field, value) for field, value in envelope.items() if field not in ['tweet', 'data']),
+                        userRows, userCache)
+    cls._extract(tweet, query, delim, raw, tweetRows, userRows, userCache)
+    return (tweetRows, userRows)
+  
+  @classmethod
+  def extractTweet(cls, tweet, query, delim=None):
+    '''
+    Will process a single tweet and produce one or more records of tweet data. A single tweet may reference a tweet that it is retweeting, in which case this method returns both as tweet data records.
+    :param tweet: the JSON from twitter representing one tweet.
+    :param query: query that the tweet is a search result for.
+    :return: returns one or more records of tweet data.
+    '''
+    return cls.extract(tweet, query, delim=delim)[0]
   
   @classmethod
   def _extractUser(cls, userData):
@@ -257,7 +383,7 @@ class MyListener(tweepy.StreamingClient):
   def extractUsers(cls, tweet):
     userRows=[]
     if type(tweet)==dict:
-      if 'tweet' in tweet: return cls.extractUser(tweet['tweet'])
+      if 'tweet' in tweet: return cls.extractUsers(tweet['tweet'])
       for field, value in tweet.items():
         if value is not None:
           if field=='user':
@@ -270,7 +396,8 @@ class MyListener(tweepy.StreamingClient):
     return userRows
   
   def __init__(self, bearer_token, projectId, query, limit, topic=None, userTopic=None, bucket=None, userBucket=None,
-               pathInBucket=None, delim=None, debug=None):
+               pathInBucket=None, delim=None, debug=None, rollBytes=8*1024*1024, rollSeconds=60.0, uploadThreads=2,
+               workers=2, queueSize=1000, overflow='block', spillPath=None, userCacheSize=100000):
     '''
     :param bearer_token:
     :param projectId:
@@ -283,6 +410,15 @@ class MyListener(tweepy.StreamingClient):
     :param pathInBucket:
     :param delim:
     :param debug:
+    :param rollBytes: write the tweets (or users) buffered for a bucket as one object once there are this many bytes.
+    :param rollSeconds: write the tweets (or users) buffered for a bucket once the oldest is this many seconds old.
+    :param uploadThreads: the number of objects uploaded to each bucket at the same time.
+    :param workers: the number of tweets processed at the same time (see TweetQueue.)
+    :param queueSize: the number of tweets received but not yet processed to hold in memory.
+    :param overflow: what to do with a tweet received when the queue is full: block, dropOldest or spill.
+    :param spillPath: the local file to spill tweets to.
+    :param userCacheSize: the number of users whose profile is remembered so that a user row is only output when the
+           user is new or changed (see UserCache); 0 outputs a row for every user of every tweet.
     '''
     super().__init__(bearer_token,wait_on_rate_limit=True,return_type=dict)
     if debug is not None: _logger.setLevel(min(debug, _logger.level))
@@ -308,46 +444,68 @@ class MyListener(tweepy.StreamingClient):
     self._userPublisher=None
     
     self._path=pathInBucket
-    self._bucketClient=None
-    self._userBucketClient=None
     self._bucket=bucket
+    self._userBucket=userBucket
+    # Tweets and users are buffered and written in batches (see BufferedWriter.)
+    self._writer=None
+    self._userWriter=None
     if bucket is not None:
       _logger.debug('Output to bucket: '+self._bucket)
-    self._userBucket=userBucket
+      self._writer=BufferedWriter(bucket, self._createObjectKey, rollBytes=rollBytes, rollSeconds=rollSeconds,
+                                  uploadThreads=uploadThreads)
     if userBucket is not None:
       _logger.debug('Output user data to bucket: '+self._userBucket)
+      self._userWriter=BufferedWriter(userBucket, self._createObjectKey, rollBytes=rollBytes, rollSeconds=rollSeconds,
+                                      uploadThreads=uploadThreads)
     
     self._delim=delim
+    # Running totals of what parseData output for the tweets received (see getTotals.)
+    self._totalsLock=threading.Lock()
+    self.numTweets=0
+    self.numTweetsStored=0
+    self.numUsersStored=0
+    self.numTweetsPublished=0
+    self.numUsersPublished=0
+    self._limitLock=threading.Lock()
+    self._userCache=UserCache(self._userFields, capacity=userCacheSize) if userCacheSize>0 else None
+    # on_tweet only queues what it receives; workers run parseData.
+    self._queue=TweetQueue(self._processTweet, workers=workers, capacity=queueSize, overflow=overflow,
+                           spillPath=spillPath)
+  
+  def getTotals(self):
+    '''
+    :return (dict): the number of tweets processed and of tweet and user rows stored and published for them.
+    '''
+    with self._totalsLock:
+      return {'tweets':self.numTweets, 'tweetsStored':self.numTweetsStored, 'usersStored':self.numUsersStored,
+              'tweetsPublished':self.numTweetsPublished, 'usersPublished':self.numUsersPublished}
   
-  def _writeToBucket(self, bucketClient, bucket, records):
-    key=self._createObjectKey()
-    try:
-      if bucketClient is None: bucketClient=storage.Client().bucket(bucket)
-      for record in records:
-        recordKey=key+(('_'+str(record['id'])) if 'id' in record else '')
-        bucketClient.blob(recordKey).upload_from_string(json.dumps(record))
-        _logger.debug('Wrote to '+recordKey)
-    except Forbidden as fe:
-      try:
-        _logger.error(
-          'Failed to write to GCS bucket {bucket} because access to object {objectName} is forbidden. Error code={code}, response content={response}'.format(
-            bucket=self._bucket,
-            objectName=key,
-            code=str(fe.code),
-            response=fe.response.content
-          ), exc_info=True, stack_info=True)
-      except:
-        _logger.error(
-          'Failed to write to GCS bucket {bucket} because access to object {objectName} is forbidden.'.format(
-            bucket=self._bucket,
-            objectName=key
-          ), exc_info=True, stack_info=True)
-    except:
-      _logger.error('Failed to write to GCS bucket {bucket}, object {objectName}.'.format(
-        bucket=self._bucket,
-        objectName=key
-      ), exc_info=True, stack_info=True)
-    return bucketClient
+  def getWriterStats(self):
+    '''
+    :return (dict): the statistics of the writers of tweets and users (see BufferedWriter.getStats.)
+    '''
+    return {'tweets':None if self._writer is None else self._writer.getStats(),
+            'users':None if self._userWriter is None else self._userWriter.getStats()}
+  
+  def getUserCacheStats(self):
+    '''
+    :return (dict): the size, hit rate and number of user rows suppressed of the user cache (see UserCache.getStats.)
+    '''
+    return None if self._userCache is None else self._userCache.getStats()
+  
+  def getQueueStats(self):
+    '''
+    :return (dict): the depth, lag and counts of the queue of tweets received (see TweetQueue.getStats.)
+    '''
+    return self._queue.getStats()
+  
+  def close(self):
+    '''
+    Process the tweets still queued, write the tweets and users still buffered and wait until they are written.
+    '''
+    self._queue.close()
+    for writer in [self._writer, self._userWriter]:
+      if writer is not None: writer.close()
   
   def _createObjectKey(self):
     key=''
@@ -358,7 +516,7 @@ class MyListener(tweepy.StreamingClient):
     key+='_'+str(datetime.datetime.now())+'.json'
     return ('' if self._path is None else self._path+'/')+re.sub(r'[^A-Za-z0-9_.-]', '_', key)
   
-  # tweets -- a dict representing a tweet (parsed with a JSON parser)
+  # tweets -- a dict representing a tweet (parsed with a JSON parser) or the JSON text of the tweet as received
   def parseData(self, tweets):
     numTweetsStored=0
     numTweetsPublished=0
@@ -366,15 +524,18 @@ class MyListener(tweepy.StreamingClient):
     numUsersPublished=0
     withinLimit=True
     try:
-      tweetRecords=self.extractTweet(tweets, self.query, delim=self._delim)
-      userRecords=self.extractUsers(tweets)
+      tweetRecords, userRecords=self.extract(tweets, self.query, delim=self._delim, userCache=self._userCache)
+      
+      # Users are only remembered (so suppressed next time) once every output confirmed their rows (see UserCache.)
+      confirmation=None
+      if self._userCache is not None and len(userRecords)>0:
+        numOutputs=(0 if self._userWriter is None else 1)+(0 if self._userTopic is None else len(userRecords))
+        confirmation=_Confirmation(numOutputs, lambda: self._userCache.remember(userRecords))
       
-      if self._bucket is not None:
-        self._bucketClient=self._writeToBucket(self._bucketClient, self._bucket, tweetRecords)
-        numTweetsStored+=len(tweetRecords)
-      if self._userBucket is not None:
-        self._userBucketClient=self._writeToBucket(self._userBucketClient, self._userBucket, userRecords)
-        numUsersStored+=len(userRecords)
+      if self._writer is not None: numTweetsStored+=self._writer.write(tweetRecords)
+      if self._userWriter is not None:
+        numUsersStored+=self._userWriter.write(userRecords,
+                                               onWritten=None if confirmation is None else confirmation.done)
       
       if self._topic is not None:
         if self._publisher is None: self._publisher=PublisherClient()
@@ -392,29 +553,39 @@ class MyListener(tweepy.StreamingClient):
         if self._userPublisher is None: self._userPublisher=PublisherClient()
         for record in userRecords:
           try:
-            self._userPublisher.publish(self._userTopic, data=json.dumps(record).encode("utf-8"), **record)
+            future=self._userPublisher.publish(self._userTopic, data=json.dumps(record).encode("utf-8"), **record)
           except:
-            self._userPublisher.publish(self._userTopic, data=json.dumps(record).encode("utf-8"))
+            future=self._userPublisher.publish(self._userTopic, data=json.dumps(record).encode("utf-8"))
+          if confirmation is not None: future.add_done_callback(confirmation.published)
           numUsersPublished+=1
       
-      self.limit-=1
-      if self.limit<=0: withinLimit=False
+      with self._limitLock:
+        self.limit-=1
+        if self.limit<=0: withinLimit=False
     except:
       _logger.error('Error in on_data. Sleeping for 5 seconds.', exc_info=True, stack_info=True)
       time.sleep(5)
-    return (withinLimit, numTweetsStored, numUsersStored, numTweetsPublished, numUsersPublished)
+    return (withinLimit, numTweetsStored, numUsersStored, numTweetsPublished, numUsersPublished, self.getWriterStats())
+  
+  def _processTweet(self, data):
+    '''
+    Run parseData on a tweet taken from the queue, disconnecting once the limit is reached.
+    '''
+    withinLimit, numTweetsStored, numUsersStored, numTweetsPublished, numUsersPublished, writerStats=self.parseData(data)
+    with self._totalsLock:
+      self.numTweets+=1
+      self.numTweetsStored+=numTweetsStored
+      self.numUsersStored+=numUsersStored
+      self.numTweetsPublished+=numTweetsPublished
+      self.numUsersPublished+=numUsersPublished
+    if not withinLimit: self.disconnect()
   
   def on_tweet(self, data):
     print('on_data Found tweet')
     _logger.debug('Found tweet for '+str(self.query))
-    withinLimit=True
-    try:
-      tweets=json.loads(data) if type(data)==str else data
-      withinLimit, numTweetsStored, numUsersStored, numTweetsPublished, numUsersPublished=self.parseData(tweets)
-    except:
-      _logger.error('Error in on_data. Sleeping for 5 seconds.', exc_info=True, stack_info=True)
-      time.sleep(5)
-    return withinLimit
+    # Parsed by extract, which keeps the text as received.
+    self._queue.put(data)
+    return True
   
   def on_error(self, status):
     if status==420:
@@ -504,29 +675,27 @@ def parseTweets(request):
       'Cannot read required keys from twitterKeys.json. This file must exist and have the format {"consumer_key":"...","consumer_secret":"...","access_token":"...","access_secret":"..."}.')
     return 'Cannot read required keys from twitterKeys.json'
   twitterQuery=' OR '.join(map(lambda term:'"'+term+'"',query))
-  listener=MyListener(keys['bearer_token'],projectId,twitterQuery,limit,topic=topic,userTopic=userTopic,bucket=bucket,userBucket=userBucket,pathInBucket=pathInBuckets,delim=None,debug=10)
+  # Tweets received are processed by a pool of workers; when they fall behind, overflow is block, dropOldest or spill.
+  listener=MyListener(keys['bearer_token'],projectId,twitterQuery,limit,topic=topic,userTopic=userTopic,bucket=bucket,userBucket=userBucket,pathInBucket=pathInBuckets,delim=None,debug=10,
+                      workers=messageJSON.get('workers',2),queueSize=messageJSON.get('queueSize',1000),
+                      overflow=messageJSON.get('overflow','block'),spillPath=messageJSON.get('spillPath',None),
+                      userCacheSize=messageJSON.get('userCacheSize',100000))
   response=listener.filter(track=','.join(query),languages='en')
+  # Write what is still buffered.
+  listener.close()
   #stats=list(map(lambda tweet:listener.parseData(tweet._json),tweepy.Cursor(tweepyAPI.search,q=query).items(limit)))
   
   #nextToken=None
   #results=tweepyClient.search_recent_tweets(,next_token=nextToken)
   
   _logger.debug('Querying for {term}'.format(term=','.join(query)))
-  stats=(0,0,0,0,0)
-  totalTweetsStored=0
-  totalUsersStored=0
-  totalTweetsPublished=0
-  totalUsersPublished=0
-  for withinLimit, numTweetsStored, numUsersStored, numTweetsPublished, numUsersPublished in stats:
-    totalTweetsStored+=numTweetsStored
-    totalUsersStored+=numUsersStored
-    totalTweetsPublished+=numTweetsPublished
-    totalUsersPublished+=numUsersPublished
+  totals=listener.getTotals()
   #  twitter_stream = Stream(twitterAuth, MyListener(projectId, query, limit, topic=topic, userTopic=userTopic, bucket=bucket,
   #                                           userBucket=userBucket,pathInBucket=pathInBuckets,delim=delim,debug=debug))
   #  twitter_stream.filter(track=query)
-  statsOutput='tweets stored='+str(totalTweetsStored)+',published='+str(totalTweetsPublished)+' users stored='+str(
-    totalUsersStored)+',published='+str(totalUsersPublished)
+  statsOutput='tweets stored='+str(totals['tweetsStored'])+',published='+str(totals['tweetsPublished'])+' users stored='+str(
+    totals['usersStored'])+',published='+str(totals['usersPublished'])+' writers='+json.dumps(listener.getWriterStats())+\
+              ' queue='+json.dumps(listener.getQueueStats())+' users='+json.dumps(listener.getUserCacheStats())
   _logger.info(statsOutput)
   response=json.dumps(messageJSON)+' completed. '+statsOutput
   return response
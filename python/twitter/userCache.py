@@ -0,0 +1,82 @@
+# Remembers the profile of the users output most recently so that a user row is only output when a user is new or their
+# profile has changed, instead of once for every tweet (and retweet) they appear in. Only a compact hash of the
+# profile fields that are output is kept per user, in least-recently-used order. A profile is only remembered once its
+# row has been output, so a row that failed to be written or published is output again the next time the user is seen.
+# MyListener remembers users once the writer reports their object was uploaded and every publish was confirmed; until
+# then a user seen again is output again:
+#   userCache=UserCache(MyListener._userFields, capacity=100000)
+#   if userCache.changed(userData): ... output a user row ...
+#   ... once the rows were written and published: userCache.remember(userRows)
+import json
+import threading
+from collections import OrderedDict
+from hashlib import blake2b
+
+class UserCache(object):
+  '''
+  A bounded map of user ID to a hash of their profile, with least-recently-used eviction.
+  '''
+  def __init__(self, fields, capacity=100000):
+    '''
+    :param fields: the profile fields compared to decide whether a user has changed.
+    :param capacity: the number of users to remember.
+    '''
+    self._fields=list(fields)
+    self._capacity=capacity
+    self._hashes=OrderedDict()
+    self._lock=threading.Lock()
+    self.numHits=0
+    self.numMisses=0
+    self.numChanged=0
+
+  def _hash(self, userData):
+    profile=json.dumps([userData.get(field) for field in self._fields], default=str)
+    return blake2b(profile.encode('utf-8'), digest_size=8).digest()
+
+  def changed(self, userData):
+    '''
+    :param userData: the user object of a tweet.
+    :return (bool): True if the user is new or their profile changed since it was last remembered, False if the user
+             row can be suppressed. Users without an ID are always output. Call remember once the row has been output.
+    '''
+    userId=userData.get('id', userData.get('id_str'))
+    if userId is None: return True
+    profileHash=self._hash(userData)
+    with self._lock:
+      previous=self._hashes.get(userId)
+      if previous is None:
+        self.numMisses+=1
+        return True
+      self._hashes.move_to_end(userId)
+      if previous==profileHash:
+        self.numHits+=1
+        return False
+      self.numChanged+=1
+      return True
+
+  def remember(self, users):
+    '''
+    Remember the profiles of users whose rows have been output, so that their rows are suppressed until they change.
+    :param users: user objects, or the user rows made from them (which hold the same profile fields.)
+    '''
+    for userData in users:
+      userId=userData.get('id', userData.get('id_str'))
+      if userId is None: continue
+      profileHash=self._hash(userData)
+      with self._lock:
+        self._hashes[userId]=profileHash
+        self._hashes.move_to_end(userId)
+        if len(self._hashes)>self._capacity: self._hashes.popitem(last=False)
+
+  def __len__(self):
+    return len(self._hashes)
+
+  def getStats(self):
+    '''
+    :return (dict): users remembered (size), users unchanged (suppressed), new (misses) and changed, and the hit rate of
+             unchanged users over all users looked up.
+    '''
+    with self._lock:
+      lookups=self.numHits+self.numMisses+self.numChanged
+      return {'size':len(self._hashes), 'suppressed':self.numHits, 'misses':self.numMisses, 'changed':self.numChanged,
+              'hitRate':self.numHits/lookups if lookups>0 else 0.0}
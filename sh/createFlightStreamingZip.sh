@@ -30,10 +30,15 @@ then
   cp ${HOME}/${CODE_HOME}/python/main_${FUNCTION}.py main.py
   mkdir flight
   cp -r ${HOME}/${CODE_HOME}/python/flight/stream flight
+  cp -r ${HOME}/${CODE_HOME}/python/common .
+  mkdir schema
+  cp ${HOME}/${CODE_HOME}/schema/openSky_bigQuery.json schema
   # Create a folder that contains all the files needed for the Cloud Function:
   #   requirements... -- lists the libraries and versions the code depends on.
   #   flightStreamingRunner.py -- the entry point for the Cloud Function to call when triggered.
   #   flight/stream/* -- the code
+  #   common/* -- code shared with the other parsers (i.e. serialization.)
+  #   schema/* -- the BigQuery schema used for the column types of Parquet and Avro output.
   zip -r ../${FUNCTION}.zip .
   #   outputs a zip file in ${CODE_HOME}.
   gsutil cp ../${FUNCTION}.zip gs://${BUCKET}/function/
@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+import unittest
+from api import genericRest
+from api.genericRest import callAPIBatch
+
+class FakeResponse(object):
+  def __init__(self, data):
+    self.text=json.dumps(data)
+    self.content=self.text.encode('utf-8')
+    self.status_code=200
+
+class FakeSession(object):
+  '''
+  Answers every request after a short delay and records the most requests that were in progress for each host.
+  '''
+  def __init__(self):
+    self._lock=threading.Lock()
+    self._active={}
+    self.maxActive={}
+
+  def get(self, url, headers=None, params=None, timeout=None):
+    host=url.split('/')[2]
+    with self._lock:
+      self._active[host]=self._active.get(host, 0)+1
+      self.maxActive[host]=max(self.maxActive.get(host, 0), self._active[host])
+    time.sleep(0.02)
+    with self._lock: self._active[host]-=1
+    if url.endswith('/fail'): raise IOError('Connection refused.')
+    return FakeResponse({'url':url, 'params':params})
+
+  def request(self, method, url, headers=None, params=None, timeout=None):
+    return self.get(url, headers=headers, params=params, timeout=timeout)
+
+class FakeProcessor(object):
+  def __init__(self):
+    self.data=[]
+
+  def process(self, data):
+    self.data.append(data)
+    return (1, 0)
+
+class TestCallAPIBatch(unittest.TestCase):
+  def test_batch(self):
+    session=FakeSession()
+    processor=FakeProcessor()
+    jobs=[('https://a.example.com/{index:d}'.format(index=index), {}, {'page':index}) for index in range(8)]
+    jobs+=[{'url':'https://b.example.com/1'}, ('https://b.example.com/fail',)]
+    stats=callAPIBatch(jobs, None, None, None, None, maxWorkers=8, maxPerHost=2, session=session, processor=processor)
+    self.assertEqual(10, stats['requests'])
+    self.assertEqual(9, len(processor.data))
+    self.assertEqual(2, session.maxActive['a.example.com'])
+    failed=[result for result in stats['endpoints'] if result['error'] is not None]
+    self.assertEqual(['https://b.example.com/fail'], [result['url'] for result in failed])
+    self.assertTrue(all(result['latency']>0 for result in stats['endpoints']))
+    self.assertGreater(stats['rate'], 0)
+
+  def test_rateLimited(self):
+    genericRest._session=FakeSession()
+    genericRest._rateLimiter=None
+    try:
+      jobs=[('https://a.example.com/{index:d}'.format(index=index),) for index in range(3)]
+      callAPIBatch(jobs, None, None, None, None, processor=FakeProcessor(), rateLimit=100.0)
+      limiter=genericRest._getRateLimiter(rate=100.0)
+      self.assertEqual(3, limiter.getStats()['requests'])
+      # Calls with other settings share the limits of every host.
+      self.assertIs(limiter, genericRest._getRateLimiter(rate=1.0, tries=1))
+    finally:
+      genericRest._session=None
+      genericRest._rateLimiter=None
+
+if __name__=='__main__':
+  unittest.main()
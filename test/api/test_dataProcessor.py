@@ -0,0 +1,125 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from api.genericRest import DataProcessor
+from api.seenSet import SeenSet
+
+class SlowBucket(object):
+  def __init__(self, delay):
+    self.delay=delay
+    self.written=[]
+
+  def blob(self, name):
+    bucket=self
+    class Blob(object):
+      def upload_from_string(self, content, content_type=None):
+        time.sleep(bucket.delay)
+        bucket.written.append(name)
+    return Blob()
+
+class SlowPublisher(object):
+  def __init__(self, delay):
+    self.delay=delay
+    self.published=[]
+    self.failData=None
+    self.confirmDelay=None
+
+  def publish(self, topic, data=None, **attributes):
+    '''
+    :return (Future): fails for messages that contain failData; resolved confirmDelay seconds later if set.
+    '''
+    time.sleep(self.delay)
+    published=Future()
+    if self.failData is not None and self.failData in data:
+      published.set_exception(IOError('Cannot publish.'))
+    elif self.confirmDelay is not None:
+      def confirm():
+        self.published.append(data)
+        published.set_result('id')
+      threading.Timer(self.confirmDelay, confirm).start()
+    else:
+      self.published.append(data)
+      published.set_result('id')
+    return published
+
+def _processor(delay, workers=4, queueSize=64, seen=None, bucket='bucket'):
+  processor=DataProcessor(workers=workers, queueSize=queueSize, seen=seen)
+  processor._bucket=bucket
+  processor._bucketClient=SlowBucket(delay)
+  processor._projectId='project'
+  processor._topic='topic'
+  processor._publisher=SlowPublisher(delay)
+  return processor
+
+class TestDataProcessor(unittest.TestCase):
+  def test_parallelOutputs(self):
+    processor=_processor(0.2)
+    start=time.time()
+    self.assertEqual((1, 1), processor.process({'price':1}))
+    # The write and the publication overlap instead of taking 0.4s one after the other.
+    self.assertLess(time.time()-start, 0.35)
+    processor.close()
+
+  def test_flushAndClose(self):
+    processor=_processor(0.01, workers=2, queueSize=2)
+    futures=[processor.submit({'price':price}) for price in range(10)]
+    processor.flush()
+    self.assertTrue(all(future.done() for future in futures))
+    self.assertEqual(10, len(processor._bucketClient.written))
+    self.assertEqual(10, len(processor._publisher.published))
+    processor.close()
+    self.assertFalse(any(worker.is_alive() for worker in processor._workers))
+    with self.assertRaises(RuntimeError):
+      processor.submit({'price':11})
+
+  def test_seenPerOutputs(self):
+    seen=SeenSet()
+    archive=_processor(0.0, seen=seen, bucket='archive')
+    latest=_processor(0.0, seen=seen, bucket='latest')
+    self.assertEqual((1, 1), archive.process({'price':1}))
+    self.assertEqual((0, 0), archive.process({'price':1}))
+    # Content output by another processor that shares the seen set is still output here.
+    self.assertEqual((1, 1), latest.process({'price':1}))
+    self.assertEqual(2, len(seen))
+    archive.close()
+    latest.close()
+
+  def test_concurrentDuplicates(self):
+    processor=_processor(0.1, seen=SeenSet())
+    futures=[processor.submit({'price':1}) for index in range(3)]
+    # Only the first is output; the others arrive while it is being output.
+    self.assertEqual([(1, 1), (0, 0), (0, 0)], [future.result() for future in futures])
+    self.assertEqual(2, processor.getStats()['duplicates'])
+    processor.close()
+
+  def test_retryFailed(self):
+    processor=_processor(0.0, seen=SeenSet())
+    processor._bucketClient=None
+    self.assertEqual((0, 1), processor.process({'price':1}))
+    # Not output everywhere, so it is not a duplicate the next time.
+    processor._bucketClient=SlowBucket(0.0)
+    self.assertEqual((1, 1), processor.process({'price':1}))
+    processor.close()
+
+  def test_flushWaitsForConfirmation(self):
+    processor=_processor(0.0)
+    processor._publisher.confirmDelay=0.1
+    futures=[processor.submit({'price':price}) for price in range(3)]
+    processor.flush()
+    self.assertEqual(3, len(processor._publisher.published))
+    self.assertEqual([(1, 1)]*3, [future.result(0) for future in futures])
+    processor.close()
+
+  def test_retryUnconfirmed(self):
+    processor=_processor(0.0, seen=SeenSet())
+    processor._publisher.failData=b'price'
+    self.assertEqual((1, 0), processor.process({'price':1}))
+    # Pub/Sub failed to accept the message, so it is output again the next time.
+    processor._publisher.failData=None
+    self.assertEqual((1, 1), processor.process({'price':1}))
+    self.assertEqual((0, 0), processor.process({'price':1}))
+    processor.close()
+
+if __name__=='__main__':
+  unittest.main()
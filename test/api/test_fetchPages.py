@@ -0,0 +1,76 @@
+import json
+import time
+import unittest
+from api.genericRest import fetchPages
+
+_items=list(range(25))
+
+class FakeResponse(object):
+  def __init__(self, data, links=None):
+    self.text=json.dumps(data)
+    self.status_code=200
+    self.links={} if links is None else links
+
+class FakeSession(object):
+  '''
+  Serves _items in pages by offset, by cursor or by Link header, and records every request.
+  '''
+  def __init__(self):
+    self.requests=[]
+
+  def get(self, url, headers=None, params=None, timeout=None):
+    params=dict(params or {})
+    self.requests.append(params)
+    limit=params.get('limit', 10)
+    if 'cursor' in params or url.endswith('/cursor'):
+      start=int(params.get('cursor', 0))
+      end=start+limit
+      return FakeResponse({'items':_items[start:end], 'meta':{'next':str(end) if end<len(_items) else None}})
+    if url.endswith('/link') or '?start=' in url:
+      start=int(url.split('?start=')[1]) if '?start=' in url else 0
+      end=start+limit
+      links={'next':{'url':'https://api.example.com/link?start={end:d}'.format(end=end)}} if end<len(_items) else {}
+      return FakeResponse(_items[start:end], links)
+    start=params.get('offset', 0)
+    if url.endswith('/wrapped'): return FakeResponse({'items':_items[start:start+limit], 'total':len(_items)})
+    return FakeResponse(_items[start:start+limit])
+
+class TestFetchPages(unittest.TestCase):
+  def test_offset(self):
+    session=FakeSession()
+    pages=list(fetchPages('https://api.example.com/offset', pagination={'type':'offset', 'sizeParam':'limit'},
+                          pageSize=10, session=session))
+    self.assertEqual(_items, [item for page in pages for item in page])
+    self.assertEqual([0, 10, 20], [request.get('offset', 0) for request in session.requests])
+
+  def test_itemsField(self):
+    pages=fetchPages('https://api.example.com/wrapped', pagination={'type':'offset', 'itemsField':'items'},
+                     pageSize=10, session=FakeSession())
+    self.assertEqual(_items, [item for page in pages for item in page['items']])
+    # Without itemsField the keys of the page would be counted as items.
+    with self.assertRaises(ValueError):
+      list(fetchPages('https://api.example.com/wrapped', pagination={'type':'offset'}, pageSize=10,
+                      session=FakeSession()))
+
+  def test_cursor(self):
+    pages=fetchPages('https://api.example.com/cursor',
+                     pagination={'type':'cursor', 'cursorField':'meta.next'}, session=FakeSession())
+    self.assertEqual(_items, [item for page in pages for item in page['items']])
+
+  def test_linkAndMaxPages(self):
+    pages=list(fetchPages('https://api.example.com/link', maxPages=2, session=FakeSession()))
+    self.assertEqual(_items[:20], [item for page in pages for item in page])
+
+  def test_prefetch(self):
+    session=FakeSession()
+    pages=fetchPages('https://api.example.com/offset', pagination={'type':'offset'}, pageSize=10, session=session)
+    next(pages)
+    # The second page is requested while the first one is being processed.
+    for attempt in range(100):
+      if len(session.requests)==2: break
+      time.sleep(0.01)
+    self.assertEqual(2, len(session.requests))
+    pages.close()
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from api import genericRest
+from api.genericRest import callAPI
+from api.httpCache import CachingSession, HttpCache
+
+class FakeResponse(object):
+  def __init__(self, status, data=None, headers=None):
+    self.status_code=status
+    self.text='' if data is None else json.dumps(data)
+    self.content=self.text.encode('utf-8')
+    self.headers=headers or {}
+
+  def close(self):
+    pass
+
+class FakeSession(object):
+  '''
+  Serves one version of the data, answering conditional requests for its ETag with a 304.
+  '''
+  def __init__(self):
+    self.version=1
+    self.requests=[]
+
+  def get(self, url, headers=None, params=None, timeout=None):
+    self.requests.append(dict(headers or {}))
+    etag='"v{version:d}"'.format(version=self.version)
+    if (headers or {}).get('If-None-Match')==etag: return FakeResponse(304, headers={'ETag':etag})
+    return FakeResponse(200, {'version':self.version}, headers={'ETag':etag})
+
+  def request(self, method, url, **kwargs):
+    return self.get(url, headers=kwargs.get('headers'), params=kwargs.get('params'))
+
+class FakeBucket(object):
+  def __init__(self, fail):
+    self.fail=fail
+    self.written=[]
+
+  def blob(self, name):
+    bucket=self
+    class Blob(object):
+      def upload_from_string(self, content, content_type=None):
+        if bucket.fail: raise IOError('Cannot write '+name)
+        bucket.written.append(name)
+    return Blob()
+
+class TestHttpCache(unittest.TestCase):
+  def test_revalidate(self):
+    with tempfile.TemporaryDirectory() as directory:
+      fake=FakeSession()
+      session=CachingSession(fake, HttpCache(directory, ttl=0))
+      self.assertEqual(200, session.get('https://api.test/prices').status_code)
+      # Unchanged: revalidated with the ETag and short-circuited.
+      self.assertEqual(304, session.get('https://api.test/prices').status_code)
+      self.assertEqual('"v1"', fake.requests[-1]['If-None-Match'])
+      fake.version=2
+      response=session.get('https://api.test/prices')
+      self.assertEqual({'version':2}, json.loads(response.text))
+      stats=session.cache.getStats()
+      self.assertEqual((3, 1, 1), (stats['requests'], stats['revalidated'], stats['entries']))
+      self.assertEqual(len(b'{"version": 1}'), stats['bytesSaved'])
+
+  def test_ttlAndEviction(self):
+    with tempfile.TemporaryDirectory() as directory:
+      fake=FakeSession()
+      session=CachingSession(fake, HttpCache(directory, ttl=60, maxBytes=2*len(b'{"version": 1}')))
+      for name in ['a', 'b', 'a', 'c']:
+        session.get('https://api.test/'+name)
+      # a is served without a request while it is fresh.
+      self.assertEqual(3, len(fake.requests))
+      self.assertEqual(1, session.cache.getStats()['hits'])
+      # b, the least recently used, is evicted to keep within maxBytes, also after a restart.
+      time.sleep(0.01)
+      restored=HttpCache(directory, ttl=60)
+      self.assertEqual(2, len(restored))
+      self.assertIsNone(restored.lookup(HttpCache.key('https://api.test/b')))
+      self.assertFalse(os.path.exists(os.path.join(directory, HttpCache.key('https://api.test/b')+'.body')))
+
+  def test_discardUnlessOutput(self):
+    with tempfile.TemporaryDirectory() as directory:
+      fake=FakeSession()
+      genericRest._session=fake
+      bucket=FakeBucket(fail=True)
+      processor=genericRest.DataProcessor(bucket='cached', path='prices', bucketClient=bucket)
+      try:
+        callAPI('https://api.test/prices', None, None, None, None, 'cached', 'prices', None, cachePath=directory,
+                processor=processor)
+        # The write failed, so the response is not kept as processed.
+        self.assertEqual(0, len(genericRest._getHttpCache(directory)))
+        bucket.fail=False
+        callAPI('https://api.test/prices', None, None, None, None, 'cached', 'prices', None, cachePath=directory,
+                processor=processor)
+      finally:
+        genericRest._session=None
+        processor.close()
+      self.assertEqual(1, len(bucket.written))
+      self.assertEqual(1, len(genericRest._getHttpCache(directory)))
+
+if __name__=='__main__':
+  unittest.main()
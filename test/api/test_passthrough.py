@@ -0,0 +1,67 @@
+import hashlib
+import unittest
+from api import genericRest
+from api.genericRest import callAPI
+
+class FakeBucket(object):
+  def __init__(self):
+    self.written={}
+
+  def blob(self, name, chunk_size=None):
+    bucket=self
+    class Blob(object):
+      def upload_from_file(self, fileObject, size=None, content_type=None):
+        bucket.written[name]=(fileObject.read(), size, content_type)
+    return Blob()
+
+class FakeResponse(object):
+  def __init__(self, chunks):
+    self.status_code=200
+    self.headers={'Content-Type':'application/json'}
+    self._chunks=chunks
+    self.closed=False
+
+  def iter_content(self, chunk_size=1):
+    return iter(self._chunks)
+
+  def close(self):
+    self.closed=True
+
+class FakeSession(object):
+  def __init__(self, response):
+    self.response=response
+    self.stream=None
+
+  def request(self, method, url, stream=False, **kwargs):
+    self.stream=stream
+    return self.response
+
+class TestPassthrough(unittest.TestCase):
+  def test_streamToBucket(self):
+    chunks=[b'{"prices":[', b'', b'1,2,3', b']}']
+    body=b''.join(chunks)
+    response=FakeResponse(chunks)
+    session=FakeSession(response)
+    genericRest._session=session
+    processor=genericRest.DataProcessor(projectId='project', bucket='bucket', path='archive', bucketClient=FakeBucket())
+    try:
+      callAPI('https://api.test/archive', None, None, 'project', None, 'bucket', 'archive', None, passthrough=True,
+              processor=processor)
+    finally:
+      genericRest._session=None
+    self.assertTrue(session.stream)
+    self.assertTrue(response.closed)
+    # Written as received, named after the SHA-256 of the raw bytes.
+    self.assertEqual({hashlib.sha256(body).hexdigest():(body, len(body), 'application/json')},
+                     processor._bucketClient.written)
+
+  def test_spillToDisk(self):
+    processor=genericRest.DataProcessor()
+    processor._bucket='bucket'
+    processor._bucketClient=FakeBucket()
+    chunks=[bytes([index])*1000 for index in range(10)]
+    self.assertEqual((1, 10000), processor.writeStream(iter(chunks), spoolBytes=100))
+    self.assertEqual(b''.join(chunks), list(processor._bucketClient.written.values())[0][0])
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,62 @@
+import time
+import unittest
+from api.rateLimiter import RateLimitedSession, RateLimiter, _retryAfter
+
+class FakeResponse(object):
+  def __init__(self, status, headers=None):
+    self.status_code=status
+    self.headers=headers or {}
+
+  def close(self):
+    pass
+
+class FakeSession(object):
+  def __init__(self, statuses):
+    self._statuses=list(statuses)
+    self.sent=[]
+
+  def request(self, method, url, **kwargs):
+    self.sent.append(time.time())
+    status, headers=self._statuses.pop(0)
+    return FakeResponse(status, headers)
+
+class TestRateLimiter(unittest.TestCase):
+  def test_retryAfter(self):
+    self.assertEqual(2.0, _retryAfter(FakeResponse(429, {'Retry-After':'2'})))
+    self.assertEqual(0.0, _retryAfter(FakeResponse(429, {'Retry-After':'Wed, 21 Oct 2015 07:28:00 GMT'})))
+    self.assertIsNone(_retryAfter(FakeResponse(429)))
+
+  def test_tokenBucket(self):
+    limiter=RateLimiter(rate=20.0, burst=1)
+    session=RateLimitedSession(FakeSession([(200, None)]*5), limiter)
+    start=time.time()
+    for index in range(5):
+      session.get('https://api.test/prices')
+    # One request at once, then one every 1/20s.
+    self.assertGreaterEqual(time.time()-start, 0.19)
+
+  def test_throttled(self):
+    limiter=RateLimiter(rate=100.0, tries=3, backoff=0.01)
+    fake=FakeSession([(429, {'Retry-After':'0.2'}), (503, None), (200, None)])
+    response=RateLimitedSession(fake, limiter).get('https://api.test/prices')
+    self.assertEqual(200, response.status_code)
+    # The retry waited for Retry-After.
+    self.assertGreaterEqual(fake.sent[1]-fake.sent[0], 0.2)
+    stats=limiter.getStats()
+    self.assertEqual((3, 2, 2), (stats['requests'], stats['throttled'], stats['retries']))
+    # Halved once (the 503 came within the cooldown), then increased by the success.
+    self.assertEqual({'rate':60.0, 'concurrency':2}, stats['hosts']['api.test'])
+
+  def test_positiveRate(self):
+    with self.assertRaises(ValueError):
+      RateLimiter(rate=0)
+    with self.assertRaises(ValueError):
+      RateLimiter(rate=1.0, minRate=0)
+
+  def test_giveUp(self):
+    limiter=RateLimiter(rate=100.0, tries=2, backoff=0.01)
+    response=RateLimitedSession(FakeSession([(500, None), (502, None)]), limiter).get('https://api.test/prices')
+    self.assertEqual(502, response.status_code)
+
+if __name__=='__main__':
+  unittest.main()
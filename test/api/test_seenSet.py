@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from api.genericRest import DataProcessor
+from api.seenSet import SeenSet
+
+class FakeBucket(object):
+  def __init__(self):
+    self.written={}
+
+  def blob(self, name):
+    bucket=self
+    class Blob(object):
+      def upload_from_string(self, content, content_type=None):
+        bucket.written[name]=content
+    return Blob()
+
+class TestSeenSet(unittest.TestCase):
+  def test_lru(self):
+    seen=SeenSet(capacity=2)
+    seen.add('a')
+    seen.add('b')
+    self.assertTrue(seen.contains('a'))
+    seen.add('c')  # Evicts b, the least recently used.
+    self.assertFalse(seen.contains('b'))
+    self.assertTrue(seen.contains('c'))
+    self.assertEqual({'size':2, 'hits':2, 'misses':1}, seen.getStats())
+
+  def test_file(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path=os.path.join(directory, 'seen')
+      seen=SeenSet(capacity=2, path=path)
+      for key in ['a', 'b', 'c', 'd', 'e']:
+        seen.add(key)
+      # The file is compacted once it holds twice the capacity.
+      with open(path) as seenFile:
+        self.assertLessEqual(len(seenFile.readlines()), 4)
+      restored=SeenSet(capacity=2, path=path)
+      self.assertEqual(2, len(restored))
+      self.assertTrue(restored.contains('e'))
+      self.assertFalse(restored.contains('a'))
+
+  def test_dataProcessor(self):
+    processor=DataProcessor(seen=SeenSet())
+    processor._bucket='bucket'
+    processor._bucketClient=FakeBucket()
+    self.assertEqual((1, 0), processor.process({'price':1}))
+    self.assertEqual((0, 0), processor.process({'price':1}))
+    self.assertEqual((1, 0), processor.process({'price':2}))
+    self.assertEqual(2, len(processor._bucketClient.written))
+    self.assertEqual({'duplicates':1, 'queued':0, 'seen':{'size':2, 'hits':1, 'misses':2}}, processor.getStats())
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,79 @@
+import json
+import time
+import unittest
+from common.bufferedWriter import BufferedWriter
+
+class FakeBucket(object):
+  def __init__(self):
+    self.written={}
+    self.fail=False
+
+  def blob(self, name, chunk_size=None):
+    bucket=self
+    class Blob(object):
+      def upload_from_string(self, content, content_type=None):
+        if bucket.fail: raise IOError('upload failed')
+        bucket.written[name]=content
+    return Blob()
+
+def _keys():
+  keys=iter(range(1000))
+  return lambda:'tweets/'+str(next(keys))+'.json'
+
+class TestBufferedWriter(unittest.TestCase):
+  def test_rollOnSize(self):
+    bucket=FakeBucket()
+    writer=BufferedWriter('bucket', _keys(), rollBytes=100, rollSeconds=60, bucketClient=bucket)
+    writer.write([{'id':index, 'text':'x'*20} for index in range(3)])
+    writer.write([{'id':3, 'text':'x'*20}])
+    writer.flush()
+    self.assertEqual(2, len(bucket.written))
+    lines=bucket.written['tweets/0.json'].decode('utf-8').splitlines()
+    self.assertEqual([0, 1, 2], [json.loads(line)['id'] for line in lines])
+    stats=writer.getStats()
+    self.assertEqual((2, 4, 0), (stats['flushes'], stats['records'], stats['bufferedBytes']))
+    self.assertEqual(1, stats['lastFlush']['records'])
+    writer.close()
+
+  def test_onWritten(self):
+    bucket=FakeBucket()
+    writer=BufferedWriter('bucket', _keys(), rollBytes=1000000, rollSeconds=60, bucketClient=bucket)
+    written=[]
+    writer.write([{'id':1}], onWritten=written.append)
+    writer.write([{'id':2}], onWritten=written.append)
+    self.assertEqual([], written)
+    writer.flush()
+    self.assertEqual([True, True], written)
+    bucket.fail=True
+    writer.write([{'id':3}], onWritten=written.append)
+    writer.close()
+    self.assertEqual([True, True, False], written)
+
+  def test_rollOnAge(self):
+    bucket=FakeBucket()
+    writer=BufferedWriter('bucket', _keys(), rollBytes=1000000, rollSeconds=0.1, bucketClient=bucket)
+    writer.write([{'id':1}])
+    self.assertGreater(writer.getStats()['bufferedBytes'], 0)
+    for attempt in range(50):
+      if len(bucket.written)>0: break
+      time.sleep(0.02)
+    self.assertEqual(['tweets/0.json'], list(bucket.written))
+    writer.close()
+
+  def test_encoder(self):
+    class RecordsEncoder(object):
+      lineBased=False
+      contentType='application/json'
+      def encode(self, records):
+        return json.dumps(records).encode('utf-8')
+    bucket=FakeBucket()
+    writer=BufferedWriter('bucket', _keys(), rollBytes=1000000, rollSeconds=60, bucketClient=bucket,
+                          encoder=RecordsEncoder())
+    self.assertEqual(2, writer.write([{'id':1}, {'id':2}]))
+    # Sized from the first record serialized as JSON.
+    self.assertEqual(2*len(b'{"id":1}'), writer.getStats()['bufferedBytes'])
+    writer.close()
+    self.assertEqual([{'id':1}, {'id':2}], json.loads(bucket.written['tweets/0.json'].decode('utf-8')))
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,22 @@
+import json
+import unittest
+from common import serialization
+from common.serialization import Serializer
+
+class TestSerialization(unittest.TestCase):
+  def test_dumps(self):
+    record={'icao24':'abc123', 'origin':'Côte d\'Ivoire', 'altitude':10000.5, 'on_ground':False, 'squawk':None}
+    self.assertIsInstance(serialization.dumps(record), bytes)
+    self.assertEqual(record, json.loads(serialization.dumps(record)))
+    self.assertEqual([record, {'a':1}], [json.loads(line) for line in serialization.dumpLines([record, {'a':1}]).split(b'\n')])
+
+  def test_keyOrder(self):
+    serializer=Serializer()
+    self.assertEqual(b'{"a":1,"b":2,"c":3}', serializer.dumps({'c':3, 'a':1, 'b':2}))
+    self.assertEqual(b'{"a":1,"b":2}', serializer.dumps({'a':1, 'b':2}))
+    serializer=Serializer(keyOrder=['icao24', 'time'])
+    self.assertEqual(b'{"icao24":"x","time":1,"a":2}\n{"icao24":"y"}',
+                     serializer.dumpLines([{'a':2, 'time':1, 'icao24':'x'}, {'icao24':'y'}]))
+
+if __name__=='__main__':
+  unittest.main()
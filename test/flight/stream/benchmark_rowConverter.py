@@ -0,0 +1,25 @@
+# Compares openSkyParser._convertRow (plus the trimming of None fields done by _collectRecords) with the converter
+# compiled by RowConverter on a synthetic snapshot the size of a full OpenSky world snapshot:
+#   PYTHONPATH=~/classResources/python:~/classResources python ~/classResources/test/flight/stream/benchmark_rowConverter.py -size 10000
+import time
+import timeit
+from argparse import ArgumentParser
+
+from flight.stream.rowConverter import RowConverter
+from test.flight.stream.states import convertTrimmed, makeStates
+
+if __name__=='__main__':
+  parser=ArgumentParser(description='Benchmark the schema-compiled row converter against _convertRow.')
+  parser.add_argument('-size',help='The number of state vectors in the snapshot.',default=10000,type=int)
+  parser.add_argument('-repeat',help='The number of times to convert the snapshot.',default=5,type=int)
+  args=parser.parse_args()
+
+  states=makeStates(args.size)
+  queryTime=time.time()
+  converter=RowConverter()
+  baseline=min(timeit.repeat(lambda: [record for record in (convertTrimmed(state, queryTime) for state in states)
+                                      if len(record)>0], number=1, repeat=args.repeat))
+  compiled=min(timeit.repeat(lambda: converter.convertRows(states, queryTime), number=1, repeat=args.repeat))
+  print('_convertRow:  {seconds:.4f}s ({rate:,.0f} rows/s)'.format(seconds=baseline, rate=args.size/baseline))
+  print('RowConverter: {seconds:.4f}s ({rate:,.0f} rows/s)'.format(seconds=compiled, rate=args.size/compiled))
+  print('Speedup:      {speedup:.1f}x'.format(speedup=baseline/compiled))
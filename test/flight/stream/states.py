@@ -0,0 +1,21 @@
+# Synthetic OpenSky snapshots shared by the tests and benchmarks of flight.stream.
+from flight.stream.openSkyParser import _convertRow
+from flight.stream.opensky_api import StateVector
+
+def makeStates(size, now=1600000000):
+  '''
+  :return (list): size StateVectors that look like a full OpenSky snapshot, including some with missing fields.
+  '''
+  states=[]
+  for index in range(size):
+    states.append(StateVector(['{index:06x}'.format(index=index), 'UAL{index:d}  '.format(index=index), 'United States',
+                               now-index%5 if index%7 else None, now-index%3, -80.0+index*1e-4, 40.0+index*1e-4,
+                               10000.0, index%11==0, 230.5, 90.0, 0.0, [index%4+1, 100] if index%4 else None,
+                               10050.0 if index%2 else None, '7000' if index%3 else None, False, 0]))
+  return states
+
+def convertTrimmed(flightState, queryTime):
+  '''
+  :return (dict): the record openSkyParser._convertRow creates, without the fields that are None (see _collectRecords.)
+  '''
+  return dict(filter(lambda item: item[1] is not None, _convertRow(flightState, queryTime).items()))
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+from flight.stream.changeDetector import ChangeDetector
+
+class TestChangeDetector(unittest.TestCase):
+  @staticmethod
+  def _record(latitude=40.0, altitude=1000.0, heading=359.0):
+    return {'icao24':'abc123', 'latitude':latitude, 'longitude':-80.0, 'altitude':altitude, 'velocity':200.0,
+            'heading':heading}
+  
+  def test_filter(self):
+    detector=ChangeDetector()
+    self.assertEqual(1, len(detector.filter([self._record()], 0)))
+    # About 110m north and a 4 degree turn across north are below the default thresholds.
+    self.assertEqual(0, len(detector.filter([self._record(latitude=40.001, heading=3.0)], 10)))
+    self.assertEqual(1, len(detector.filter([self._record(altitude=1200.0)], 20)))
+    self.assertEqual(1, len(detector.filter([self._record(altitude=1200.0)], 20+detector.maxStaleness)))
+    self.assertEqual({'aircraft':1, 'emitted':3, 'suppressed':1, 'evicted':0}, detector.getStats())
+  
+  def test_checkpoint(self):
+    detector=ChangeDetector(positionMeters=50)
+    detector.filter([self._record()], 0)
+    with tempfile.TemporaryDirectory() as directory:
+      path=os.path.join(directory, 'deltas.json')
+      detector.save(path)
+      restored=ChangeDetector.load(path)
+    self.assertEqual(50, restored.positionMeters)
+    self.assertEqual(1, len(restored))
+    self.assertEqual(0, len(restored.filter([self._record()], 10)))
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,156 @@
+import gzip
+import json
+import unittest
+
+from flight.stream.opensky_api import OpenSkyApi
+
+class FakeRaw(object):
+  '''
+  The undecoded body of a response; tell() is the number of bytes read off the wire.
+  '''
+  def __init__(self, size):
+    self._size=size
+  
+  def tell(self):
+    return self._size
+
+class FakeResponse(object):
+  def __init__(self, body, status_code=200):
+    self.status_code=status_code
+    self.reason='OK' if status_code==200 else 'Error'
+    self.url='https://opensky-network.org/api/states/all'
+    self.content=body
+    self.raw=FakeRaw(len(gzip.compress(body)))
+  
+  def iter_content(self, chunk_size=None):
+    for start in range(0, len(self.content), chunk_size):
+      yield self.content[start:start+chunk_size]
+  
+  def close(self):
+    pass
+
+class FakeSession(object):
+  '''
+  Answers every request with the next body and counts the requests as one pooled connection.
+  '''
+  def __init__(self, bodies, pool):
+    self._bodies=list(bodies)
+    self._pool=pool
+    self.requests=[]
+  
+  def get(self, url, **kwargs):
+    self.requests.append((url, kwargs))
+    self._pool.num_requests+=1
+    self._pool.num_connections=1
+    body=self._bodies.pop(0)
+    return FakeResponse(body) if body is not None else FakeResponse(b'', status_code=503)
+
+class FakePool(object):
+  def __init__(self):
+    self.num_connections=0
+    self.num_requests=0
+
+class FakeAdapter(object):
+  def __init__(self, pool):
+    self.poolmanager=type('PoolManager', (object,), {'pools':{'opensky-network.org':pool}})()
+
+def _snapshot(numStates):
+  return {'time':1700000000,
+          'states':[['abc{index:03d}'.format(index=index), 'UAL1  ', 'United States', 1700000000, 1700000001, -87.5,
+                     41.9, 1000.0, False, 200.5, 90.0, -1.0, None, 1050.0, '7000', False, 0]
+                    for index in range(numStates)]}
+
+class TestConnectionStats(unittest.TestCase):
+  def _api(self, bodies):
+    api=OpenSkyApi()
+    pool=FakePool()
+    api._adapter=FakeAdapter(pool)
+    api._session=FakeSession(bodies, pool)
+    return api
+  
+  def test_bytesOnWireAndDecoded(self):
+    body=json.dumps(_snapshot(50)).encode('utf-8')
+    api=self._api([body, body, None])
+    self.assertEqual(50, len(api.get_states().states))
+    api._last_requests.clear()
+    flightStream=api.get_states(stream=True)
+    self.assertEqual(50, len(list(flightStream)))
+    api._last_requests.clear()
+    self.assertIsNone(api.get_states())
+    stats=api.get_connection_stats()
+    self.assertEqual(3, stats['requests'])
+    self.assertEqual(1, stats['connections'])
+    self.assertEqual(2, stats['reused'])
+    # Only the response that was not streamed is counted decoded; all three are counted on the wire.
+    self.assertEqual(len(body), stats['bytes_decoded'])
+    self.assertEqual(2*len(gzip.compress(body))+len(gzip.compress(b'')), stats['bytes_on_wire'])
+    self.assertLess(stats['bytes_on_wire'], 2*len(body))
+  
+  def test_rateLimitedRequestsAreNotSent(self):
+    api=self._api([json.dumps(_snapshot(1)).encode('utf-8')])
+    self.assertIsNotNone(api.get_states())
+    self.assertIsNone(api.get_states())
+    self.assertEqual(1, api.get_connection_stats()['requests'])
+    self.assertEqual(1, len(api._session.requests))
+
+class TestTiles(unittest.TestCase):
+  def _api(self, states):
+    '''
+    :param states: a function of a tile (min_latitude, max_latitude, min_longitude, max_longitude) returning its states.
+    '''
+    api=OpenSkyApi()
+    api.requested=[]
+    def getJson(urlPost, callee, params=None):
+      tile=(params['lamin'], params['lamax'], params['lomin'], params['lomax'])
+      api.requested.append(tile)
+      return {'time':1700000000+len(api.requested), 'states':states(tile)}
+    api._get_json=getJson
+    return api
+  
+  @staticmethod
+  def _state(icao24, lastContact):
+    return [icao24, None, 'Germany', None, lastContact, 10.0, 50.0, None, True, 0, None, None, None, None, None, False, 0]
+  
+  def test_makeTiles(self):
+    self.assertEqual([(0, 10, 0, 10), (0, 10, 10, 20), (10, 20, 0, 10), (10, 20, 10, 20)],
+                     OpenSkyApi._make_tiles([0, 20, 0, 20], (10, 10)))
+    self.assertEqual([(0, 10, -5, 5), (10, 15, -5, 5)], OpenSkyApi._make_tiles([0, 15, -5, 5], (10, 20)))
+    self.assertEqual([], OpenSkyApi._make_tiles([10, 10, 0, 20], (10, 10)))
+    for tileSize in [(0, 10), (10, -1)]:
+      with self.assertRaises(ValueError):
+        OpenSkyApi._make_tiles([0, 20, 0, 20], tileSize)
+    for bbox in [[20, 0, 0, 20], [0, 20, 20, 0]]:
+      with self.assertRaises(ValueError):
+        OpenSkyApi._make_tiles(bbox, (10, 10))
+  
+  def test_mergesTiles(self):
+    # abc is reported by both tiles; the later contact wins.
+    api=self._api(lambda tile: [self._state('abc', 100 if tile[2]==0 else 200), self._state('def'+str(tile[2]), 50)])
+    flightStates=api.get_states_tiled([0, 10, 0, 20], tile_size=10)
+    self.assertEqual(2, len(api.requested))
+    self.assertEqual(1700000002, flightStates.time)
+    contacts=dict((state.icao24, state.last_contact) for state in flightStates.states)
+    self.assertEqual({'abc':200, 'def0':50, 'def10':50}, contacts)
+  
+  def test_rateLimitCountsFromLastTile(self):
+    api=self._api(lambda tile: [])
+    self.assertIsNotNone(api.get_states_tiled([0, 20, 0, 20], tile_size=10))
+    # One interval from the last tile sent, however many tiles there were.
+    self.assertGreater(api.get_states_wait(), 0.9*api.get_states_interval())
+    self.assertLessEqual(api.get_states_wait(), api.get_states_interval())
+    self.assertIsNone(api.get_states_tiled([0, 20, 0, 20], tile_size=10))
+    self.assertEqual(4, len(api.requested))
+  
+  def test_skipsAndReprobesEmptyTiles(self):
+    api=self._api(lambda tile: [self._state('abc', 100)] if tile[0]==0 else [])
+    requested=[]
+    for poll in range(10):
+      api._last_requests.clear()
+      del api.requested[:]
+      api.get_states_tiled([0, 20, 0, 10], tile_size=10, skip_empty_after=3, reprobe_every=3)
+      requested.append(len(api.requested))
+    # The empty tile is requested until it was empty 3 times, then only every third poll.
+    self.assertEqual([2, 2, 2, 1, 1, 2, 1, 1, 2, 1], requested)
+
+if __name__=='__main__':
+  unittest.main()
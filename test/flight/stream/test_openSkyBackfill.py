@@ -0,0 +1,81 @@
+import os
+import tempfile
+import threading
+import unittest
+from flight.stream.openSkyBackfill import OpenSkyBackfill, _parseTime
+from flight.stream.opensky_api import OpenSkyStates
+
+class FakeApi(object):
+  '''
+  Serves one aircraft per historical snapshot, failing for the times in failures.
+  '''
+  def __init__(self, failures=()):
+    self.requested=[]
+    self._failures=set(failures)
+    self._lock=threading.Lock()
+
+  def get_states_wait(self):
+    return 0.0
+
+  def get_states_interval(self):
+    return 0.0
+
+  def get_states(self, time_secs=0, columnar=False):
+    with self._lock: self.requested.append(time_secs)
+    if time_secs in self._failures: return None
+    return OpenSkyStates({'time':time_secs, 'states':[['abc123', 'UAL1', 'United States', time_secs, time_secs,
+                                                        -80.0, 40.0, 10000.0, False, 230.0, 90.0, 0.0, None, 10050.0,
+                                                        None, False, 0]]})
+
+class FakeSinks(object):
+  '''
+  Keeps the records given to it; flush reports a failure unless complete is True.
+  '''
+  def __init__(self, complete=True):
+    self.records=[]
+    self.complete=complete
+    self.numFlushes=0
+
+  def process(self, records, debug=None):
+    self.records.extend(records)
+    return len(records)
+
+  def flush(self):
+    self.numFlushes+=1
+    return self.complete
+
+class TestOpenSkyBackfill(unittest.TestCase):
+  def test_parseTime(self):
+    self.assertEqual(1600000000, _parseTime('1600000000'))
+    self.assertEqual(1600000000, _parseTime('2020-09-13 12:26:40'))
+
+  def test_resume(self):
+    with tempfile.TemporaryDirectory() as directory:
+      checkpoint=os.path.join(directory, 'backfill.json')
+      api=FakeApi(failures=[1600000120])
+      sinks=FakeSinks()
+      stats=OpenSkyBackfill(sinks, 1600000000, 1600000240, step=60, checkpoint=checkpoint, tries=2, api=api).run()
+      self.assertEqual({'snapshots':5, 'completed':4, 'fetched':4, 'failed':1, 'records':4}, stats)
+      self.assertEqual(4, len(sinks.records))
+
+      # The second run only fetches the snapshot that failed.
+      api=FakeApi()
+      stats=OpenSkyBackfill(FakeSinks(), 1600000000, 1600000240, step=60, checkpoint=checkpoint, api=api).run()
+      self.assertEqual([1600000120], api.requested)
+      self.assertEqual(5, stats['completed'])
+
+  def test_checkpointAfterFlush(self):
+    with tempfile.TemporaryDirectory() as directory:
+      checkpoint=os.path.join(directory, 'backfill.json')
+      sinks=FakeSinks(complete=False)
+      stats=OpenSkyBackfill(sinks, 1600000000, 1600000240, step=60, checkpoint=checkpoint, workers=1,
+                            checkpointEvery=2, api=FakeApi()).run()
+      # Flushed after every two snapshots and at the end, and nothing recorded since the outputs failed.
+      self.assertEqual(3, sinks.numFlushes)
+      self.assertEqual((0, 5), (stats['completed'], stats['failed']))
+      api=FakeApi()
+      OpenSkyBackfill(FakeSinks(), 1600000000, 1600000240, step=60, checkpoint=checkpoint, api=api).run()
+      self.assertEqual(5, len(api.requested))
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,227 @@
+import json
+import threading
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+from flight.stream.opensky_api import OpenSkyStates, OpenSkyStateColumns, OpenSkyStatesStream
+import flight.stream.openSkyParser as openSkyParser
+from flight.stream.openSkyParser import Publish, Sinks, _checkSeparateLines, _collectRecords, _getLatestFlightData, \
+  _scavengeRows
+
+class FakePublisherClient(object):
+  '''
+  An in-process stand-in for PublisherClient that confirms messages from a thread pool after a short delay.
+  '''
+  def __init__(self, failEvery=None):
+    self._executor=ThreadPoolExecutor(max_workers=4)
+    self._lock=threading.Lock()
+    self._failEvery=failEvery
+    self.messages=[]
+    self.outstanding=0
+    self.maxOutstanding=0
+  
+  def _confirm(self, future, number):
+    time.sleep(0.001)
+    with self._lock:
+      self.outstanding-=1
+    if self._failEvery is not None and number%self._failEvery==0:
+      future.set_exception(RuntimeError('Failed to publish message #'+str(number)))
+    else:
+      future.set_result(str(number))
+  
+  def publish(self, topic, data=None, **attributes):
+    future=Future()
+    with self._lock:
+      self.messages.append((topic, data, attributes))
+      number=len(self.messages)
+      self.outstanding+=1
+      self.maxOutstanding=max(self.maxOutstanding, self.outstanding)
+    self._executor.submit(self._confirm, future, number)
+    return future
+
+class FakeStreamedResponse(object):
+  '''
+  Mimics a requests response opened with stream=True, handing out the body in small chunks.
+  '''
+  def __init__(self, body, chunkSize=7):
+    self._body=body
+    self._chunkSize=chunkSize
+    self.chunksRead=0
+    self.closed=False
+  
+  def iter_content(self, chunk_size=None):
+    for start in range(0, len(self._body), self._chunkSize):
+      self.chunksRead+=1
+      yield self._body[start:start+self._chunkSize]
+  
+  def close(self):
+    self.closed=True
+
+class FakeStreamingApi(object):
+  '''
+  Returns the given bodies as streamed snapshots, one per request.
+  '''
+  def __init__(self, bodies):
+    self._bodies=list(bodies)
+    self.numRequests=0
+  
+  def get_states_wait(self):
+    return 0
+  
+  def get_states(self, columnar=False, stream=False, bbox=()):
+    self.numRequests+=1
+    return OpenSkyStatesStream(FakeStreamedResponse(self._bodies.pop(0)))
+  
+  def get_connection_stats(self):
+    return {}
+
+class TestOpenSkyParser(unittest.TestCase):
+  _queryTime=1700000005.5
+  
+  @staticmethod
+  def _snapshot():
+    return {'time':1700000000,
+            'states':[['abc123', 'UAL1  ', 'United States', 1700000000, 1700000001, -87.5, 41.9, 1000.0, False,
+                       200.5, 90.0, -1.0, None, 1050.0, '7000', False, 0],
+                      ['def456', None, 'Germany', None, 1700000002, None, None, None, True,
+                       0, None, None, None, None, None, False, 2]]}
+  
+  def test_columnarMatchesRows(self):
+    rows=_collectRecords(OpenSkyStates(self._snapshot()), self._queryTime)
+    columns=_collectRecords(OpenSkyStateColumns(self._snapshot()), self._queryTime)
+    self.assertEqual(rows, columns)
+    self.assertEqual(2, len(columns))
+    self.assertNotIn('time', columns[1])
+  
+  def test_columnarLimit(self):
+    self.assertEqual(1, len(_collectRecords(OpenSkyStateColumns(self._snapshot()), self._queryTime, limit=1)))
+    self.assertEqual(0, len(_collectRecords(OpenSkyStateColumns({'time':1, 'states':None}), self._queryTime)))
+  
+  def test_columnarPadsShortRows(self):
+    snapshot=self._snapshot()
+    # A short row must not cut the fields of the other rows.
+    snapshot['states'][1]=snapshot['states'][1][:12]
+    snapshot['states'][0]=snapshot['states'][0]+['extra']
+    columns=OpenSkyStateColumns(snapshot)
+    self.assertEqual([1050.0, None], columns.column('geo_altitude'))
+    self.assertEqual([0, None], columns.column('position_source'))
+    self.assertEqual([-1.0, None], columns.column('vertical_rate'))
+    self.assertEqual(len(self._snapshot()['states'][0]), len(columns.columns))
+  
+  def test_streamMatchesRows(self):
+    response=FakeStreamedResponse(json.dumps(self._snapshot()).encode('utf-8'))
+    flightStream=OpenSkyStatesStream(response)
+    self.assertEqual(1700000000, flightStream.time)
+    self.assertEqual(_collectRecords(OpenSkyStates(self._snapshot()), self._queryTime),
+                     _collectRecords(flightStream, self._queryTime))
+    self.assertTrue(response.closed)
+  
+  def test_streamStopsAtLimit(self):
+    snapshot=self._snapshot()
+    snapshot['states']=snapshot['states']*100
+    body=json.dumps(snapshot).encode('utf-8')
+    response=FakeStreamedResponse(body, chunkSize=64)
+    self.assertEqual(3, len(_collectRecords(OpenSkyStatesStream(response), self._queryTime, limit=3)))
+    self.assertTrue(response.closed)
+    self.assertLess(response.chunksRead*64, len(body)/10)
+
+  def test_streamOnlyKeepsKnownFields(self):
+    body=json.dumps({'time':1700000000, 'close':1, '_response':None, 'states':None}).encode('utf-8')
+    flightStream=OpenSkyStatesStream(FakeStreamedResponse(body))
+    self.assertEqual(1700000000, flightStream.time)
+    self.assertEqual([], list(flightStream))
+    self.assertIsNotNone(flightStream._response)
+    flightStream.close()
+  
+  def test_streamRejectsColumnar(self):
+    with self.assertRaises(ValueError):
+      _getLatestFlightData(columnar=True, stream=True)
+  
+  def test_truncatedStreamIsRetried(self):
+    snapshot=self._snapshot()
+    snapshot['states']=snapshot['states']*10
+    body=json.dumps(snapshot).encode('utf-8')
+    previous=openSkyParser._api
+    openSkyParser._api=FakeStreamingApi([body[:len(body)//2], body])
+    try:
+      _scavengeRows(stream=True)
+      self.assertEqual(2, openSkyParser._api.numRequests)
+    finally:
+      openSkyParser._api=previous
+
+  def test_sinkErrorsAreNotRetried(self):
+    class FailingSinks(object):
+      def __init__(self, **kwargs):
+        pass
+      def process(self, records, debug=None):
+        raise ValueError('Cannot write.')
+      def flush(self):
+        return True
+    body=json.dumps(self._snapshot()).encode('utf-8')
+    previous=(openSkyParser._api, openSkyParser.Sinks)
+    openSkyParser._api=FakeStreamingApi([body, body])
+    openSkyParser.Sinks=FailingSinks
+    try:
+      with self.assertRaises(ValueError):
+        _scavengeRows(stream=True)
+      self.assertEqual(1, openSkyParser._api.numRequests)
+    finally:
+      openSkyParser._api, openSkyParser.Sinks=previous
+
+class TestSinks(unittest.TestCase):
+  def test_separateLinesNeedsLineFormat(self):
+    class ParquetLike(object):
+      lineBased=False
+      extension='.parquet'
+    with self.assertRaises(ValueError):
+      _checkSeparateLines(True, ParquetLike())
+    _checkSeparateLines(False, ParquetLike())
+    _checkSeparateLines(True, None)
+    Sinks(separateLines=True, bucket='bucket', format='json.gz')
+
+  def test_flushReportsFailures(self):
+    sinks=Sinks(separateLines=True, projectId='project', topic='topic')
+    sinks._publisher=Publish('project', 'topic', separateLines=True, publisher=FakePublisherClient(failEvery=3))
+    records=[{'icao24':'abc{index:03d}'.format(index=index)} for index in range(5)]
+    sinks.process(records[:2])
+    self.assertTrue(sinks.flush())
+    # The third message fails; only the flush after it reports the failure.
+    sinks.process(records[2:4])
+    self.assertFalse(sinks.flush())
+    sinks.process(records[4:])
+    self.assertTrue(sinks.flush())
+
+class TestPublish(unittest.TestCase):
+  _records=[{'icao24':'abc'+str(index), 'velocity':float(index)} for index in range(200)]
+  
+  def test_separateLines(self):
+    client=FakePublisherClient()
+    publisher=Publish('project', 'topic', separateLines=True, maxOutstandingMessages=10, publisher=client)
+    self.assertEqual(200, publisher.process(self._records))
+    self.assertTrue(publisher.flush(timeout=10))
+    self.assertLessEqual(client.maxOutstanding, 10)
+    self.assertEqual(200, len(client.messages))
+    self.assertEqual('projects/project/topics/topic', client.messages[0][0])
+    self.assertEqual(self._records[0], json.loads(client.messages[0][1].decode('utf-8')))
+    stats=publisher.getStats()
+    self.assertEqual(200, stats['published'])
+    self.assertEqual(0, stats['outstandingMessages'])
+  
+  def test_singleMessageAndFailures(self):
+    client=FakePublisherClient(failEvery=2)
+    publisher=Publish('project', 'topic', publisher=client)
+    self.assertEqual(1, publisher.process(self._records))
+    self.assertEqual(1, publisher.process(self._records))
+    self.assertTrue(publisher.flush(timeout=10))
+    self.assertEqual(len(self._records), len(client.messages[0][1].decode('utf-8').split('\n')))
+    self.assertEqual({'published':1, 'failed':1}, dict((key, value) for key, value in publisher.getStats().items()
+                                                      if key in ['published', 'failed']))
+  
+  def test_uniqueKeys(self):
+    publisher=Publish('project', 'topic', publisher=FakePublisherClient())
+    with ThreadPoolExecutor(max_workers=8) as executor:
+      keys=list(executor.map(lambda index: publisher._createKey(), range(1000)))
+    self.assertEqual(1000, len(set(keys)))
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,94 @@
+import threading
+import time
+import unittest
+
+import flight.stream.openSkyParser as openSkyParser
+from flight.stream.openSkyParser import _getLatestFlightData
+from flight.stream.openSkyPoller import OpenSkyPoller
+
+class FakeApi(object):
+  '''
+  Stands in for OpenSkyApi with a client-side rate limit of interval seconds counted from the last response.
+  '''
+  def __init__(self, interval=0.05):
+    self._interval=interval
+    self._lastResponse=time.time()
+    self.refused=0
+
+  def get_states_interval(self):
+    return self._interval
+
+  def get_states_wait(self):
+    return max(0.0, self._lastResponse+self._interval-time.time())
+
+  def get_states(self, **kwargs):
+    if self.get_states_wait()>0:
+      self.refused+=1
+      return None
+    self._lastResponse=time.time()
+    return {'time':int(self._lastResponse), 'states':[]}
+
+  def get_connection_stats(self):
+    return {}
+
+class FakeSinks(object):
+  def getPublishStats(self):
+    return None
+
+class TestOpenSkyPoller(unittest.TestCase):
+  def setUp(self):
+    self._api=openSkyParser._api
+    openSkyParser._api=FakeApi()
+
+  def tearDown(self):
+    openSkyParser._api=self._api
+
+  def test_firstTryWaitsForRateLimit(self):
+    for poll in range(3):
+      self.assertIsNotNone(_getLatestFlightData(tries=1))
+    self.assertEqual(0, openSkyParser._api.refused)
+
+  def test_stopWhileWaiting(self):
+    openSkyParser._api=FakeApi(interval=60)
+    stopped=threading.Event()
+    threading.Timer(0.05, stopped.set).start()
+    start=time.time()
+    self.assertIsNone(_getLatestFlightData(tries=1, stopped=stopped))
+    self.assertLess(time.time()-start, 5)
+    self.assertEqual(0, openSkyParser._api.refused)
+
+  def test_nextWindow(self):
+    poller=OpenSkyPoller(FakeSinks(), interval=10)
+    self.assertEqual(20, poller._nextWindow(20))
+    self.assertEqual(30, poller._nextWindow(20.5))
+    self.assertEqual(30, poller._nextWindow(29.9999999999))
+    # The interval cannot be less than the rate limit window.
+    self.assertEqual(0.05, OpenSkyPoller(FakeSinks(), interval=0.01)._interval)
+
+  def test_backoffBounds(self):
+    poller=OpenSkyPoller(FakeSinks(), interval=10, maxBackoff=60)
+    for failures in range(12):
+      poller._consecutiveFailures=failures
+      for trial in range(50):
+        backoff=poller._backoff()
+        self.assertGreaterEqual(backoff, 10)
+        self.assertLessEqual(backoff, min(60, 10*2**failures)+1e-9)
+
+  def test_accounting(self):
+    poller=OpenSkyPoller(FakeSinks(), interval=0.05)
+    outcomes=[True, False, None, True, True]
+    def poll():
+      outcome=outcomes.pop(0)
+      if outcome is None: raise RuntimeError('Poll failed.')
+      return outcome
+    poller.poll=poll
+    poller._backoff=lambda: 0.0
+    poller.run(maxPolls=5)
+    stats=poller.getStats()
+    self.assertEqual(5, stats['polls'])
+    self.assertEqual(2, stats['failures'])
+    self.assertEqual(0, poller._consecutiveFailures)
+    self.assertEqual(5, poller._lag.count)
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,43 @@
+import gzip
+import io
+import json
+import unittest
+from flight.stream import outputFormats
+from flight.stream.outputFormats import getEncoder, loadSchema
+
+class TestOutputFormats(unittest.TestCase):
+  _records=[{'icao24':'abc123', 'callsign':'UAL1', 'time':1600000000, 'latitude':40.5, 'on_ground':False,
+             'time_bq':'2020-09-13 12:26:40', 'sensors':'[1, 2]'},
+            {'icao24':'def456', 'squawk':7000}]
+
+  def test_schema(self):
+    fields=dict((field['name'], field['type']) for field in loadSchema())
+    self.assertEqual('STRING', fields['icao24'])
+    self.assertEqual('TIMESTAMP', fields['time_bq'])
+    self.assertEqual(('STRING', 'STRING', 'STRING'), (fields['time'], fields['contact'], fields['sensors']))
+
+  def test_gzip(self):
+    encoder=getEncoder('json.gz')
+    self.assertEqual('.json.gz', encoder.extension)
+    lines=gzip.decompress(encoder.encode(self._records)).split(b'\n')
+    self.assertEqual(self._records, [json.loads(line) for line in lines])
+
+  @unittest.skipIf(outputFormats.pyarrow is None, 'pyarrow is not installed.')
+  def test_parquet(self):
+    table=outputFormats.pyarrow.parquet.read_table(io.BytesIO(getEncoder('parquet').encode(self._records)))
+    rows=table.to_pylist()
+    # time is written as a string, the type of the column in the published schema.
+    self.assertEqual('1600000000', rows[0]['time'])
+    self.assertEqual(7000, rows[1]['squawk'])
+    self.assertEqual('[1, 2]', rows[0]['sensors'])
+
+  @unittest.skipIf(outputFormats.fastavro is None, 'fastavro is not installed.')
+  def test_avro(self):
+    rows=list(outputFormats.fastavro.reader(io.BytesIO(getEncoder('avro').encode(self._records))))
+    self.assertEqual('abc123', rows[0]['icao24'])
+    self.assertEqual('1600000000', rows[0]['time'])
+    self.assertEqual(2020, rows[0]['time_bq'].year)
+    self.assertIsNone(rows[1]['time_bq'])
+
+if __name__=='__main__':
+  unittest.main()
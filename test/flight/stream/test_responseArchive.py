@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+import unittest
+from flight.stream.opensky_api import OpenSkyStatesStream
+from flight.stream.responseArchive import RecordingOpenSkyApi, ReplayOpenSkyApi, ResponseArchive
+
+def _body(time):
+  return json.dumps({'time':time, 'states':[['abc123', 'UAL1', 'United States', time, time, -80.0, 40.0, 10000.0,
+                                             False, 230.0, 90.0, 0.0, None, 10050.0, None, False, 0]]}).encode('utf-8')
+
+class FakeResponse(object):
+  def __init__(self, content):
+    self.status_code=200
+    self.content=content
+    self.url='https://opensky-network.org/api/states/all'
+
+class FakeSession(object):
+  def __init__(self, bodies):
+    self._bodies=list(bodies)
+
+  def get(self, url, **kwargs):
+    return FakeResponse(self._bodies.pop(0))
+
+  def close(self):
+    pass
+
+class TestResponseArchive(unittest.TestCase):
+  def test_recordAndReplay(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path=os.path.join(directory, 'opensky')
+      recorder=RecordingOpenSkyApi(path)
+      recorder._session=FakeSession([_body(1600000000), _body(1600000010)])
+      self.assertEqual(1600000000, recorder.get_states().time)
+      recorder._last_requests.clear()
+      self.assertEqual(1600000010, recorder.get_states().time)
+      self.assertEqual(2, len(ResponseArchive(path).entries()))
+
+      replay=ReplayOpenSkyApi(path, speed=1000.0)
+      self.assertEqual(1600000000, replay.get_states().time)
+      # Served through a memory map whether the request is streamed or not.
+      flightStream=replay.get_states(stream=True)
+      self.assertIsInstance(flightStream, OpenSkyStatesStream)
+      self.assertEqual(['abc123'], [state.icao24 for state in flightStream.states])
+      flightStream.close()
+      self.assertIsNone(replay.get_states())
+      replay.close()
+
+  def test_loop(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path=os.path.join(directory, 'opensky')
+      archive=ResponseArchive(path)
+      archive.append('/states/all', {'time':0}, _body(1600000000), recorded=100.0)
+      archive.append('/states/all', {'time':0}, _body(1600000010), recorded=100.5)
+      replay=ReplayOpenSkyApi(path, speed=100.0, loop=True)
+      self.assertEqual([1600000000, 1600000010, 1600000000], [replay.get_states().time for index in range(3)])
+      self.assertEqual(0.1, replay.get_states_interval())
+      replay.close()
+
+if __name__=='__main__':
+  unittest.main()
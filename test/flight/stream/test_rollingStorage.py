@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+import unittest
+from flight.stream.openSkyParser import RollingStorage
+
+class FakeBucket(object):
+  '''
+  Keeps the objects uploaded to it; uploads wait for release to be set and fail for names containing failName.
+  '''
+  def __init__(self, failName=None):
+    self.written={}
+    self.release=threading.Event()
+    self.release.set()
+    self._failName=failName
+    self._lock=threading.Lock()
+  
+  def blob(self, name, chunk_size=None):
+    bucket=self
+    class Blob(object):
+      def upload_from_string(self, content, content_type=None):
+        bucket.release.wait()
+        if bucket._failName is not None and bucket._failName in name: raise IOError('Failed to upload '+name)
+        with bucket._lock: bucket.written[name]=content
+    return Blob()
+  
+  def records(self):
+    return [json.loads(line) for name in sorted(self.written) for line in self.written[name].decode('utf-8').splitlines()]
+
+class TestRollingStorage(unittest.TestCase):
+  _records=[{'icao24':'abc{index:03d}'.format(index=index), 'velocity':float(index)} for index in range(10)]
+  
+  def _storage(self, bucket, **kwargs):
+    return RollingStorage('bucket', folder='flights', bucketClient=bucket, **kwargs)
+  
+  def test_rollOnSize(self):
+    bucket=FakeBucket()
+    storage=self._storage(bucket, rollBytes=100, rollSeconds=60)
+    storage.process(self._records[:2])
+    self.assertEqual(0, len(bucket.written))
+    storage.process(self._records[2:4])
+    storage.flush()
+    self.assertEqual(1, len(bucket.written))
+    self.assertTrue(list(bucket.written)[0].startswith('flights/'))
+    self.assertEqual(self._records[:4], bucket.records())
+    storage.close()
+  
+  def test_rollOnAge(self):
+    bucket=FakeBucket()
+    storage=self._storage(bucket, rollBytes=1000000, rollSeconds=0.1)
+    storage.process(self._records[:1])
+    for attempt in range(50):
+      if len(bucket.written)>0: break
+      time.sleep(0.02)
+    self.assertEqual(self._records[:1], bucket.records())
+    storage.close()
+  
+  def test_flushAndCloseDrain(self):
+    bucket=FakeBucket()
+    storage=self._storage(bucket, rollBytes=50, rollSeconds=60, uploadThreads=2)
+    for record in self._records:
+      storage.process([record])
+    storage.flush()
+    self.assertEqual(self._records, sorted(bucket.records(), key=lambda record: record['velocity']))
+    self.assertEqual(len(bucket.written), storage.getStats()['flushes'])
+    storage.process(self._records[:1])
+    storage.close()
+    storage.close()
+    self.assertEqual(len(self._records)+1, len(bucket.records()))
+  
+  def test_backpressure(self):
+    bucket=FakeBucket()
+    bucket.release.clear()
+    # One upload thread: one object uploading and one waiting; the third roll waits for a slot.
+    storage=self._storage(bucket, rollBytes=1, rollSeconds=60, uploadThreads=1)
+    storage.process(self._records[:1])
+    storage.process(self._records[1:2])
+    third=threading.Thread(target=storage.process, args=(self._records[2:3],))
+    third.start()
+    third.join(0.2)
+    self.assertTrue(third.is_alive())
+    bucket.release.set()
+    third.join(5)
+    self.assertFalse(third.is_alive())
+    storage.close()
+    self.assertEqual(3, storage.getStats()['flushes'])
+  
+  def test_failures(self):
+    bucket=FakeBucket(failName='flights/')
+    storage=self._storage(bucket, rollBytes=1, rollSeconds=60, uploadThreads=4)
+    for record in self._records:
+      storage.process([record])
+    storage.close()
+    stats=storage.getStats()
+    self.assertEqual((0, len(self._records)), (stats['flushes'], stats['failed']))
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,26 @@
+import time
+import unittest
+from flight.stream.opensky_api import StateVector
+from flight.stream.rowConverter import RowConverter
+from test.flight.stream.states import convertTrimmed, makeStates
+
+class TestRowConverter(unittest.TestCase):
+  def test_matchesConvertRow(self):
+    converter=RowConverter()
+    queryTime=time.time()
+    states=makeStates(100)+[StateVector([None]*17)]
+    expected=[convertTrimmed(state, queryTime) for state in states]
+    expected=[record for record in expected if len(record)>0]
+    actual=converter.convertRows(states, queryTime)
+    self.assertEqual(expected, actual)
+    self.assertEqual('[2, 100]', actual[1]['sensors'])
+    # Same field order, so the JSON written is identical.
+    self.assertEqual([list(record) for record in expected], [list(record) for record in actual])
+    self.assertEqual(10, len(converter.convertRows(states, queryTime, limit=10)))
+
+  def test_unknownField(self):
+    with self.assertRaises(ValueError):
+      RowConverter(schema=[{'name':'icao24', 'type':'STRING'}, {'name':'unknown', 'type':'STRING'}])
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from flight.stream.opensky_api import OpenSkyStateColumns, OpenSkyStates
+from flight.stream.trackStore import TrackStore
+
+def _snapshot(time, icao24s):
+  return {'time':time, 'states':[[icao24, 'UAL1', 'United States', time-1, time, -80.0, 40.0+time*1e-3, 10000.0,
+                                  False, 230.0, 90.0, 0.0, None, 10050.0, None, False, 0] for icao24 in icao24s]}
+
+class TestTrackStore(unittest.TestCase):
+  def test_ringBuffer(self):
+    tracks=TrackStore(capacity=3)
+    for time in range(10, 60, 10):
+      tracks.addStates(OpenSkyStates(_snapshot(time, ['abc123'])))
+    # A repeated position report is only kept once.
+    tracks.addStates(OpenSkyStateColumns(_snapshot(50, ['abc123'])))
+    self.assertEqual([29, 39, 49], [position[0] for position in tracks.last('abc123', 5)])
+    self.assertEqual([49], [position[0] for position in tracks.last('abc123')])
+    self.assertEqual([39], [position[0] for position in tracks.window('abc123', 30, 49)])
+    self.assertEqual({'aircraft':1, 'positions':5, 'repeated':1, 'evicted':0},
+                     dict((key, value) for key, value in tracks.getStats().items() if key!='bytes'))
+
+  def test_evict(self):
+    tracks=TrackStore(capacity=100, evictAfter=60)
+    tracks.addStates(OpenSkyStates(_snapshot(10, ['abc123', 'def456'])))
+    tracks.addStates(OpenSkyStates(_snapshot(100, ['def456'])))
+    self.assertEqual([], tracks.last('abc123'))
+    self.assertEqual(1, len(tracks))
+    # 100 positions of 6 doubles, plus the headers.
+    self.assertLess(100*6*8, tracks.bytesPerAircraft())
+    self.assertLess(tracks.memoryUsage(), 2*tracks.bytesPerAircraft())
+
+if __name__=='__main__':
+  unittest.main()
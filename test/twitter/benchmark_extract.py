@@ -0,0 +1,36 @@
+# Compares extracting tweet rows and user rows in two passes over the parsed tweet (extractTweet then extractUsers,
+# serializing the tweet again for "raw") with the single pass of extract over the tweet as received, on a synthetic
+# corpus of tweets where every other tweet is a retweet:
+#   PYTHONPATH=~/classResources/python:~/classResources python ~/classResources/test/twitter/benchmark_extract.py -size 10000
+import json
+import timeit
+from argparse import ArgumentParser
+
+from twitter.twitterParser import MyListener
+from test.twitter.tweets import makeTweet
+
+if __name__=='__main__':
+  parser=ArgumentParser(description='Benchmark the single-pass tweet extraction against extractTweet+extractUsers.')
+  parser.add_argument('-size',help='The number of tweets in the corpus.',default=10000,type=int)
+  parser.add_argument('-repeat',help='The number of times to extract the corpus.',default=5,type=int)
+  args=parser.parse_args()
+
+  corpus=[json.dumps(makeTweet(id, retweet=makeTweet(id+args.size) if id%2==0 else None),
+                     separators=(',', ':')).encode('utf-8')
+          for id in range(args.size)]
+
+  def twoPasses():
+    for raw in corpus:
+      tweet=json.loads(raw)
+      MyListener.extractTweet(tweet, 'zipcar')
+      MyListener.extractUsers(tweet)
+
+  def onePass():
+    for raw in corpus:
+      MyListener.extract(raw, 'zipcar')
+
+  baseline=min(timeit.repeat(twoPasses, number=1, repeat=args.repeat))
+  compiled=min(timeit.repeat(onePass, number=1, repeat=args.repeat))
+  print('extractTweet+extractUsers: {seconds:.4f}s ({rate:,.0f} tweets/s)'.format(seconds=baseline, rate=args.size/baseline))
+  print('extract:                   {seconds:.4f}s ({rate:,.0f} tweets/s)'.format(seconds=compiled, rate=args.size/compiled))
+  print('Speedup:                   {speedup:.1f}x'.format(speedup=baseline/compiled))
@@ -0,0 +1,35 @@
+import json
+import unittest
+from twitter.twitterParser import MyListener
+from test.twitter.tweets import makeTweet
+
+class TestExtract(unittest.TestCase):
+  def test_extract(self):
+    tweet=makeTweet(100, retweet=makeTweet(50))
+    raw=json.dumps(tweet, separators=(',', ':')).encode('utf-8')
+    tweetRows, userRows=MyListener.extract(raw, 'zipcar')
+    self.assertEqual([50, 100], [row['id'] for row in tweetRows])
+    row=tweetRows[1]
+    self.assertEqual((3, 50, ['zipcar'], [3], 'Lafayette, IN', -86.9, 40.4),
+                     (row['user'], row['retweeted_status'], row['hashtags'], row['user_mentions'],
+                      row['place_full_name'], row['longitude'], row['latitude']))
+    self.assertEqual([], row['symbols'])
+    # The text as received is kept; nested tweets are serialized.
+    self.assertEqual(raw.decode('utf-8'), row['raw'])
+    self.assertEqual(tweet['retweeted_status'], json.loads(tweetRows[0]['raw']))
+    # The same users as a separate pass over the tweet finds, in the same order.
+    self.assertEqual(MyListener.extractUsers(tweet), userRows)
+    # A parsed tweet gives the same rows, with raw serialized again.
+    wrapped=MyListener.extractTweet({'data':tweet}, 'zipcar')
+    self.assertEqual(tweet, json.loads(wrapped[1].pop('raw')))
+    row.pop('raw')
+    self.assertEqual(tweetRows, wrapped)
+
+  def test_delimited(self):
+    tweetRows, userRows=MyListener.extract({'data':makeTweet(7)}, 'zipcar', delim='|')
+    self.assertEqual('zipcar', tweetRows[0]['hashtags'])
+    self.assertNotIn('symbols', tweetRows[0])
+    self.assertEqual(['user1', 'user9'], [row['screen_name'] for row in userRows])
+
+if __name__=='__main__':
+  unittest.main()
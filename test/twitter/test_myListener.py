@@ -0,0 +1,61 @@
+import json
+import unittest
+from twitter.twitterParser import MyListener
+from test.twitter.tweets import makeTweet
+
+class FakeBucket(object):
+  def __init__(self, fail=False):
+    self.written={}
+    self.fail=fail
+
+  def blob(self, name, chunk_size=None):
+    bucket=self
+    class Blob(object):
+      def upload_from_string(self, content, content_type=None):
+        if bucket.fail: raise IOError('upload failed')
+        bucket.written[name]=content
+    return Blob()
+
+class TestMyListener(unittest.TestCase):
+  def _listener(self, limit=10):
+    listener=MyListener('token', None, 'zipcar', limit, bucket='tweets', userBucket='users', rollSeconds=60)
+    listener._writer._bucketClient=FakeBucket()
+    listener._userWriter._bucketClient=FakeBucket()
+    return listener
+
+  def test_parseData(self):
+    listener=self._listener()
+    result=listener.parseData(json.dumps(makeTweet(100, retweet=makeTweet(50))))
+    withinLimit, numTweetsStored, numUsersStored, numTweetsPublished, numUsersPublished, writerStats=result
+    # User 9, quoted by both tweets, is only output once (see UserCache.)
+    self.assertEqual((True, 2, 3, 0, 0), result[:5])
+    self.assertGreater(writerStats['tweets']['bufferedBytes'], 0)
+    listener.close()
+    self.assertEqual(1, listener.getWriterStats()['users']['flushes'])
+    self.assertEqual(3, len(list(listener._userWriter._bucketClient.written.values())[0].splitlines()))
+
+  def test_totals(self):
+    listener=self._listener()
+    listener._processTweet(json.dumps(makeTweet(100, retweet=makeTweet(50))))
+    # Users are only remembered once their rows were written.
+    listener._userWriter.flush()
+    listener._processTweet(json.dumps(makeTweet(107)))
+    listener.close()
+    # The second tweet is by user 3 and quotes user 9, both already output.
+    self.assertEqual({'tweets':2, 'tweetsStored':3, 'usersStored':3, 'tweetsPublished':0, 'usersPublished':0},
+                     listener.getTotals())
+
+  def test_rememberOnlyWritten(self):
+    listener=self._listener()
+    listener._userWriter._bucketClient.fail=True
+    listener._processTweet(json.dumps(makeTweet(100, retweet=makeTweet(50))))
+    listener._userWriter.flush()
+    listener._userWriter._bucketClient.fail=False
+    listener._processTweet(json.dumps(makeTweet(107)))
+    listener.close()
+    # The users of the first tweet failed to be written, so users 3 and 9 are output again.
+    self.assertEqual(5, listener.getTotals()['usersStored'])
+    self.assertEqual(2, listener.getUserCacheStats()['size'])
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from twitter.tweetQueue import TweetQueue
+from twitter.twitterParser import MyListener
+from test.twitter.tweets import makeTweet
+
+class Handler(object):
+  '''
+  Records the payloads it processes, holding them until released.
+  '''
+  def __init__(self):
+    self.processed=[]
+    self.release=threading.Event()
+
+  def __call__(self, payload):
+    self.release.wait(5)
+    if payload=='bad': raise ValueError('Cannot parse.')
+    self.processed.append(payload)
+
+class TestTweetQueue(unittest.TestCase):
+  def test_dropOldest(self):
+    handler=Handler()
+    tweetQueue=TweetQueue(handler, workers=1, capacity=2, overflow='dropOldest')
+    tweetQueue.put('a')
+    # Wait for the worker to take a, then fill the queue and overflow it.
+    while tweetQueue.getStats()['depth']>0: time.sleep(0.01)
+    for payload in ['b', 'c', 'd']:
+      tweetQueue.put(payload)
+    stats=tweetQueue.getStats()
+    self.assertEqual((2, 1), (stats['depth'], stats['dropped']))
+    handler.release.set()
+    tweetQueue.close()
+    self.assertEqual(['a', 'c', 'd'], handler.processed)
+
+  def test_spill(self):
+    with tempfile.TemporaryDirectory() as directory:
+      spillPath=os.path.join(directory, 'tweets.spill')
+      handler=Handler()
+      tweetQueue=TweetQueue(handler, workers=1, capacity=1, overflow='spill', spillPath=spillPath)
+      for payload in ['a', 'b', b'c', 'bad', 'e']:
+        tweetQueue.put(payload)
+      stats=tweetQueue.getStats()
+      self.assertGreaterEqual(stats['spilled'], 3)
+      self.assertTrue(os.path.exists(spillPath))
+      handler.release.set()
+      tweetQueue.join()
+      # In the order received, with the failure counted rather than stopping the workers.
+      self.assertEqual(['a', 'b', 'c', 'e'], handler.processed)
+      stats=tweetQueue.getStats()
+      self.assertEqual((4, 1, 0), (stats['processed'], stats['failed'], stats['spilled']))
+      self.assertFalse(os.path.exists(spillPath))
+      tweetQueue.close()
+
+  def test_recoverSpill(self):
+    with tempfile.TemporaryDirectory() as directory:
+      spillPath=os.path.join(directory, 'tweets.spill')
+      lines=[json.dumps({'received':time.time(), 'payload':payload})+'\n' for payload in ['a', 'b', 'c']]
+      lines.insert(2, '{"received":\n')
+      with open(spillPath, 'w') as spillFile:
+        spillFile.write(''.join(lines))
+      # A previous run took a out before it stopped.
+      with open(spillPath+'.offset', 'w') as offsetFile:
+        offsetFile.write(str(len(lines[0])))
+      handler=Handler()
+      handler.release.set()
+      tweetQueue=TweetQueue(handler, workers=1, capacity=1, overflow='spill', spillPath=spillPath)
+      tweetQueue.join()
+      # The corrupt line is counted as failed rather than stopping the worker.
+      self.assertEqual(['b', 'c'], handler.processed)
+      stats=tweetQueue.getStats()
+      self.assertEqual((2, 1), (stats['processed'], stats['failed']))
+      self.assertFalse(os.path.exists(spillPath+'.offset'))
+      tweetQueue.close()
+
+  def test_onTweet(self):
+    listener=MyListener('token', None, 'zipcar', 2, workers=2)
+    disconnected=threading.Event()
+    listener.disconnect=disconnected.set
+    for id in range(3):
+      self.assertTrue(listener.on_tweet(json.dumps(makeTweet(id))))
+    listener.close()
+    self.assertEqual(3, listener.getTotals()['tweets'])
+    self.assertTrue(disconnected.is_set())
+    self.assertEqual(3, listener.getQueueStats()['processed'])
+
+if __name__=='__main__':
+  unittest.main()
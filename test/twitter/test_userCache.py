@@ -0,0 +1,47 @@
+import json
+import unittest
+from twitter.twitterParser import MyListener
+from twitter.userCache import UserCache
+from test.twitter.tweets import makeTweet, makeUser
+
+class TestUserCache(unittest.TestCase):
+  def _output(self, userCache, userData):
+    changed=userCache.changed(userData)
+    if changed: userCache.remember([userData])
+    return changed
+
+  def test_changed(self):
+    userCache=UserCache(['id', 'name', 'followers_count'], capacity=2)
+    self.assertTrue(self._output(userCache, makeUser(1)))
+    self.assertFalse(self._output(userCache, makeUser(1)))
+    # Fields that are not compared do not count as a change.
+    self.assertFalse(self._output(userCache, dict(makeUser(1), profile_image_url='https://example.com/new.png')))
+    self.assertTrue(self._output(userCache, dict(makeUser(1), followers_count=11)))
+    self.assertTrue(self._output(userCache, makeUser(2)))
+    self.assertTrue(self._output(userCache, makeUser(3)))  # Evicts user 1, the least recently used.
+    self.assertTrue(self._output(userCache, dict(makeUser(1), followers_count=11)))
+    self.assertEqual({'size':2, 'suppressed':2, 'misses':4, 'changed':1, 'hitRate':2/7}, userCache.getStats())
+
+  def test_onlyRemembersOutput(self):
+    userCache=UserCache(['id', 'name', 'followers_count'])
+    self.assertTrue(userCache.changed(makeUser(1)))
+    # The row was not output, e.g. the write failed.
+    self.assertTrue(userCache.changed(makeUser(1)))
+    userCache.remember([MyListener._extractUser(makeUser(1))])
+    self.assertFalse(userCache.changed(makeUser(1)))
+
+  def test_extract(self):
+    userCache=UserCache(MyListener._userFields)
+    tweet=makeTweet(100, retweet=makeTweet(50))
+    tweetRows, userRows=MyListener.extract(json.dumps(tweet), 'zipcar', userCache=userCache)
+    # Both tweets quote a tweet by user 9: one row for it.
+    self.assertEqual([3, 9, 2], [row['id'] for row in userRows])
+    self.assertEqual(2, len(tweetRows))
+    userCache.remember(userRows)
+    tweetRows, userRows=MyListener.extract(json.dumps(makeTweet(107)), 'zipcar', userCache=userCache)
+    # By user 3 and quoting user 9, both unchanged since they were output.
+    self.assertEqual([], userRows)
+    self.assertEqual(2, userCache.getStats()['suppressed'])
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,22 @@
+# Synthetic tweets and users shared by the tests and benchmarks of the twitter package.
+def makeUser(id):
+  '''
+  :return: a synthetic user in the format of the Twitter streaming API.
+  '''
+  return {'id':id, 'id_str':str(id), 'name':'User '+str(id), 'screen_name':'user'+str(id), 'location':None,
+          'followers_count':id*10, 'profile_image_url':'https://example.com/'+str(id)+'.png'}
+
+def makeTweet(id, retweet=None):
+  '''
+  :return: a synthetic tweet in the format of the Twitter streaming API.
+  '''
+  tweet={'created_at':'Wed Oct 10 20:19:24 +0000 2018', 'id':id, 'id_str':str(id), 'text':'Tweet '+str(id),
+         'user':makeUser(id%7+1),
+         'place':{'name':'Lafayette', 'full_name':'Lafayette, IN', 'country_code':'US', 'id':'x'},
+         'coordinates':{'type':'Point', 'coordinates':[-86.9, 40.4]}, 'geo':None,
+         'entities':{'hashtags':[{'text':'zipcar', 'indices':[0, 7]}], 'urls':[],
+                     'user_mentions':[{'id':3, 'screen_name':'user3'}]},
+         'quoted_status':{'id':id-1, 'user':makeUser(9)}, 'retweet_count':id%5, 'lang':'en',
+         'timestamp_ms':'1539202764000'}
+  if retweet is not None: tweet['retweeted_status']=retweet
+  return tweet